@@ -3,18 +3,59 @@ Saga AI Microservice
 HuggingFace Spaces üzerinde çalışacak semantic search + LLM servisi
 """
 
+import io
 import os
+import re
+import sys
 import json
+import time
+import gzip
+import zlib
+import struct
+import heapq
+import bisect
+import hashlib
+import random
+import pstats
+import cProfile
+import itertools
+import shutil
+import asyncio
+import weakref
+import threading
+from contextlib import asynccontextmanager
+from collections import Counter, OrderedDict, deque
+from contextvars import ContextVar, copy_context
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import httpx
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+from typing import Dict, Iterator, List, Literal, Optional, Tuple, Type, Union
+from functools import lru_cache
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, Response
+from pydantic import BaseModel, ValidationError
 from sentence_transformers import SentenceTransformer
 import faiss
 from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
 import torch
+from starlette.datastructures import MutableHeaders
+
+try:
+    import orjson  # Opsiyonel: hızlı JSON serileştirme
+except ImportError:
+    orjson = None
+
+try:
+    import brotli  # Opsiyonel: br sıkıştırma (yoksa sadece gzip)
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack  # Opsiyonel: MessagePack istek/cevap gövdeleri
+except ImportError:
+    msgpack = None
 
 # FastAPI app
 app = FastAPI(
@@ -32,16 +73,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Embedding modeli (ayarlanabilir); index metadata'sında model adı ve boyut saklanır
+EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+LEGACY_EMBEDDING_MODEL = "all-MiniLM-L6-v2"  # index_meta.json olmayan eski index'ler bununla kuruldu
+INDEX_META_PATH = "index_meta.json"
+
 # Global değişkenler
 model: SentenceTransformer = None
+model_name: str = EMBEDDING_MODEL_NAME  # Şu an servis veren embedding modeli
 index: faiss.IndexFlatIP = None
 content_data: List[dict] = []
+tur_positions: Dict[str, np.ndarray] = {}  # tür -> index pozisyonları (filtreli arama için)
+title_positions: Dict[str, List[int]] = {}  # normalize başlık -> index pozisyonları
+bm25_index = None  # BM25Index (lexical arama)
+prefix_index = None  # TitlePrefixIndex (autocomplete)
+id_positions: Dict[int, int] = {}  # ContentItem.id -> index pozisyonu
+position_keys: List[Tuple[str, str]] = []  # pozisyon -> (tür, normalize başlık); artımlı güncellemede eski anahtarlar
+index_generation = 0  # Index her değiştiğinde artar
+index_reserve: tuple = (lambda: None, 0)  # (kapasitesi ayrılmış index'e zayıf referans, kapasite)
 
 # Groq API - Ücretsiz, çok hızlı, çok akıllı!
 # llama-3.3-70b-versatile: 30 req/min, 1K req/day, 12K tokens/min
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")
 GROQ_MODEL = "llama-3.3-70b-versatile"  # En akıllı model!
+GROQ_API_URL = os.environ.get("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")  # Test/benchmark için mock sunucu verilebilir
 USE_GROQ = bool(GROQ_API_KEY)
+GROQ_RPM = int(os.environ.get("GROQ_RPM", "30"))  # Dakikalık istek bütçesi
+GROQ_TPM = int(os.environ.get("GROQ_TPM", "12000"))  # Dakikalık token bütçesi
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "4"))  # Aynı anda çalışan LLM çağrısı
+llm_in_flight = 0
 
 # Lokal model (Groq yoksa fallback)
 LLM_MODEL_NAME = "Qwen/Qwen2.5-3B-Instruct"
@@ -54,6 +114,12 @@ class SearchRequest(BaseModel):
     query: str
     limit: int = 5
     tur: Optional[str] = None  # film, dizi, kitap
+    lexical_weight: Optional[float] = None  # BM25 ağırlığı (0-1), None ise varsayılan
+    field_weights: Optional[Dict[str, float]] = None  # "genel", "baslik", "aciklama" alan ağırlıkları
+    field_aggregation: Literal["sum", "max"] = "sum"  # Alan skorlarını birleştirme: "sum" (ağırlıklı) veya "max"
+    rerank: Optional[bool] = None  # Cross-encoder yeniden sıralama, None ise RERANK_ENABLED
+    diversity: float = 0.0  # MMR çeşitlilik katsayısı (0 = sadece alaka)
+    cursor: Optional[str] = None  # Önceki sayfanın next_cursor'ı
 
 class ContentItem(BaseModel):
     id: int
@@ -63,6 +129,7 @@ class ContentItem(BaseModel):
     yil: Optional[int] = None
     posterUrl: Optional[str] = None
     puan: Optional[float] = None
+    populerlik: Optional[float] = None  # Opsiyonel popülerlik sinyali (ör. kütüphane sayısı)
 
 class SearchResult(BaseModel):
     id: int
@@ -74,20 +141,74 @@ class SearchResult(BaseModel):
     puan: Optional[float] = None
     score: float
     neden: str  # Neden bu sonuç döndü
+    rerank_score: Optional[float] = None  # Cross-encoder skoru (yeniden sıralama uygulandıysa)
 
 class SearchResponse(BaseModel):
     results: List[SearchResult]
     query: str
     total: int
+    next_cursor: Optional[str] = None  # Sonraki sayfa için; None ise başka sonuç yok
+
+class AutocompleteItem(BaseModel):
+    id: int
+    baslik: str
+    tur: str
+    yil: Optional[int] = None
+    posterUrl: Optional[str] = None
+    puan: Optional[float] = None
+
+class AutocompleteResponse(BaseModel):
+    query: str
+    suggestions: List[AutocompleteItem]
+
+class SimilarResponse(BaseModel):
+    id: int
+    results: List[SearchResult]
+    total: int
+    source: str  # "table" (önceden hesaplanmış) veya "search"
+
+class SimilarBatchRequest(BaseModel):
+    ids: List[int]
+    limit: int = 10
+    tur: Optional[str] = None
+
+class SimilarBatchResponse(BaseModel):
+    results: Dict[int, List[SearchResult]]
+    missing: List[int]  # Index'te bulunmayan id'ler
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+    normalize: bool = True  # L2 normalize (cosine için)
+    pooling: str = "model"  # model (modelin kendi pooling'i, aramayla aynı), mean, max, cls
+    dtype: str = "float32"  # float32, float16, int8
+
+class EmbedResponse(BaseModel):
+    embeddings: List[List[float]]
+    dimension: int
+    model: str
+    pooling: str
+    dtype: str
+    normalized: bool
+    token_counts: List[int]  # Kırpılmadan önceki token sayısı
+    truncated: List[int]  # max_seq_length'i aşıp kırpılan metinlerin sırası
+    max_seq_length: int
+    scales: Optional[List[float]] = None  # int8: vektör = değerler * scale
 
 class IndexRequest(BaseModel):
     contents: List[ContentItem]
+    mode: str = "replace"  # "replace": tüm index'i yeniden kur, "upsert": sadece verilenleri ekle/güncelle
 
 class HealthResponse(BaseModel):
     status: str
     model_loaded: bool
     index_size: int
     llm_loaded: bool
+    embedding_model: Optional[str] = None
+    shard_count: int = 0  # Aktif shard süreci sayısı (0 = tek süreçte arama)
+    snapshot: Optional[str] = None  # Paylaşımlı index modunda kullanılan nesil
+
+class MigrateRequest(BaseModel):
+    model: str  # Yeni embedding modeli, ör. "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 
 
 # LLM için yeni modeller
@@ -105,7 +226,10 @@ class GenerateResponse(BaseModel):
 
 class RecommendRequest(BaseModel):
     query: str
-    user_history: Optional[List[str]] = None  # Kullanıcının izlediği/okuduğu şeyler
+    user_history: Optional[List[str]] = None  # Kullanıcının izlediği/okuduğu şeyler (en yeni başta)
+    history_ratings: Optional[List[float]] = None  # user_history ile aynı sırada puanlar (0-10, opsiyonel)
+    history_weight: float = 0.5  # Zevk profilinin sorguya karışma oranı (0-1)
+    diversity: float = 0.3  # MMR çeşitlilik katsayısı (0 = sadece alaka)
     tur: Optional[str] = None
     limit: int = 5
 
@@ -146,6 +270,17 @@ class IdentifyResponse(BaseModel):
     search_query: str  # TMDB/Google Books araması için önerilen sorgu
 
 
+class IdentifyLLMOutput(BaseModel):
+    """/identify prompt'unun istediği JSON"""
+    found: bool = True
+    title: str = ""
+    title_en: Optional[str] = None
+    tur: str = "film"
+    year: Optional[int] = None
+    explanation: str = ""
+    confidence: float = 0.7
+
+
 # ===== YENİ: Genel AI Chat Modelleri =====
 class ChatMessage(BaseModel):
     role: str  # "user", "assistant", "system"
@@ -187,13 +322,519 @@ class AssistantResponse(BaseModel):
     action_data: Optional[dict] = None  # Aksiyon için ek veri
     suggestions: Optional[List[str]] = None
 
+class AssistantIdentifyOutput(BaseModel):
+    """Asistanın içerik tanımlama modundaki JSON"""
+    found: bool = False
+    title: str = ""
+    title_en: Optional[str] = None
+    content_type: str = "film"
+    message: Optional[str] = None
+
+
+# ===== Metrikler (Prometheus) =====
+# /metrics Prometheus text formatında sunulur. Sıcak yolda ölçüm sadece sabit bucket
+# dizisinde sayaç artırır; metin sadece scrape sırasında üretilir.
+# Çok worker'da (SHARED_INDEX_DIR) her worker kendi metriklerini tutar.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class MetricHistogram:
+    """Tek etiketli histogram; seri başına [bucket sayıları..., +Inf, toplam süre]"""
+
+    def __init__(self, name: str, help_text: str, label_name: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help_text, self.label_name, self.buckets = name, help_text, label_name, buckets
+        self.series: Dict[str, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label: str, value: float):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                series = self.series[label] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            snapshot = {label: list(series) for label, series in self.series.items()}
+        for label, series in sorted(snapshot.items()):
+            selector = f'{self.label_name}="{label}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{selector},le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{selector},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{selector}}} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{selector}}} {cumulative}")
+        return lines
+
+
+class MetricCounter:
+    """Etiket demeti başına artan sayaç"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name, self.help_text, self.label_names = name, help_text, label_names
+        self.values: Dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            snapshot = dict(self.values)
+        for labels, value in sorted(snapshot.items()):
+            selector = ",".join(f'{name}="{label}"' for name, label in zip(self.label_names, labels))
+            lines.append(f"{self.name}{{{selector}}} {value:g}" if selector else f"{self.name} {value:g}")
+        return lines
+
+
+STAGE_SECONDS = MetricHistogram("saga_stage_duration_seconds", "İstek aşamalarının süresi", "stage")
+REQUEST_SECONDS = MetricHistogram("saga_request_duration_seconds", "Endpoint bazında istek süresi", "endpoint")
+REQUESTS_TOTAL = MetricCounter("saga_requests_total", "Endpoint ve HTTP durum koduna göre istekler", ("endpoint", "status"))
+CACHE_REQUESTS = MetricCounter("saga_cache_requests_total", "Cache sorguları", ("cache", "result"))
+GROQ_RESPONSES = MetricCounter("saga_groq_responses_total", "Groq API cevapları (429 = rate limit, error = bağlantı hatası)", ("status",))
+FALLBACKS = MetricCounter("saga_fallback_total", "LLM yerine yedek cevap kullanımı", ("endpoint",))
+
+requests_in_flight = 0
+
+
+def run_in_executor(executor, func, *args) -> asyncio.Future:
+    """loop.run_in_executor + istek bağlamı: thread'de ölçülen aşamalar da Server-Timing'e girer"""
+    return asyncio.get_running_loop().run_in_executor(executor, copy_context().run, func, *args)
+
+
+def observe_stage(stage: str, started: float):
+    """perf_counter() ile alınan başlangıçtan itibaren geçen süreyi aşama histogramına yaz"""
+    elapsed = time.perf_counter() - started
+    STAGE_SECONDS.observe(stage, elapsed)
+    stages = request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + elapsed
+
+
+class MetricsMiddleware:
+    """Saf ASGI middleware: endpoint süresi, durum kodu ve eşzamanlı istek sayısı"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global requests_in_flight
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            requests_in_flight -= 1
+            # Router eşleşen endpoint'i scope'a yazar; etiket sayısı route sayısıyla sınırlı kalır
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            REQUEST_SECONDS.observe(endpoint, time.perf_counter() - started)
+            REQUESTS_TOTAL.inc(endpoint, str(status))
+
+
+app.add_middleware(MetricsMiddleware)
+
+
+# ===== HTTP Yanıtları (sıkıştırma, ETag, ikili formatlar) =====
+# Arama sonuçları sadece index değişince değişir. Cevaplar index sürümü + istek anahtarından
+# türetilen ETag taşır; If-None-Match eşleşirse arama hiç yapılmadan 304 döner. Eşikten büyük
+# gövdeler istemcinin kabul ettiği en iyi kodlamayla (br > gzip) sıkıştırılır.
+# Backend Accept/Content-Type ile JSON yerine MessagePack (vektörler için ham little-endian
+# float32) konuşabilir; JSON varsayılan kalır.
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))  # 0 = sıkıştırma kapalı
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "4"))  # 11 çok yavaş; 4-5 gzip'ten hem küçük hem hızlı
+ETAG_ENABLED = os.environ.get("ETAG_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_CONTROL = "no-cache"  # Saklanabilir ama her kullanımda ETag ile doğrulanmalı
+COMPRESSIBLE_TYPES = ("application/json", "application/msgpack", "text/")
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+MSGPACK_TYPES = (MSGPACK_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+RAW_VECTOR_TYPE = "application/octet-stream"  # Ham little-endian vektör dizisi
+process_epoch = f"{os.getpid()}-{time.time_ns()}"  # Paylaşımlı nesil yoksa ETag'ler süreçle sınırlı
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Accept-Encoding'e göre kullanılacak kodlama (q=0 reddedilmiş sayılır)"""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """Saf ASGI middleware: eşikten büyük tek parça JSON/metin cevaplarını br veya gzip ile sıkıştırır"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or COMPRESS_MIN_BYTES <= 0:
+            await self.app(scope, receive, send)
+            return
+        request_headers = dict(scope.get("headers") or [])
+        encoding = negotiate_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # Gövdenin boyutu görülene kadar başlıklar bekletilir
+                start_message = message
+                return
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(scope=start)
+            if (
+                message.get("more_body")
+                or len(body) < COMPRESS_MIN_BYTES
+                or "content-encoding" in headers
+                or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            ):
+                await send(start)
+                await send(message)
+                return
+            started = time.perf_counter()
+            body = compress_body(body, encoding)
+            observe_stage("compress", started)
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+app.add_middleware(CompressionMiddleware)
+
+
+def index_version() -> str:
+    """ETag'lerin dayandığı index sürümü: paylaşımlı nesil adı veya süreç epoch'u + sayaç"""
+    if SHARED_INDEX_DIR and snapshot_generation:
+        return snapshot_generation
+    return f"{process_epoch}:{index_generation}"
+
+
+def response_etag(key: str, media_type: str = JSON_TYPE) -> Optional[str]:
+    if not ETAG_ENABLED:
+        return None
+    digest = hashlib.sha1(f"{index_version()}|{media_type}|{key}".encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """If-None-Match zayıf karşılaştırması (W/ öneki yok sayılır)"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def negotiate_media_type(accept: Optional[str], raw_vectors: bool = False) -> str:
+    """Accept başlığına göre cevap tipi: JSON (varsayılan), MessagePack veya ham vektör dizisi"""
+    if not accept:
+        return JSON_TYPE
+    offers = []
+    for order, part in enumerate(accept.lower().split(",")):
+        media_type, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            offers.append((-quality, order, media_type.strip()))
+    for _, _, media_type in sorted(offers):
+        if media_type in (JSON_TYPE, "*/*", "application/*"):
+            return JSON_TYPE
+        if media_type in MSGPACK_TYPES and msgpack is not None:
+            return MSGPACK_TYPE
+        if media_type == RAW_VECTOR_TYPE and raw_vectors:
+            return RAW_VECTOR_TYPE
+    return JSON_TYPE
+
+
+def msgpack_default(value):
+    """MessagePack'in bilmediği tipler: numpy dizileri ham little-endian bayt (float64 -> float32), skalerler Python sayısı"""
+    if isinstance(value, np.ndarray):
+        dtype = np.dtype("<f4") if value.dtype == np.float64 else value.dtype.newbyteorder("<")
+        return value.astype(dtype, copy=False).tobytes()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"MessagePack'e çevrilemeyen tip: {type(value).__name__}")
+
+
+def encoded_response(content, etag: Optional[str] = None, media_type: str = JSON_TYPE) -> Response:
+    """response_model doğrulamasını atlayan hızlı cevap (JSON veya MessagePack)"""
+    if media_type == MSGPACK_TYPE:
+        data = content.model_dump() if isinstance(content, BaseModel) else content
+        body = msgpack.packb(data, use_bin_type=True, use_single_float=True, default=msgpack_default)
+    elif isinstance(content, BaseModel):
+        body = content.model_dump_json().encode("utf-8")
+    elif orjson is not None:
+        body = orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    headers = {"Vary": "Accept"}
+    if etag:
+        headers.update({"ETag": etag, "Cache-Control": RESPONSE_CACHE_CONTROL})
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def not_modified(etag: str) -> Response:
+    CACHE_REQUESTS.inc("etag", "hit")
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": RESPONSE_CACHE_CONTROL, "Vary": "Accept"})
+
+
+class MessagePackRequest(Request):
+    """MessagePack gövdeyi FastAPI'ye JSON metnine çevirmeden doğrudan obje olarak verir"""
+
+    async def json(self):
+        if not hasattr(self, "_json"):
+            self._json = msgpack.unpackb(await self.body(), raw=False)
+        return self._json
+
+
+class BinaryBodyRoute(APIRoute):
+    """Content-Type MessagePack ise gövde msgpack ile çözülür, sonra normal pydantic doğrulamasından geçer"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request):
+            content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+            if content_type in MSGPACK_TYPES:
+                if msgpack is None:
+                    raise HTTPException(status_code=415, detail="MessagePack desteği kurulu değil (msgpack paketi)")
+                scope = dict(request.scope)
+                scope["headers"] = [(k, v) for k, v in request.scope["headers"] if k != b"content-type"]
+                scope["headers"].append((b"content-type", JSON_TYPE.encode("latin-1")))
+                request = MessagePackRequest(scope, request.receive)
+            return await handler(request)
+
+        return route_handler
+
+
+# Bundan sonra tanımlanan tüm endpoint'ler MessagePack gövde kabul eder
+app.router.route_class = BinaryBodyRoute
+
+
+# ===== Profiling (opsiyonel) =====
+# PROFILE_SAMPLE_RATE oranındaki istekler ve PROFILE_SLOW_MS'yi aşan istekler profillenir,
+# son PROFILE_BUFFER_SIZE profil bellekte tutulur (/admin/profiles).
+# "sampler" modunda tek bir arka plan thread'i tüm thread'lerin yığınını örnekler; örnekler
+# o sırada izlenen her isteğe eklenir. Event loop ortak olduğu için aynı anda çalışan diğer
+# isteklerin işi de profilde görünür. Event loop'un select'te beklemesi I/O (ör. Groq) demektir.
+# "cprofile" modunda aynı anda tek istek profillenir ve sadece event loop thread'i ölçülür.
+# SERVER_TIMING=true ise aşama süreleri Server-Timing başlığında döner.
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))  # 0 = kapalı
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))  # 0 = kapalı
+PROFILE_MODE = os.environ.get("PROFILE_MODE", "sampler").lower()  # "sampler" veya "cprofile"
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_BUFFER_SIZE = int(os.environ.get("PROFILE_BUFFER_SIZE", "50"))
+PROFILE_MAX_STACKS = 200  # Profil başına saklanan en sık yığın sayısı
+PROFILE_SKIP_PATHS = ("/metrics", "/admin/")
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "false").lower() == "true"
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")  # /admin/* X-Admin-Token başlığı ister; boşsa kapalı
+PROFILING_ENABLED = PROFILE_SAMPLE_RATE > 0 or (PROFILE_SLOW_MS > 0 and PROFILE_MODE == "sampler")
+
+request_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_stages", default=None)
+profiles: deque = deque(maxlen=PROFILE_BUFFER_SIZE)
+profile_counter = itertools.count(1)
+cprofile_active = False
+IDLE_LEAF_FRAMES = ("thread.py:_worker", "threading.py:Condition.wait", "threading.py:Event.wait", "queue.py:Queue.get")
+
+
+class StackSampler:
+    """Arka plan thread'i: her aralıkta tüm thread'lerin yığınını izlenen isteklere ekler"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.watchers: Dict[int, List[str]] = {}  # izleme no -> katlanmış yığınlar
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.counter = itertools.count()
+
+    def watch(self) -> int:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+            self.thread.start()
+        token = next(self.counter)
+        with self.lock:
+            self.watchers[token] = []
+        return token
+
+    def unwatch(self, token: int) -> List[str]:
+        with self.lock:
+            return self.watchers.pop(token, [])
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            if not self.watchers:
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+                    frame = frame.f_back
+                # Boşta bekleyen executor thread'leri gürültü; event loop'un beklemesi ise bilgi
+                if not frames or (frames[0] in IDLE_LEAF_FRAMES and ident != threading.main_thread().ident):
+                    continue
+                frames.append(names.get(ident, str(ident)))
+                stacks.append(";".join(reversed(frames)))
+            with self.lock:
+                for samples in self.watchers.values():
+                    samples.extend(stacks)
+
+
+stack_sampler = StackSampler(PROFILE_INTERVAL_MS / 1000)
+
+
+def server_timing_header(stages: Dict[str, float], total: float) -> bytes:
+    parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in stages.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts).encode("latin-1")
+
+
+class ProfilingMiddleware:
+    """Saf ASGI middleware: istek bazında aşama süreleri, Server-Timing ve örneklenen profiller"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global cprofile_active
+        if scope["type"] != "http" or not (SERVER_TIMING or PROFILING_ENABLED):
+            await self.app(scope, receive, send)
+            return
+
+        stages: Dict[str, float] = {}
+        token = request_stages.set(stages)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", server_timing_header(stages, time.perf_counter() - started)),
+                        (b"timing-allow-origin", b"*"),
+                    ]
+            await send(message)
+
+        path = scope.get("path", "")
+        profiled = PROFILING_ENABLED and not path.startswith(PROFILE_SKIP_PATHS)
+        sampled = profiled and random.random() < PROFILE_SAMPLE_RATE
+        watch_token = profiler = None
+        if profiled and PROFILE_MODE == "cprofile":
+            if sampled and not cprofile_active:
+                cprofile_active = True
+                profiler = cProfile.Profile()
+                profiler.enable()
+        elif profiled and (sampled or PROFILE_SLOW_MS > 0):
+            watch_token = stack_sampler.watch()
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            duration = time.perf_counter() - started
+            request_stages.reset(token)
+            slow = PROFILE_SLOW_MS > 0 and duration * 1000 >= PROFILE_SLOW_MS
+            profile = None
+            if profiler is not None:
+                profiler.disable()
+                cprofile_active = False
+                if slow or PROFILE_SLOW_MS <= 0:
+                    output = io.StringIO()
+                    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(40)
+                    profile = {"mode": "cprofile", "stats": output.getvalue()}
+            elif watch_token is not None:
+                samples = stack_sampler.unwatch(watch_token)
+                if sampled or slow:
+                    stacks = Counter(samples).most_common(PROFILE_MAX_STACKS)
+                    profile = {"mode": "sampler", "interval_ms": PROFILE_INTERVAL_MS, "samples": len(samples), "stacks": stacks}
+            if profile is not None:
+                profile.update(
+                    id=next(profile_counter),
+                    timestamp=time.time(),
+                    method=scope.get("method"),
+                    path=path,
+                    endpoint=getattr(scope.get("endpoint"), "__name__", "unmatched"),
+                    status=status,
+                    reason="slow" if slow else "sampled",
+                    duration_ms=round(duration * 1000, 2),
+                    stages_ms={stage: round(seconds * 1000, 3) for stage, seconds in stages.items()},
+                )
+                profiles.append(profile)
+
+
+app.add_middleware(ProfilingMiddleware)
+
 
 def load_model():
     """Embedding modelini yükle"""
     global model
     if model is None:
-        print("🔄 Model yükleniyor: all-MiniLM-L6-v2")
-        model = SentenceTransformer('all-MiniLM-L6-v2')
+        print(f"🔄 Model yükleniyor: {model_name}")
+        model = SentenceTransformer(model_name)
         print("✅ Model yüklendi!")
     return model
 
@@ -210,6 +851,7 @@ def load_llm():
         print(f"🔄 LLM yükleniyor: {LLM_MODEL_NAME}")
         try:
             llm_tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_NAME)
+            PROMPTS.set_tokenizer(lambda text: len(llm_tokenizer.encode(text, add_special_tokens=False)))
             llm_model = AutoModelForCausalLM.from_pretrained(
                 LLM_MODEL_NAME,
                 torch_dtype=torch.float32,
@@ -230,40 +872,376 @@ def load_llm():
     return llm_pipe
 
 
-async def call_groq_api(messages: list, max_tokens: int = 300) -> str:
-    """Groq API ile yanıt üret - ÇOK HIZLI!"""
+# ===== Prompt Kayıt Defteri =====
+# Prompt şablonları import sırasında bir kez derlenir: statik parçalar ve ${slot}'lar
+# ayrılır, içerikten versiyon hash'i ve statik kısmın token sayısı hesaplanır. İstekte
+# sadece slot değerleri birleştirilir ve sayılır. "ad@versiyon" + slot değerleri stabil
+# bir anahtardır (single-flight, cache); şablon değişince anahtar da değişir. Statik metin
+# mümkün olduğunca slotlardan önce tutulur ki ortak prefix sağlayıcı tarafında yeniden
+# kullanılabilsin. Token sayıları lokal tokenizer yüklenene kadar tahminidir.
+
+PROMPT_SLOT_PATTERN = re.compile(r"\$\{(\w+)\}")
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Tokenizer olmadan kaba tahmin (~4 karakter/token)"""
+    return len(text) // 4
+
+
+class PromptTemplate:
+    """Derlenmiş prompt: statik parçalar + slot adları + versiyon"""
+
+    def __init__(self, name: str, text: str, count_tokens=estimate_text_tokens):
+        self.name = name
+        parts = PROMPT_SLOT_PATTERN.split(text)
+        self.static_parts: List[str] = parts[0::2]
+        self.slots: List[str] = parts[1::2]
+        self.version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+        self.key = f"{name}@{self.version}"
+        self.recount(count_tokens)
+
+    def recount(self, count_tokens):
+        self.count_tokens = count_tokens
+        self.static_tokens = sum(count_tokens(part) for part in self.static_parts)
+        self.prefix_tokens = count_tokens(self.static_parts[0])  # İlk slottan önceki ortak prefix
+
+    def render(self, values: Dict[str, str]) -> str:
+        if not self.slots:
+            return self.static_parts[0]
+        rendered = [self.static_parts[0]]
+        for slot, static in zip(self.slots, self.static_parts[1:]):
+            rendered.append(values[slot])
+            rendered.append(static)
+        return "".join(rendered)
+
+    def token_count(self, values: Dict[str, str]) -> int:
+        return self.static_tokens + sum(self.count_tokens(values[slot]) for slot in self.slots)
+
+
+class PromptRegistry:
+    def __init__(self):
+        self.templates: Dict[str, PromptTemplate] = {}
+        self.count_tokens = estimate_text_tokens
+
+    def register(self, name: str, text: str) -> PromptTemplate:
+        template = self.templates[name] = PromptTemplate(name, text, self.count_tokens)
+        return template
+
+    def __getitem__(self, name: str) -> PromptTemplate:
+        return self.templates[name]
+
+    def set_tokenizer(self, count_tokens):
+        """Gerçek tokenizer yüklenince statik token sayılarını bir kez yeniden hesapla"""
+        self.count_tokens = count_tokens
+        for template in self.templates.values():
+            template.recount(count_tokens)
+
+
+PROMPTS = PromptRegistry()
+
+
+class PromptCall:
+    """LLM'e gidecek mesajlar; anahtar ve prompt token sayısı şablonlardan birikir"""
+
+    def __init__(self):
+        self.messages: List[dict] = []
+        self.key_parts: List[list] = []
+        self.tokens = 0
+
+    def add(self, role: str, template_name: str, **values: str) -> "PromptCall":
+        template = PROMPTS[template_name]
+        self.messages.append({"role": role, "content": template.render(values)})
+        self.key_parts.append([role, template.key, [values[slot] for slot in template.slots]])
+        self.tokens += template.token_count(values)
+        return self
+
+    def add_text(self, role: str, content: str) -> "PromptCall":
+        """Şablonsuz mesaj (sohbet geçmişi gibi)"""
+        self.messages.append({"role": role, "content": content})
+        self.key_parts.append([role, content])
+        self.tokens += PROMPTS.count_tokens(content)
+        return self
+
+    @property
+    def key(self) -> str:
+        return json.dumps(self.key_parts, ensure_ascii=False)
+
+
+# ===== Single-flight (istek birleştirme) =====
+# Aynı anahtarla eşzamanlı gelen çağrılar tek bir task'ı paylaşır: trend bir içerik için
+# aynı prompt onlarca kez gelse de upstream'e tek çağrı gider. Anahtar LLM için prompt,
+# arama için aday listesinin anahtarı (sorgu + filtreler, limit/cursor hariç) + index nesli;
+# sayfalar birleşen listeden ayrı ayrı dilimlenir. Çağrı ayrı bir task olduğundan ilk isteğin
+# iptali (istemci bağlantıyı kapatırsa) bekleyen diğer istekleri etkilemez.
+
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+COALESCED = MetricCounter("saga_coalesced_calls_total", "Birleştirilen çağrılar (leader = upstream'e giden, follower = sonucu paylaşan)", ("kind", "role"))
+inflight_calls: Dict[Tuple[str, str], asyncio.Task] = {}
+
+
+def release_inflight(slot: Tuple[str, str], task: asyncio.Task):
+    if inflight_calls.get(slot) is task:
+        del inflight_calls[slot]
+    if not task.cancelled():
+        task.exception()  # Kimse beklemiyorsa "exception never retrieved" uyarısını engelle
+
+
+async def single_flight(kind: str, key: str, call):
+    """call() sonucunu aynı (kind, key) ile eşzamanlı bekleyen tüm çağıranlarla paylaş"""
+    if not SINGLE_FLIGHT_ENABLED:
+        return await call()
+    slot = (kind, key)
+    task = inflight_calls.get(slot)
+    if task is not None:
+        COALESCED.inc(kind, "follower")
+        started = time.perf_counter()
+        try:
+            return await asyncio.shield(task)
+        finally:
+            observe_stage("coalesced_wait", started)
+    COALESCED.inc(kind, "leader")
+    task = asyncio.ensure_future(call())
+    inflight_calls[slot] = task
+    task.add_done_callback(lambda done: release_inflight(slot, done))
+    return await asyncio.shield(task)
+
+
+def llm_call_key(prompt_key: str, max_tokens: int, priority: str, response_format: Optional[dict] = None) -> str:
+    # Öncelik anahtarda: interaktif bir istek batch kuyruğundaki eş çağrıyı beklemesin
+    return json.dumps([prompt_key, max_tokens, priority, response_format], ensure_ascii=False)
+
+
+# ===== LLM Gateway (öncelik + bütçe) =====
+# Tüm LLM çağrıları tek kapıdan geçer. Endpoint'ler öncelik sınıfı verir; bekleyen
+# interaktif istek varken alt sınıflar alınmaz. Groq kullanılıyorsa dakikalık istek
+# (GROQ_RPM) ve token (GROQ_TPM; prompt tahmini + max_tokens) bütçesi token bucket ile
+# izlenir; çağrı bitince fark Groq'un bildirdiği usage ile iade edilir. Batch sınıfı
+# bütçenin LLM_BATCH_RESERVE kadarını ve son slotu interaktif trafiğe bırakır. Kuyruk
+# doluysa veya istek sınıfının bekleme sınırı içinde alınamayacaksa çağrı yapılmaz
+# (None döner), endpoint kendi yedek cevabına düşer.
+
+LLM_PRIORITY_ORDER = ("interactive", "standard", "batch")
+LLM_QUEUE_LIMITS = {"interactive": 32, "standard": 16, "batch": 64}
+LLM_QUEUE_DEADLINES = {"interactive": 8.0, "standard": 15.0, "batch": 30.0}  # Kuyrukta en fazla bekleme (sn)
+LLM_BATCH_RESERVE = float(os.environ.get("LLM_BATCH_RESERVE", "0.3"))
+LLM_SHED = MetricCounter("saga_llm_shed_total", "Gateway'in reddettiği LLM çağrıları", ("priority", "reason"))
+LLM_ADMITTED = MetricCounter("saga_llm_admitted_total", "Gateway'den geçen LLM çağrıları", ("priority",))
+
+
+def estimate_tokens(messages: list, max_tokens: int) -> int:
+    """Prompt + üretilebilecek en fazla token"""
+    return sum(PROMPTS.count_tokens(str(message.get("content", ""))) for message in messages) + max_tokens
+
+
+class TokenBucket:
+    """Dakikalık limit için sürekli dolan kova"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+
+class LLMGateway:
+    """Öncelik sınıflı, sınırlı kuyruklu slot + bütçe dağıtıcısı"""
+
+    def __init__(self, slots: int, rpm: int, tpm: int):
+        self.slots = self.free_slots = max(1, slots)
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.queues: Dict[str, deque] = {priority: deque() for priority in LLM_PRIORITY_ORDER}
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def admission_wait(self, priority: str, cost: int) -> Optional[float]:
+        """0 = hemen alınabilir, >0 = bütçe açılana kadar sn, None = slot bekleniyor"""
+        if self.free_slots <= 0 or (priority == "batch" and self.slots > 1 and self.free_slots <= 1):
+            return None
+        reserve = LLM_BATCH_RESERVE if priority == "batch" else 0.0
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, cost)):
+            if bucket is not None:
+                bucket.refill()
+                wait = max(wait, bucket.seconds_until(amount + reserve * bucket.capacity))
+        return wait
+
+    def dispatch(self):
+        """Kuyruk başlarını öncelik sırasıyla al; üst sınıf bekliyorsa alt sınıflar da bekler"""
+        for priority in LLM_PRIORITY_ORDER:
+            queue = self.queues[priority]
+            while queue:
+                future, cost = queue[0]
+                wait = self.admission_wait(priority, cost)
+                if wait != 0.0:
+                    if wait:
+                        self.schedule(wait)
+                    return
+                queue.popleft()
+                self.free_slots -= 1
+                if self.requests is not None:
+                    self.requests.level -= 1
+                if self.tokens is not None:
+                    self.tokens.level -= cost
+                future.set_result(True)
+
+    def schedule(self, delay: float):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = asyncio.get_running_loop().call_later(delay, self.dispatch)
+
+    async def acquire(self, priority: str, cost: int) -> Optional[str]:
+        """Slot ve bütçe al. Alınamazsa shed sebebi döner (queue_full, budget, deadline)."""
+        queue = self.queues[priority]
+        if len(queue) >= LLM_QUEUE_LIMITS[priority]:
+            return "queue_full"
+        deadline = LLM_QUEUE_DEADLINES[priority]
+        if self.requests is not None:
+            # Öndeki istekler bile bütçeyi süre sınırı içinde tüketecekse beklemeden düş
+            self.requests.refill()
+            ahead = sum(len(self.queues[p]) for p in LLM_PRIORITY_ORDER[:LLM_PRIORITY_ORDER.index(priority) + 1])
+            if (ahead + 1 - self.requests.level) / self.requests.rate > deadline:
+                return "budget"
+
+        entry = (asyncio.get_running_loop().create_future(), cost)
+        queue.append(entry)
+        self.dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(entry[0]), deadline)
+            return None
+        except asyncio.TimeoutError:
+            if entry[0].done():
+                return None  # Süre dolarken alındı
+            queue.remove(entry)
+            entry[0].cancel()
+            self.dispatch()  # Bloklayan baş çıktıysa arkadakiler alınabilir
+            return "deadline"
+        except asyncio.CancelledError:
+            if entry[0].done():
+                self.release()
+            else:
+                queue.remove(entry)
+                entry[0].cancel()
+            raise
+
+    def release(self):
+        self.free_slots += 1
+        self.dispatch()
+
+    def settle(self, charged: int, used: int):
+        """Çağrı bitti: alınan tahmini maliyeti Groq'un bildirdiği gerçek kullanıma göre düzelt"""
+        if self.tokens is not None:
+            self.tokens.refill()
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + charged - used)
+            self.dispatch()
+
+    def throttle(self):
+        """Upstream 429 döndü: istek bütçesini boşalt, kuyruk bütçe dolana kadar beklesin"""
+        if self.requests is not None:
+            self.requests.refill()
+            self.requests.level = min(self.requests.level, 0.0)
+
+
+llm_gateway = LLMGateway(LLM_MAX_CONCURRENCY, GROQ_RPM if USE_GROQ else 0, GROQ_TPM if USE_GROQ else 0)
+
+
+async def call_groq_api(messages: list, max_tokens: int = 300, response_format: Optional[dict] = None, cost: int = 0) -> str:
+    """Groq API ile yanıt üret - ÇOK HIZLI! cost: gateway'de bu çağrı için düşülen token"""
+    payload = {
+        "model": GROQ_MODEL,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": 0.7
+    }
+    if response_format:
+        payload["response_format"] = response_format
+    # Gateway'de düşülen tahmin her çıkışta düzeltilir: Groq çağrıyı çalıştırmadıysa
+    # (429, diğer hatalar, bağlantı hatası) tamamı iade edilir, çalıştırdıysa usage kadar kalır
+    used = 0
     try:
         async with httpx.AsyncClient(timeout=30.0) as client:
             response = await client.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                json={
-                    "model": GROQ_MODEL,
-                    "messages": messages,
-                    "max_tokens": max_tokens,
-                    "temperature": 0.7
-                },
+                GROQ_API_URL,
+                json=payload,
                 headers={
                     "Authorization": f"Bearer {GROQ_API_KEY}",
                     "Content-Type": "application/json"
                 }
             )
             
+            GROQ_RESPONSES.inc(str(response.status_code))
+            if response.status_code == 429:
+                llm_gateway.throttle()
             if response.status_code == 200:
                 result = response.json()
+                used = int((result.get("usage") or {}).get("total_tokens", cost))
                 return result["choices"][0]["message"]["content"]
+            elif response.status_code == 400 and response_format:
+                # JSON modunda doğrulanamayan üretim hata içinde döner; onarım adımı kullanır
+                error = response.json().get("error") or {}
+                if error.get("code") == "json_validate_failed" and error.get("failed_generation"):
+                    used = cost  # Üretim yapıldı ama usage bildirilmedi: tahmin kalır
+                    return error["failed_generation"]
+                print(f"❌ Groq API hatası: {response.status_code} - {response.text}")
+                return None
             else:
                 print(f"❌ Groq API hatası: {response.status_code} - {response.text}")
                 return None
     except Exception as e:
+        GROQ_RESPONSES.inc("error")
+        if isinstance(e, httpx.ReadTimeout):
+            used = cost  # İstek gitti, Groq üretmeye devam ediyor olabilir
         print(f"❌ Groq API çağrı hatası: {e}")
         return None
+    finally:
+        if cost:
+            llm_gateway.settle(cost, used)
 
 
-async def call_local_llm(messages: list, max_tokens: int = 300) -> str:
-    """LLM ile yanıt üret - Groq varsa onu kullan, yoksa lokal"""
+async def call_local_llm(
+    messages: Union[list, PromptCall], max_tokens: int = 300, priority: str = "standard", response_format: Optional[dict] = None
+) -> str:
+    """LLM ile yanıt üret - Groq varsa onu kullan, yoksa lokal. Aynı prompt'lu eşzamanlı çağrılar birleştirilir."""
+    if isinstance(messages, PromptCall):
+        prompt_key, cost, messages = messages.key, messages.tokens + max_tokens, messages.messages
+    else:
+        prompt_key, cost = json.dumps(messages, ensure_ascii=False, sort_keys=True), estimate_tokens(messages, max_tokens)
+    key = llm_call_key(prompt_key, max_tokens, priority, response_format)
+    return await single_flight("llm", key, lambda: run_llm_call(messages, max_tokens, priority, cost, response_format))
+
+
+async def run_llm_call(messages: list, max_tokens: int, priority: str, cost: int, response_format: Optional[dict] = None) -> Optional[str]:
+    """Gateway'den geçen tek bir LLM çağrısı; reddedilirse None (endpoint yedek cevaba düşer)"""
+    global llm_in_flight
+    queued = time.perf_counter()
+    shed_reason = await llm_gateway.acquire(priority, cost)
+    observe_stage("llm_queue_wait", queued)
+    if shed_reason:
+        LLM_SHED.inc(priority, shed_reason)
+        return None
+    LLM_ADMITTED.inc(priority)
+    llm_in_flight += 1
+    started = time.perf_counter()
+    try:
+        return await generate_llm_response(messages, max_tokens, response_format, cost)
+    finally:
+        llm_in_flight -= 1
+        llm_gateway.release()
+        observe_stage("llm_generation", started)
+
+
+async def generate_llm_response(messages: list, max_tokens: int = 300, response_format: Optional[dict] = None, cost: int = 0) -> str:
+    """Groq veya lokal pipeline ile tek bir üretim (JSON modu sadece Groq'ta; lokal cevap parser'dan geçer)"""
     
     if USE_GROQ:
-        return await call_groq_api(messages, max_tokens)
+        return await call_groq_api(messages, max_tokens, response_format, cost)
     
     pipe = load_llm()
     if pipe is None:
@@ -298,11 +1276,11 @@ async def call_local_llm(messages: list, max_tokens: int = 300) -> str:
 async def call_hf_serverless_api(messages: list, max_tokens: int = 300) -> str:
     return await call_local_llm(messages, max_tokens)
 
-async def call_hf_router_api(messages: list, max_tokens: int = 300) -> str:
-    return await call_local_llm(messages, max_tokens)
+async def call_hf_router_api(messages: Union[list, PromptCall], max_tokens: int = 300, priority: str = "standard") -> str:
+    return await call_local_llm(messages, max_tokens, priority)
 
 
-async def call_hf_inference_api(prompt: str, max_tokens: int = 300, system_prompt: str = None) -> str:
+async def call_hf_inference_api(prompt: str, max_tokens: int = 300, system_prompt: str = None, priority: str = "standard") -> str:
     """LLM çağır"""
     
     messages = []
@@ -310,68 +1288,136 @@ async def call_hf_inference_api(prompt: str, max_tokens: int = 300, system_promp
         messages.append({"role": "system", "content": system_prompt})
     messages.append({"role": "user", "content": prompt})
     
-    return await call_local_llm(messages, max_tokens)
+    return await call_local_llm(messages, max_tokens, priority)
+
+
+# ===== Yapılandırılmış Çıktı (JSON) =====
+# JSON beklenen LLM çağrıları tek katmandan geçer: Groq'tan JSON modu istenir, cevap tek
+# geçişte taranır ve doğrudan pydantic modeline doğrulanır. Bozuk cevapta bir kez kısa bir
+# onarım çağrısı yapılır; o da olmazsa endpoint kendi yedek cevabına düşer.
+GROQ_RESPONSE_FORMAT = os.environ.get("GROQ_RESPONSE_FORMAT", "json_object")  # json_object | json_schema | off
+STRUCTURED_OUTPUTS = MetricCounter("saga_structured_output_total", "JSON beklenen LLM cevapları (ok, repaired, failed)", ("schema", "result"))
+JSON_SCAN_PATTERN = re.compile(r'[{}"\\]')
+
+
+class JsonObjectScanner:
+    """Parça parça gelen metinde üst seviye JSON objelerini tek geçişte bulur (string ve kaçış farkında)"""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk: str) -> List[str]:
+        """Yeni parçayı işle; bu parçayla tamamlanan objeleri döndür"""
+        completed = []
+        start = 0
+        skip = 0 if self.escaped else -1
+        self.escaped = False
+        # Sadece parantez, tırnak ve ters bölüye bakılır; aradaki metin regex ile atlanır
+        for match in JSON_SCAN_PATTERN.finditer(chunk):
+            i = match.start()
+            if i == skip:
+                continue
+            char = chunk[i]
+            if self.depth == 0:
+                if char == "{":
+                    self.depth, start = 1, i
+            elif self.in_string:
+                if char == "\\":
+                    skip = i + 1
+                    self.escaped = skip == len(chunk)
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.parts.append(chunk[start:i + 1])
+                    completed.append("".join(self.parts))
+                    self.parts = []
+        if self.depth:
+            self.parts.append(chunk[start:])
+        return completed
 
 
 def extract_json(text: str) -> Optional[str]:
-    """Metinden JSON objesini çıkar (iç içe {} destekli)"""
-    import re
-    
+    """Metindeki ilk JSON objesi (iç içe {} ve string içi parantez destekli)"""
+    objects = JsonObjectScanner().feed(text or "")
+    return objects[0] if objects else None
+
+
+def parse_structured(text: Optional[str], schema: Type[BaseModel]) -> Optional[BaseModel]:
+    """Metindeki ilk şemaya uyan JSON objesi; yoksa None"""
     if not text:
         return None
-    
-    # Önce ```json bloğu ara
-    code_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', text, re.DOTALL)
-    if code_match:
-        return code_match.group(1)
-    
-    # Sonra normal JSON bloğu ara - brace counting ile
-    start = text.find('{')
-    if start == -1:
-        return None
-    
-    depth = 0
-    for i, char in enumerate(text[start:], start):
-        if char == '{':
-            depth += 1
-        elif char == '}':
-            depth -= 1
-            if depth == 0:
-                return text[start:i+1]
+    for candidate in JsonObjectScanner().feed(text):
+        try:
+            return schema.model_validate_json(candidate)
+        except ValidationError:
+            continue
     return None
 
 
-def parse_assistant_response(text: str) -> dict:
-    """Asistan yanıtını parse et - JSON veya düz metin"""
+@lru_cache(maxsize=None)
+def schema_json(schema: Type[BaseModel]) -> str:
+    return json.dumps(schema.model_json_schema(), ensure_ascii=False)
+
+
+def response_format_for(schema: Type[BaseModel]) -> Optional[dict]:
+    """Groq'a gönderilecek response_format (json_schema her modelde desteklenmiyor)"""
+    if not USE_GROQ or GROQ_RESPONSE_FORMAT == "off":
+        return None
+    if GROQ_RESPONSE_FORMAT == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": schema.__name__, "schema": json.loads(schema_json(schema))}}
+    return {"type": "json_object"}
+
+
+PROMPTS.register("json_repair_system", """Kullanıcının gönderdiği metni aşağıdaki JSON şemasına uyan tek bir geçerli JSON objesine dönüştür.
+Yeni bilgi ekleme, sadece metindeki bilgiyi kullan. Sadece JSON döndür.
+
+Şema:
+${schema}""")
+
+
+async def call_structured_llm(
+    prompt: PromptCall, schema: Type[BaseModel], max_tokens: int, priority: str = "standard"
+) -> Tuple[Optional[BaseModel], Optional[str]]:
+    """JSON bekleyen LLM çağrısı: (doğrulanmış model, ham cevap). Bozuk cevapta bir kez onarım denenir."""
+    response_format = response_format_for(schema)
+    text = await call_local_llm(prompt, max_tokens, priority, response_format)
     if not text:
-        return {"message": "Yanıt alınamadı", "action": None, "action_data": None, "suggestions": None}
-    
-    # JSON parse dene
-    json_str = extract_json(text)
-    if json_str:
-        try:
-            parsed = json.loads(json_str)
-            # message içinde de JSON string varsa tekrar parse et
-            if isinstance(parsed.get("message"), str) and parsed["message"].strip().startswith("{"):
-                inner_json = extract_json(parsed["message"])
-                if inner_json:
-                    try:
-                        inner_parsed = json.loads(inner_json)
-                        # İç JSON'ı ana yanıtla birleştir
-                        return {
-                            "message": inner_parsed.get("message", parsed["message"]),
-                            "action": inner_parsed.get("action") or parsed.get("action"),
-                            "action_data": inner_parsed.get("action_data") or parsed.get("action_data"),
-                            "suggestions": inner_parsed.get("suggestions") or parsed.get("suggestions")
-                        }
-                    except:
-                        pass
-            return parsed
-        except json.JSONDecodeError:
-            pass
-    
-    # JSON yoksa düz metin olarak işle
-    return {"message": text.strip(), "action": None, "action_data": None, "suggestions": None}
+        return None, None
+    started = time.perf_counter()
+    parsed = parse_structured(text, schema)
+    observe_stage("json_parse", started)
+    if parsed is not None:
+        STRUCTURED_OUTPUTS.inc(schema.__name__, "ok")
+        return parsed, text
+
+    repair = PromptCall().add("system", "json_repair_system", schema=schema_json(schema)).add_text("user", text)
+    repaired = parse_structured(await call_local_llm(repair, max_tokens, priority, response_format), schema)
+    STRUCTURED_OUTPUTS.inc(schema.__name__, "repaired" if repaired is not None else "failed")
+    return repaired, text
+
+
+def unwrap_assistant_response(response: AssistantResponse) -> AssistantResponse:
+    """message içine yine JSON yazılmışsa iç yanıtı dışınkiyle birleştir"""
+    if not response.message.strip().startswith("{"):
+        return response
+    inner = parse_structured(response.message, AssistantResponse)
+    if inner is None:
+        return response
+    return AssistantResponse(
+        message=inner.message,
+        action=inner.action or response.action,
+        action_data=inner.action_data or response.action_data,
+        suggestions=inner.suggestions or response.suggestions
+    )
 
 
 def create_search_text(item: dict) -> str:
@@ -403,147 +1449,2715 @@ def generate_reason(query: str, item: dict, score: float) -> str:
         return f"{tur_emoji} Benzer tema"
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Uygulama başlarken modeli yükle"""
-    load_model()
-    
-    # Eğer önceden kaydedilmiş index varsa yükle
-    if os.path.exists("faiss_index.bin") and os.path.exists("content_data.json"):
-        load_index_from_disk()
+# Türkçe karakterleri katlayarak karşılaştırma için normalize et
+TURKISH_FOLD_MAP = str.maketrans({
+    "ı": "i", "İ": "i", "I": "i", "ş": "s", "Ş": "s", "ğ": "g", "Ğ": "g",
+    "ü": "u", "Ü": "u", "ö": "o", "Ö": "o", "ç": "c", "Ç": "c",
+    "â": "a", "Â": "a", "î": "i", "Î": "i", "û": "u", "Û": "u",
+})
 
 
-def load_index_from_disk():
-    """Disk'ten index ve veri yükle"""
-    global index, content_data
-    try:
-        index = faiss.read_index("faiss_index.bin")
-        with open("content_data.json", "r", encoding="utf-8") as f:
-            content_data = json.load(f)
-        print(f"✅ Index yüklendi: {len(content_data)} içerik")
-    except Exception as e:
-        print(f"⚠️ Index yüklenemedi: {e}")
+def normalize_text(text: str) -> str:
+    """Türkçe duyarlı küçük harf + diakritik katlama + noktalama temizliği"""
+    if not text:
+        return ""
+    text = text.translate(TURKISH_FOLD_MAP).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
 
 
-def save_index_to_disk():
-    """Index ve veriyi disk'e kaydet"""
-    global index, content_data
-    try:
-        faiss.write_index(index, "faiss_index.bin")
-        with open("content_data.json", "w", encoding="utf-8") as f:
-            json.dump(content_data, f, ensure_ascii=False)
-        print(f"✅ Index kaydedildi: {len(content_data)} içerik")
-    except Exception as e:
-        print(f"⚠️ Index kaydedilemedi: {e}")
+# ===== Lexical Arama: BM25 Inverted Index =====
+# Başlık/açıklama üzerinde süreç içi BM25. Postings CSR düzeninde kompakt numpy dizileri:
+# term_offsets[t]:term_offsets[t+1] aralığı post_docs (int32) / post_tfs (uint16) içinde.
+# Upsert'ler index'i baştan kurmaz, değişen dokümanlar için küçük segment ekler.
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_TITLE_BOOST = 3  # Başlıktaki terimler açıklamadakinden bu kadar kat sayılır
+BM25_PREFIX_MIN_LEN = 3  # Bu uzunluktan kısa terimler için prefix genişletme yapılmaz
+BM25_PREFIX_MAX_EXPANSIONS = 16
+BM25_PREFIX_WEIGHT = 0.6  # Prefix ile eşleşen terimlerin katkı oranı
+BM25_MERGE_RATIO = 0.1  # Upsert segmentlerindeki doküman sayısı tabanın bu oranını aşınca index baştan kurulur
 
+TURKISH_STOPWORDS = {
+    "ve", "ile", "bir", "bu", "su", "o", "da", "de", "ki", "mi", "mu", "icin", "gibi",
+    "ama", "veya", "ya", "cok", "daha", "en", "the", "a", "an", "of", "and",
+}
 
-@app.get("/", response_model=HealthResponse)
-async def health_check():
-    """Sağlık kontrolü"""
-    return HealthResponse(
-        status="healthy",
-        model_loaded=model is not None,
+
+def tokenize_text(text: str) -> List[str]:
+    """Normalize edip stopword'leri at"""
+    return [token for token in normalize_text(text).split() if token not in TURKISH_STOPWORDS]
+
+
+class BM25Segment:
+    """Değişmez postings segmenti: terim -> (doküman pozisyonu, tf) CSR dizileri"""
+
+    def __init__(self, terms: List[str], term_offsets: np.ndarray, post_docs: np.ndarray,
+                 post_tfs: np.ndarray, positions: np.ndarray):
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.sorted_terms = sorted(terms)  # prefix araması için (bisect)
+        self.term_offsets = term_offsets
+        self.post_docs = post_docs
+        self.post_tfs = post_tfs
+        self.positions = positions  # Segmentin kurulduğu doküman pozisyonları
+
+    @classmethod
+    def build(cls, items: List[dict], positions: np.ndarray) -> Tuple["BM25Segment", np.ndarray]:
+        """Verilen pozisyonlardaki içerikler için segment ve doküman uzunlukları"""
+        term_ids: Dict[str, int] = {}
+        terms: List[str] = []
+        rows_term: List[int] = []
+        rows_doc: List[int] = []
+        rows_tf: List[int] = []
+        doc_lengths = np.zeros(len(positions), dtype=np.float32)
+
+        for row, doc in enumerate(positions.tolist()):
+            item = items[doc]
+            counts: Dict[str, int] = {}
+            for token in tokenize_text(item.get('baslik', '')):
+                counts[token] = counts.get(token, 0) + BM25_TITLE_BOOST
+            for token in tokenize_text(item.get('aciklama', '')):
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                term_id = term_ids.get(token)
+                if term_id is None:
+                    term_id = term_ids[token] = len(terms)
+                    terms.append(token)
+                rows_term.append(term_id)
+                rows_doc.append(doc)
+                rows_tf.append(tf)
+            doc_lengths[row] = sum(counts.values())
+
+        rows_term_arr = np.array(rows_term, dtype=np.int32)
+        order = np.argsort(rows_term_arr, kind="stable")
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows_term_arr, minlength=len(terms)), out=term_offsets[1:])
+        post_docs = np.array(rows_doc, dtype=np.int32)[order]
+        post_tfs = np.minimum(np.array(rows_tf, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16)[order]
+        return cls(terms, term_offsets, post_docs, post_tfs, positions), doc_lengths
+
+    def prefix_terms(self, token: str, limit: int) -> List[str]:
+        """token ile başlayan ilk limit terim (sıralı)"""
+        start = bisect.bisect_left(self.sorted_terms, token)
+        matches = []
+        for term in self.sorted_terms[start:start + limit]:
+            if not term.startswith(token):
+                break
+            matches.append(term)
+        return matches
+
+
+class BM25Index:
+    """
+    Segmentli BM25 inverted index. İlk kurulumda tek taban segment vardır; upsert'te
+    değişen dokümanlar küçük bir segment olarak eklenir ve live_segment dokümanın güncel
+    halini tutan segmenti gösterir (eski kopyaları aramada atlanır). Boyutları yakın son
+    segmentler birleştirilir, ek segmentler tabanın BM25_MERGE_RATIO katını aşınca index
+    baştan kurulur: her doküman amortize O(log n) kez yeniden token'lanır.
+    """
+
+    def __init__(self, segments: List[BM25Segment], live_segment: np.ndarray, doc_lengths: np.ndarray):
+        self.segments = segments
+        self.live_segment = live_segment
+        self.doc_lengths = doc_lengths
+        self.doc_count = len(doc_lengths)
+        self.avg_doc_length = float(doc_lengths.mean()) if self.doc_count else 0.0
+        # Doküman başına normalizasyon terimi önceden hesaplanır
+        self.length_norm = (BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / max(self.avg_doc_length, 1e-6))).astype(np.float32)
+
+    @classmethod
+    def build(cls, items: List[dict]) -> "BM25Index":
+        segment, doc_lengths = BM25Segment.build(items, np.arange(len(items), dtype=np.int64))
+        return cls([segment], np.zeros(len(items), dtype=np.int16), doc_lengths)
+
+    def update(self, items: List[dict], changed_positions: List[int]) -> "BM25Index":
+        """
+        Değişen pozisyonlar için yeni index (sadece onlar token'lanır). Mevcut nesne ve
+        segmentleri değişmez; items yeni pozisyonları sonda içeren güncel içerik listesidir.
+        """
+        changed = np.unique(np.asarray(changed_positions, dtype=np.int64))
+        overlay_docs = sum(len(segment.positions) for segment in self.segments[1:]) + len(changed)
+        if overlay_docs > BM25_MERGE_RATIO * len(items):
+            return BM25Index.build(items)
+
+        segment, lengths = BM25Segment.build(items, changed)
+        segments = self.segments + [segment]
+        live_segment = np.zeros(len(items), dtype=np.int16)
+        live_segment[:self.doc_count] = self.live_segment
+        live_segment[changed] = len(segments) - 1
+        doc_lengths = np.zeros(len(items), dtype=np.float32)
+        doc_lengths[:self.doc_count] = self.doc_lengths
+        doc_lengths[changed] = lengths
+
+        # Son segment bir öncekinden büyük/eşitse ikisini birleştir (taban hariç)
+        while len(segments) > 2 and len(segments[-2].positions) <= len(segments[-1].positions):
+            last, previous = len(segments) - 1, len(segments) - 2
+            merged = np.concatenate([
+                positions[live_segment[positions] == number]
+                for number, positions in ((previous, segments[previous].positions), (last, segments[last].positions))
+            ])
+            merged.sort()
+            segments[previous:] = [BM25Segment.build(items, merged)[0]]
+            live_segment[merged] = previous
+        return BM25Index(segments, live_segment, doc_lengths)
+
+    def _expand_term(self, token: str) -> List[Tuple[str, float]]:
+        """Terimi (terim, ağırlık) listesine çevir: tam eşleşme + prefix genişletme"""
+        expanded = []
+        if any(token in segment.term_ids for segment in self.segments):
+            expanded.append((token, 1.0))
+        if len(token) >= BM25_PREFIX_MIN_LEN:
+            limit = BM25_PREFIX_MAX_EXPANSIONS + 1
+            terms = sorted({term for segment in self.segments for term in segment.prefix_terms(token, limit)})
+            expanded.extend((term, BM25_PREFIX_WEIGHT) for term in terms[:limit] if term != token)
+        return expanded
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Terimin güncel postings'i: dokümanın eski segmentlerde kalan kopyaları atlanır"""
+        docs_parts: List[np.ndarray] = []
+        tfs_parts: List[np.ndarray] = []
+        for number, segment in enumerate(self.segments):
+            term_id = segment.term_ids.get(term)
+            if term_id is None:
+                continue
+            lo, hi = segment.term_offsets[term_id], segment.term_offsets[term_id + 1]
+            docs, tfs = segment.post_docs[lo:hi], segment.post_tfs[lo:hi]
+            if len(self.segments) > 1:
+                live = self.live_segment[docs] == number
+                docs, tfs = docs[live], tfs[live]
+            docs_parts.append(docs)
+            tfs_parts.append(tfs)
+        if len(docs_parts) == 1:
+            return docs_parts[0], tfs_parts[0]
+        if not docs_parts:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint16)
+        return np.concatenate(docs_parts), np.concatenate(tfs_parts)
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """BM25 skoruna göre (pozisyon, skor) listesi; allowed verilirse sadece o pozisyonlar"""
+        if self.doc_count == 0:
+            return []
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for token in set(tokenize_text(query)):
+            for term, weight in self._expand_term(token):
+                docs, tfs = self._postings(term)
+                if len(docs) == 0:
+                    continue
+                tfs = tfs.astype(np.float32)
+                doc_freq = np.float32(len(docs))
+                idf = np.log(1 + (self.doc_count - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+                # Bir terimin güncel postings'inde doküman tekrar etmez, doğrudan toplanabilir
+                scores[docs] += weight * idf * tfs * (BM25_K1 + 1) / (tfs + self.length_norm[docs])
+
+        if allowed is not None:
+            mask = np.zeros(self.doc_count, dtype=bool)
+            mask[allowed] = True
+            scores[~mask] = 0.0
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) == 0:
+            return []
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(pos), float(scores[pos])) for pos in candidates]
+
+
+# ===== Typeahead: Başlık Prefix Index =====
+# Normalize başlıklar sıralı dizide tutulur, prefix aralığı bisect ile bulunur.
+# Her başlık kelime başlarından da girilir ("potter" -> "Harry Potter ...").
+AUTOCOMPLETE_MAX_WORD_ENTRIES = 6
+AUTOCOMPLETE_TITLE_START_BONUS = 0.5  # Başlığın başından eşleşme kelime ortasından önde gelsin
+
+
+def popularity_score(item: dict) -> float:
+    """Sıralama için popülerlik + puan skoru"""
+    populerlik = item.get('populerlik') or 0.0
+    return float(np.log1p(max(populerlik, 0.0)) + (item.get('puan') or 0.0) / 10.0)
+
+
+class TitlePrefixIndex:
+    """Sıralı anahtar dizisi + bisect ile prefix arama; değişen içerikler artımlı güncellenir"""
+
+    def __init__(self):
+        self.keys: List[str] = []
+        self.positions = np.zeros(0, dtype=np.int32)
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.turs = np.zeros(0, dtype=np.int8)  # Tür kodu (tur_codes)
+        self.tur_codes: Dict[str, int] = {}
+
+    def _tur_code(self, tur: str) -> int:
+        return self.tur_codes.setdefault(tur.lower(), len(self.tur_codes))
+
+    def _entries(self, pos: int, item: dict) -> List[Tuple[str, int, float, int]]:
+        words = normalize_text(item.get('baslik', '')).split()
+        base = popularity_score(item)
+        tur_code = self._tur_code(item.get('tur', ''))
+        entries = []
+        for i in range(min(len(words), AUTOCOMPLETE_MAX_WORD_ENTRIES)):
+            bonus = AUTOCOMPLETE_TITLE_START_BONUS if i == 0 else 0.0
+            entries.append((" ".join(words[i:]), pos, base + bonus, tur_code))
+        return entries
+
+    @classmethod
+    def build(cls, items: List[dict]) -> "TitlePrefixIndex":
+        prefix_index = cls()
+        entries = [entry for pos, item in enumerate(items) for entry in prefix_index._entries(pos, item)]
+        entries.sort(key=lambda entry: entry[0])
+        prefix_index.keys = [entry[0] for entry in entries]
+        prefix_index.positions = np.array([entry[1] for entry in entries], dtype=np.int32)
+        prefix_index.scores = np.array([entry[2] for entry in entries], dtype=np.float32)
+        prefix_index.turs = np.array([entry[3] for entry in entries], dtype=np.int8)
+        return prefix_index
+
+    def update(self, items: List[dict], positions: List[int]):
+        """
+        Verilen pozisyonların girişlerini yenile. Eski girişler tek maskeyle çıkarılır, yenileri
+        sıralı dizilere tek geçişte yerleştirilir (giriş başına dizi kaydırması yapılmaz).
+        """
+        changed = np.unique(np.asarray(positions, dtype=np.int32))
+        keep = ~np.isin(self.positions, changed)
+        if not keep.all():
+            self.keys = list(itertools.compress(self.keys, keep))
+            self.positions = self.positions[keep]
+            self.scores = self.scores[keep]
+            self.turs = self.turs[keep]
+        entries = sorted(
+            (entry for pos in changed.tolist() for entry in self._entries(pos, items[pos])), key=lambda entry: entry[0]
+        )
+        if not entries:
+            return
+        at = [bisect.bisect_left(self.keys, entry[0]) for entry in entries]
+        keys: List[str] = []
+        previous = 0
+        for insert_at, entry in zip(at, entries):
+            keys.extend(self.keys[previous:insert_at])
+            keys.append(entry[0])
+            previous = insert_at
+        keys.extend(self.keys[previous:])
+        self.keys = keys
+        self.positions = np.insert(self.positions, at, [entry[1] for entry in entries]).astype(np.int32)
+        self.scores = np.insert(self.scores, at, [entry[2] for entry in entries]).astype(np.float32)
+        self.turs = np.insert(self.turs, at, [entry[3] for entry in entries]).astype(np.int8)
+
+    def search(self, prefix: str, limit: int, tur: Optional[str] = None) -> List[int]:
+        """Prefix ile başlayan başlıkları popülerliğe göre sıralı pozisyon listesi olarak döndür"""
+        prefix = normalize_text(prefix)
+        if not prefix:
+            return []
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + "\uffff", lo)
+        if lo == hi:
+            return []
+
+        positions = self.positions[lo:hi]
+        scores = self.scores[lo:hi].copy()
+        if tur:
+            tur_code = self.tur_codes.get(tur.lower())
+            if tur_code is None:
+                return []
+            scores[self.turs[lo:hi] != tur_code] = -np.inf
+
+        # Aynı başlık birden çok kelime girişiyle gelebilir, fazladan aday al
+        take = min(len(scores), limit * 3)
+        top = np.argpartition(-scores, take - 1)[:take] if take < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        results: List[int] = []
+        seen = set()
+        for i in top:
+            if scores[i] == -np.inf:
+                break
+            pos = int(positions[i])
+            if pos not in seen:
+                seen.add(pos)
+                results.append(pos)
+                if len(results) >= limit:
+                    break
+        return results
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[int, float]]], weights: List[float], k: int = 60) -> List[int]:
+    """Ağırlıklı Reciprocal Rank Fusion: pozisyonları birleşik sıraya göre döndür"""
+    fused: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        if weight <= 0:
+            continue
+        for rank, (pos, _) in enumerate(ranking):
+            fused[pos] = fused.get(pos, 0.0) + weight / (k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)
+
+
+def position_key(item: dict) -> Tuple[str, str]:
+    """Pozisyonun tür ve başlık haritalarındaki anahtarları"""
+    return item.get('tur', '').lower(), normalize_text(item.get('baslik', ''))
+
+
+def update_position_maps(changed_positions: List[int]):
+    """Tür/başlık/id haritalarını sadece değişen pozisyonlar için güncelle (eski anahtarlar position_keys'te)"""
+    added: Dict[str, List[int]] = {}
+    removed: Dict[str, List[int]] = {}
+    for pos in sorted(set(changed_positions)):
+        item = content_data[pos]
+        id_positions[item.get('id', pos)] = pos
+        key = position_key(item)
+        if pos == len(position_keys):
+            position_keys.append(key)  # Yeni pozisyonlar sona eklenir
+        elif position_keys[pos] == key:
+            continue
+        else:
+            old_tur, old_title = position_keys[pos]
+            position_keys[pos] = key
+            removed.setdefault(old_tur, []).append(pos)
+            titles = title_positions[old_title]
+            titles.remove(pos)
+            if not titles:
+                del title_positions[old_title]
+        added.setdefault(key[0], []).append(pos)
+        bisect.insort(title_positions.setdefault(key[1], []), pos)
+
+    # Diziler yerinde değiştirilmez: önceki dizilerle kurulmuş selector'lar geçerli kalsın
+    for tur in set(added) | set(removed):
+        positions = tur_positions.get(tur, np.zeros(0, dtype=np.int64))
+        if tur in removed:
+            positions = positions[~np.isin(positions, removed[tur])]
+        if tur in added:
+            positions = np.union1d(positions, np.array(added[tur], dtype=np.int64))
+        if len(positions):
+            tur_positions[tur] = positions.astype(np.int64)
+        else:
+            tur_positions.pop(tur, None)
+
+
+def rebuild_derived_indexes(changed_positions: Optional[List[int]] = None, refresh_neighbors: bool = True):
+    """
+    Index değiştiğinde yardımcı yapıları (tür bölümleri, başlık haritası vb.) yeniden kur.
+    changed_positions verilirse (upsert) haritalar, BM25, prefix index ve komşu tablosu
+    sadece değişen pozisyonlar için artımlı güncellenir.
+    """
+    global tur_positions, title_positions, bm25_index, prefix_index, id_positions, position_keys, index_generation
+    if changed_positions is not None and bm25_index is not None and prefix_index is not None:
+        update_position_maps(changed_positions)
+        bm25_index = bm25_index.update(content_data, changed_positions)
+        prefix_index.update(content_data, changed_positions)
+    else:
+        groups: Dict[str, List[int]] = {}
+        titles: Dict[str, List[int]] = {}
+        ids: Dict[int, int] = {}
+        keys: List[Tuple[str, str]] = []
+        for pos, item in enumerate(content_data):
+            key = position_key(item)
+            groups.setdefault(key[0], []).append(pos)
+            titles.setdefault(key[1], []).append(pos)
+            ids[item.get('id', pos)] = pos
+            keys.append(key)
+        tur_positions = {tur: np.array(positions, dtype=np.int64) for tur, positions in groups.items()}
+        title_positions = titles
+        id_positions = ids
+        position_keys = keys
+        bm25_index = BM25Index.build(content_data)
+        prefix_index = TitlePrefixIndex.build(content_data)
+    index_generation += 1
+    sync_shards(changed_positions)
+    if refresh_neighbors:
+        schedule_neighbor_refresh(changed_positions)
+
+
+# ===== Embedding Worker + Cache =====
+# Sorgu ve /embed encode'ları tek bir worker'da mikro-batch'lenir ve event loop dışında
+# çalışır. Her batch önce bekleyen sorgularla doldurulur; dış servislerin toplu /embed
+# istekleri boş kalan yeri kullanır, böylece /search'ü aç bırakamaz. Ham vektörler
+# (model, pooling, metin) anahtarıyla LRU cache'te tutulur.
+EMBED_MAX_BATCH = int(os.environ.get("EMBED_MAX_BATCH", "256"))  # Tek /embed isteğindeki en fazla metin
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "32"))  # model.encode'a tek seferde giden metin
+EMBED_BATCH_WAIT_MS = float(os.environ.get("EMBED_BATCH_WAIT_MS", "0"))  # 0: worker meşgulken biriken işler zaten batch'lenir
+EMBED_MAX_PENDING = int(os.environ.get("EMBED_MAX_PENDING", "4096"))  # Kuyruktaki toplu metin sınırı (aşılırsa 503)
+EMBED_CACHE_SIZE = int(os.environ.get("EMBED_CACHE_SIZE", "20000"))
+EMBED_POOLINGS = ("model", "mean", "max", "cls")
+EMBED_DTYPES = ("float32", "float16", "int8")
+EMBED_BATCH_SIZES = MetricHistogram(
+    "saga_embed_batch_size", "Embedding worker'ının tek seferde encode ettiği metin sayısı", "pooling",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+
+embedding_cache: "OrderedDict[Tuple[str, str, str], Tuple[np.ndarray, int]]" = OrderedDict()  # (model, pooling, metin) -> (ham vektör, token sayısı)
+embedding_cache_lock = threading.Lock()
+embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+
+
+class EmbeddingQueueFull(Exception):
+    pass
+
+
+def pool_token_embeddings(token_embeddings: np.ndarray, pooling: str) -> np.ndarray:
+    """(token, dim) matristen tek vektör; padding'siz token'lar üzerinde"""
+    if pooling == "max":
+        return token_embeddings.max(axis=0)
+    if pooling == "cls":
+        return token_embeddings[0]
+    return token_embeddings.mean(axis=0)
+
+
+def embedding_token_counts(encoder, texts: List[str]) -> List[int]:
+    """Kırpılmadan önceki token sayıları (özel token'lar dahil)"""
+    tokenizer = getattr(encoder, "tokenizer", None)
+    if tokenizer is None:
+        return [len(text.split()) for text in texts]
+    return [len(ids) for ids in tokenizer(texts, add_special_tokens=True, truncation=False)["input_ids"]]
+
+
+def encode_batch(texts: List[str], pooling: str) -> Tuple[np.ndarray, List[int]]:
+    """
+    Worker thread'inde tek model.encode çağrısı; vektörler ve kırpılmadan önceki token
+    sayıları cache'e yazılır. Tokenizer sadece bu thread'de kullanılır (hızlı tokenizer
+    farklı ayarlarla eşzamanlı çağrılamaz).
+    """
+    current_model, current_name = model, model_name  # Model geçişi sırasında cache doğru modele yazılsın
+    token_counts = embedding_token_counts(current_model, texts)
+    if pooling == "model":
+        vectors = current_model.encode(texts, convert_to_numpy=True, batch_size=len(texts)).astype(np.float32)
+    else:
+        token_embeddings = current_model.encode(texts, output_value="token_embeddings", batch_size=len(texts))
+        vectors = np.stack([
+            pool_token_embeddings(tokens.float().cpu().numpy(), pooling) for tokens in token_embeddings
+        ]).astype(np.float32)
+    with embedding_cache_lock:
+        for text, vector, count in zip(texts, vectors, token_counts):
+            embedding_cache[(current_name, pooling, text)] = (vector, count)
+        while len(embedding_cache) > EMBED_CACHE_SIZE:
+            embedding_cache.popitem(last=False)
+    return vectors, token_counts
+
+
+def encode_on_worker(func, *args):
+    """
+    Canlı modelle senkron encode (Gradio thread'i, intent router): iş embed worker'ında
+    sıraya girer. Event loop'tan çağıran async kod run_in_executor(embed_executor, ...) kullanır.
+    """
+    return embed_executor.submit(func, *args).result()
+
+
+class EmbeddingBatcher:
+    """Encode isteklerini öncelikli iki kuyrukta toplayıp tek worker'da batch'ler"""
+
+    def __init__(self, batch_size: int, wait_ms: float, max_pending: int):
+        self.batch_size, self.wait, self.max_pending = max(1, batch_size), wait_ms / 1000, max_pending
+        self.queues: Dict[str, deque] = {"interactive": deque(), "bulk": deque()}
+        self.loop = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.worker: Optional[asyncio.Task] = None
+
+    async def encode(self, texts: List[str], priority: str = "interactive", pooling: str = "model") -> Tuple[np.ndarray, List[int]]:
+        """
+        Ham (normalize edilmemiş) float32 vektörler (len(texts), dim) ve kırpılmadan önceki
+        token sayıları; cache'tekiler encode edilmez
+        """
+        load_model()
+        vectors: List[Optional[Tuple[np.ndarray, int]]] = []
+        with embedding_cache_lock:
+            for text in texts:
+                key = (model_name, pooling, text)
+                vector = embedding_cache.get(key)
+                if vector is not None:
+                    embedding_cache.move_to_end(key)
+                vectors.append(vector)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        CACHE_REQUESTS.inc("embedding", "hit", amount=len(texts) - len(missing))
+        CACHE_REQUESTS.inc("embedding", "miss", amount=len(missing))
+        if missing:
+            if priority == "bulk" and len(self.queues["bulk"]) + len(missing) > self.max_pending:
+                raise EmbeddingQueueFull()
+            self.ensure_worker()
+            futures = []
+            for text in missing:
+                future = self.loop.create_future()
+                self.queues[priority].append((text, pooling, future))
+                futures.append(future)
+            self.wakeup.set()
+            encoded = dict(zip(missing, await asyncio.gather(*futures)))
+            vectors = [encoded[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return np.stack([vector for vector, _ in vectors]), [count for _, count in vectors]
+
+    def ensure_worker(self):
+        # Her event loop kendi worker'ını kullanır (ör. testlerde loop değişebilir)
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop or self.worker is None or self.worker.done():
+            self.loop, self.wakeup = loop, asyncio.Event()
+            self.worker = loop.create_task(self.run())
+
+    def take(self) -> List[tuple]:
+        """Önce sorgular; kalan yer aynı pooling'li toplu işlerle doldurulur"""
+        batch: List[tuple] = []
+        pooling = None
+        for priority in ("interactive", "bulk"):
+            queue = self.queues[priority]
+            while queue and len(batch) < self.batch_size:
+                if queue[0][2].done():  # İsteği iptal edilmiş
+                    queue.popleft()
+                    continue
+                if pooling is not None and queue[0][1] != pooling:
+                    break
+                pooling = queue[0][1]
+                batch.append(queue.popleft())
+        return batch
+
+    async def run(self):
+        request_stages.set(None)  # Worker hiçbir isteğin aşama sözlüğüne yazmaz
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if self.wait > 0:
+                await asyncio.sleep(self.wait)
+            while self.queues["interactive"] or self.queues["bulk"]:
+                batch = self.take()
+                if not batch:
+                    continue
+                texts = list(dict.fromkeys(text for text, _, _ in batch))
+                pooling = batch[0][1]
+                EMBED_BATCH_SIZES.observe(pooling, len(texts))
+                started = time.perf_counter()
+                try:
+                    vectors, token_counts = await self.loop.run_in_executor(embed_executor, encode_batch, texts, pooling)
+                except Exception as e:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                finally:
+                    observe_stage("embed_batch", started)
+                encoded = dict(zip(texts, zip(vectors, token_counts)))
+                for text, _, future in batch:
+                    if not future.done():
+                        future.set_result(encoded[text])
+
+
+embedding_batcher = EmbeddingBatcher(EMBED_BATCH_SIZE, EMBED_BATCH_WAIT_MS, EMBED_MAX_PENDING)
+
+
+async def encode_query(text: str) -> np.ndarray:
+    """Sorgu için normalize edilmiş (1, dim) embedding üret"""
+    started = time.perf_counter()
+    query_embedding, _ = await embedding_batcher.encode([text])
+    faiss.normalize_L2(query_embedding)
+    observe_stage("encode", started)
+    return query_embedding
+
+
+def get_index_vectors(source_index=None) -> np.ndarray:
+    """
+    Index'teki normalize vektörlere kopyasız (ntotal, dim) görünüm.
+    Görünüm index nesnesine referans tutmaz; thread'lerde index'i ayrıca referansta tutun.
+    """
+    source_index = source_index if source_index is not None else index
+    if source_index is None or source_index.ntotal == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return faiss.rev_swig_ptr(source_index.get_xb(), source_index.ntotal * source_index.d).reshape(source_index.ntotal, source_index.d)
+
+
+INDEX_RESERVE_MIN_ROWS = 1024  # Sona eklemeler için ayrılan en az satır (kapasite her büyümede iki katına çıkar)
+
+
+def reserve_index(source, dimension: int, rows: int) -> Tuple["faiss.IndexFlatIP", int]:
+    """
+    source'un (None olabilir) özel kopyası; tampon en az rows satırlık ayrılır.
+    (index, kapasite) döndürür. Kapasite dolana kadar append_to_index tamponu taşımaz.
+    """
+    capacity = max(2 * rows, INDEX_RESERVE_MIN_ROWS)
+    copy = faiss.IndexFlatIP(dimension)
+    copy.codes.resize(capacity * dimension * 4)
+    copy.codes.resize(0)  # Boyut sıfırlanır, ayrılan kapasite kalır
+    if source is not None and source.ntotal:
+        copy.add(get_index_vectors(source))
+    return copy, capacity
+
+
+def append_to_index(source, reserve: tuple, vectors: np.ndarray) -> Tuple["faiss.IndexFlatIP", tuple]:
+    """
+    Vektörleri index'in sonuna ekle; (index, yeni reserve) döndürür. reserve, kapasitesi
+    ayrılmış son nesnenin (zayıf referans, kapasite) kaydıdır.
+    Yayınlanmış bir nesnenin mevcut satırları hiç değişmez: kapasite yetiyorsa yeni satırlar
+    aynı nesnede ntotal'ın arkasına yazılır (tampon taşınmaz, görünümler geçerli kalır;
+    ntotal'ı önceden okuyan thread'ler yeni satırları görmez). Yetmiyorsa ya da nesne
+    kapasitesi bilinmeyen bir kopyaysa (diskten/mmap'ten açılmış, elle kurulmuş) iki katı
+    kapasiteli kopyaya geçilir; bu O(N) kopya eklenen satırlara yayıldığında satır başına sabittir.
+    """
+    reference, capacity = reserve
+    rows = source.ntotal if source is not None else 0
+    if source is None or reference() is not source or rows + len(vectors) > capacity:
+        dimension = source.d if source is not None else vectors.shape[1]
+        source, capacity = reserve_index(source, dimension, rows + len(vectors))
+    if len(vectors):
+        source.add(vectors)
+    return source, (weakref.ref(source), capacity)
+
+
+def index_prefix(source, rows: int):
+    """
+    İlk rows satırın kopyası. Yerinde sona ekleme alabilen index'i başka thread'de seri
+    hale getirmeden önce kullanılır (yakalanan ntotal'dan sonraki satırlar dosyaya girmesin).
+    """
+    copy = faiss.IndexFlatIP(source.d)
+    if rows:
+        copy.add(np.ascontiguousarray(get_index_vectors(source)[:rows]))
+    return copy
+
+
+def swap_index(new_index, new_data: List[dict]):
+    """Index'i ve içerik listesini birlikte değiştir (komşu job'ı ikisini tutarlı okusun)"""
+    global index, content_data
+    with neighbor_lock:
+        index, content_data = new_index, new_data
+
+
+async def search_vectors(
+    query_embedding: np.ndarray,
+    k: int,
+    tur: Optional[str] = None,
+    exclude: Optional[np.ndarray] = None
+) -> List[Tuple[int, float]]:
+    """
+    Index'te ara, (pozisyon, skor) listesi döndür.
+    Tür filtresi ve hariç tutulan pozisyonlar FAISS içinde IDSelector ile uygulanır,
+    sonradan elemeye gerek kalmaz.
+    """
+    if index is None or index.ntotal == 0:
+        return []
+
+    # Selector'lar arama bitene kadar referansta kalmalı
+    started = time.perf_counter()
+    selectors = []
+    available = index.ntotal
+    if tur:
+        positions = tur_positions.get(tur.lower())
+        if positions is None or len(positions) == 0:
+            return []
+        selectors.append(faiss.IDSelectorBatch(positions))
+        available = len(positions)
+
+    if shards_ready:
+        observe_stage("filter", started)
+        started = time.perf_counter()
+        hits = await scatter_search(query_embedding, k, tur=tur, exclude=exclude)
+        if hits is not None:
+            observe_stage("faiss_search", started)
+            return hits
+
+    if exclude is not None and len(exclude) > 0:
+        selectors.append(faiss.IDSelectorNot(faiss.IDSelectorBatch(np.asarray(exclude, dtype=np.int64))))
+
+    params = None
+    if len(selectors) == 1:
+        params = faiss.SearchParameters(sel=selectors[0])
+    elif len(selectors) == 2:
+        selectors.append(faiss.IDSelectorAnd(selectors[0], selectors[1]))
+        params = faiss.SearchParameters(sel=selectors[-1])
+
+    observe_stage("filter", started)
+
+    k = min(k, available)
+    if k <= 0:
+        return []
+    started = time.perf_counter()
+    scores, indices = index.search(query_embedding, k, params=params)
+    observe_stage("faiss_search", started)
+    return [(int(idx), float(score)) for score, idx in zip(scores[0], indices[0]) if idx != -1]
+
+
+def mmr_rerank(
+    query_embedding: np.ndarray,
+    candidate_vectors: np.ndarray,
+    limit: int,
+    diversity: float = 0.3,
+    relevance: Optional[np.ndarray] = None
+) -> List[int]:
+    """
+    Maximal Marginal Relevance: alaka ile çeşitliliği dengele.
+    Aday vektörleri arası benzerlik matrisi tek seferde hesaplanır; döngü sadece seçim için.
+    relevance verilmezse sorguya cosine benzerliği kullanılır.
+    Seçilen adayların (candidate_vectors içindeki) sıralarını döndürür.
+    """
+    n = len(candidate_vectors)
+    if n == 0:
+        return []
+    if relevance is None:
+        relevance = candidate_vectors @ query_embedding[0]
+    similarity = candidate_vectors @ candidate_vectors.T
+
+    selected: List[int] = []
+    max_sim_to_selected = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(min(limit, n)):
+        if selected:
+            mmr_scores = (1 - diversity) * relevance - diversity * max_sim_to_selected
+        else:
+            mmr_scores = relevance.copy()
+        mmr_scores[~available] = -np.inf
+        best = int(np.argmax(mmr_scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_sim_to_selected, similarity[best], out=max_sim_to_selected)
+    return selected
+
+
+# ===== Shard'lı Arama: Çok Süreçli Scatter-Gather =====
+# Katalog id hash'ine veya türe göre N shard sürecine bölünür (bkz. shard_worker.py).
+# Sorgu embedding'i tüm ilgili shard'lara paralel gönderilir, top-k sonuçlar heap ile birleştirilir.
+# Kapsam: shard'lar sadece "genel" vektör taramasını CPU çekirdeklerine yayar, belleği azaltmaz.
+# Ön süreç tam index'i ve alan index'ini tutmaya devam eder (kalıcılık, MMR, alan skorlaması,
+# komşu grafiği); bir shard hata verirse arama otomatik olarak yerel index'e döner.
+# Her shard'ın tek thread'li kendi executor'ı var: mesajlar sırayla gider, böylece
+# güncellemeden sonra kuyruğa giren arama güncel shard'ı görür. Event loop IPC'yi await eder.
+
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "0"))  # 0/1 = kapalı
+SHARD_PARTITION = os.environ.get("SHARD_PARTITION", "hash").lower()  # "hash": id'ye göre, "tur": türe göre
+SHARD_THREADS = int(os.environ.get("SHARD_THREADS", "1"))  # Her shard sürecinin FAISS thread sayısı
+
+shard_processes: list = []
+shard_conns: list = []
+shard_locks: List[threading.Lock] = []
+shard_owner = np.zeros(0, dtype=np.int32)  # index pozisyonu -> shard
+shard_executors: List[ThreadPoolExecutor] = []
+shards_ready = False
+
+
+def shard_for_tur(tur: str) -> int:
+    return zlib.crc32(tur.lower().encode("utf-8")) % len(shard_conns)
+
+
+def shard_for_item(item: dict) -> int:
+    if SHARD_PARTITION == "tur":
+        return shard_for_tur(item.get('tur', ''))
+    return int(item['id']) % len(shard_conns)
+
+
+def start_shards():
+    """Shard süreçlerini başlat; ayrı yorumlayıcı, sadece numpy + faiss yükler"""
+    if SHARD_COUNT <= 1 or shard_conns:
+        return
+    import socket
+    import subprocess
+    from multiprocessing.connection import Connection
+    for _ in range(SHARD_COUNT):
+        parent_sock, child_sock = socket.socketpair()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "shard_worker", str(child_sock.fileno()), str(SHARD_THREADS)],
+            pass_fds=(child_sock.fileno(),),
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        child_sock.close()
+        shard_processes.append(process)
+        shard_conns.append(Connection(parent_sock.detach()))
+        shard_locks.append(threading.Lock())
+        shard_executors.append(ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"shard{len(shard_conns) - 1}"))
+    print(f"✅ {SHARD_COUNT} shard süreci başlatıldı (bölümleme: {SHARD_PARTITION}; "
+          f"sadece genel vektör taraması, tam index ön süreçte kalır)")
+
+
+def stop_shards():
+    global shards_ready
+    shards_ready = False
+    for executor in shard_executors:
+        executor.shutdown(wait=True)
+    for shard in range(len(shard_conns)):
+        try:
+            _shard_call(shard, ("stop",))
+        except Exception:
+            pass
+        shard_conns[shard].close()
+    for process in shard_processes:
+        try:
+            process.wait(timeout=5)
+        except Exception:
+            process.kill()
+    shard_processes.clear()
+    shard_conns.clear()
+    shard_locks.clear()
+    shard_executors.clear()
+
+
+def _shard_call(shard: int, message: tuple):
+    """Shard'a mesaj gönder, cevabı bekle (her pipe'ta aynı anda tek istek)"""
+    with shard_locks[shard]:
+        shard_conns[shard].send(message)
+        status, payload = shard_conns[shard].recv()
+    if status != "ok":
+        raise RuntimeError(f"Shard {shard}: {payload}")
+    return payload
+
+
+def _disable_shards(error: Exception):
+    global shards_ready
+    shards_ready = False
+    print(f"⚠️ Shard hatası, arama yerel index'e döndü: {error}")
+
+
+def _check_shard_update(future):
+    """Kuyruktaki load/update başarısız olursa shard'ları kapat; sonraki sync tam yükleme yapar"""
+    error = future.exception()
+    if error is not None:
+        _disable_shards(error)
+
+
+def sync_shards(changed_positions: Optional[List[int]] = None):
+    """
+    Index değişikliğini shard'lara yansıt; changed_positions verilirse sadece onlar taşınır.
+    Mesajlar shard kuyruklarına bırakılır, beklenmez: sonraki aramalar aynı kuyrukta arkada kalır.
+    """
+    global shard_owner, shards_ready
+    if not shard_conns:
+        return
+    if index is None or index.ntotal == 0:
+        shards_ready = False
+        return
+
+    vectors = get_index_vectors()
+    messages: Dict[int, tuple] = {}
+    if changed_positions is None or not shards_ready:
+        owners = np.array([shard_for_item(item) for item in content_data], dtype=np.int32)
+        for shard in range(len(shard_conns)):
+            rows = np.flatnonzero(owners == shard).astype(np.int64)
+            messages[shard] = ("load", index.d, rows, vectors[rows], [content_data[pos].get('tur', '').lower() for pos in rows])
+    else:
+        changed = np.asarray(sorted(set(changed_positions)), dtype=np.int64)
+        previous = np.full(len(changed), -1, dtype=np.int32)
+        known = changed < len(shard_owner)
+        previous[known] = shard_owner[changed[known]]
+        owners = np.zeros(len(content_data), dtype=np.int32)
+        owners[:len(shard_owner)] = shard_owner
+        owners[changed] = [shard_for_item(content_data[pos]) for pos in changed.tolist()]
+        for shard in range(len(shard_conns)):
+            removed = changed[previous == shard]
+            added = changed[owners[changed] == shard]
+            if len(removed) or len(added):
+                messages[shard] = ("update", removed, added, vectors[added], [content_data[pos].get('tur', '').lower() for pos in added])
+
+    for shard, message in messages.items():
+        shard_executors[shard].submit(_shard_call, shard, message).add_done_callback(_check_shard_update)
+    shard_owner = owners
+    shards_ready = True
+
+
+async def scatter_search(
+    query_embedding: np.ndarray,
+    k: int,
+    tur: Optional[str] = None,
+    exclude: Optional[np.ndarray] = None
+) -> Optional[List[Tuple[int, float]]]:
+    """Sorguyu shard'lara dağıt, top-k'yı heap ile birleştir. Hata olursa None (yerel aramaya dönülür)."""
+    tur = tur.lower() if tur else None
+    if tur and SHARD_PARTITION == "tur":
+        targets = [shard_for_tur(tur)]  # Tür tek shard'da
+    else:
+        targets = range(len(shard_conns))
+    if exclude is not None:
+        exclude = np.asarray(exclude, dtype=np.int64)
+
+    message = ("search", query_embedding, k, tur, exclude)
+    try:
+        partials = await asyncio.gather(*(
+            asyncio.wrap_future(shard_executors[shard].submit(_shard_call, shard, message))
+            for shard in targets
+        ))
+    except Exception as e:
+        _disable_shards(e)
+        return None
+    merged = heapq.nlargest(
+        k,
+        ((int(pos), float(score)) for ids, scores in partials for pos, score in zip(ids, scores)),
+        key=lambda hit: hit[1]
+    )
+    return merged
+
+
+# ===== Benzer İçerik Komşu Grafiği =====
+# Her içeriğin (kendi türü içindeki) top-K komşusu arka plan job'ında önceden hesaplanır;
+# "benzer" rafları ve öneriler model çağrısı olmadan O(1) tablodan okur.
+# Tablo faiss_index.bin yanında int32/float16 matris olarak saklanır, upsert sonrası
+# sadece etkilenen satırlar yeniden hesaplanır.
+SIMILAR_PRECOMPUTE_K = int(os.environ.get("SIMILAR_PRECOMPUTE_K", "20"))  # 0 = kapalı
+SIMILAR_PRECOMPUTE_BATCH = 1024
+NEIGHBOR_JOB_THREADS = int(os.environ.get("NEIGHBOR_JOB_THREADS", "2"))
+NEIGHBOR_PARTITION_BY_TUR = os.environ.get("NEIGHBOR_PARTITION_BY_TUR", "true").lower() == "true"
+NEIGHBOR_TABLE_PATH = "neighbors.npz"
+
+neighbor_ids: Optional[np.ndarray] = None  # (n, K) int32 komşu pozisyonları, -1 = boş
+neighbor_scores: Optional[np.ndarray] = None  # (n, K) float16 skorlar
+neighbor_generation = -1  # Tablonun geçerli olduğu index_generation
+
+neighbor_lock = threading.Lock()
+neighbor_dirty_rows: Optional[set] = set()  # None = tam yeniden hesaplama gerekli
+neighbor_job_running = False
+
+
+def content_fingerprint(items: Optional[List[dict]] = None) -> str:
+    """content_data'daki (veya verilen listedeki) id dizisinin özeti (diskteki tablonun geçerliliği için)"""
+    items = content_data if items is None else items
+    ids = np.array([item.get('id', pos) for pos, item in enumerate(items)], dtype=np.int64)
+    return hashlib.sha1(ids.tobytes()).hexdigest()
+
+
+def _neighbor_partitions(rows: np.ndarray, turs: List[str]) -> List[Tuple[np.ndarray, Optional[np.ndarray]]]:
+    """Satırları tür bölümlerine ayır: (satırlar, aranacak pozisyonlar veya None=hepsi)"""
+    if not NEIGHBOR_PARTITION_BY_TUR:
+        return [(rows, None)]
+    all_turs = np.array(turs)
+    row_turs = all_turs[rows]
+    return [
+        (rows[row_turs == tur], np.flatnonzero(all_turs == tur).astype(np.int64))
+        for tur in np.unique(row_turs)
+    ]
+
+
+def compute_neighbor_rows(source_index, turs: List[str], rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Verilen satırlar için top-k komşu: chunk'lar halinde, çok thread'li batch index.search"""
+    vectors = get_index_vectors(source_index)
+    ids = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.zeros((len(rows), k), dtype=np.float16)
+    row_slot = {int(row): slot for slot, row in enumerate(rows)}
+
+    tasks = []
+    for part_rows, allowed in _neighbor_partitions(rows, turs):
+        for start in range(0, len(part_rows), SIMILAR_PRECOMPUTE_BATCH):
+            tasks.append((part_rows[start:start + SIMILAR_PRECOMPUTE_BATCH], allowed))
+
+    def run(task):
+        chunk_rows, allowed = task
+        params = None
+        selector = None
+        available = source_index.ntotal
+        if allowed is not None:
+            selector = faiss.IDSelectorBatch(allowed)
+            params = faiss.SearchParameters(sel=selector)
+            available = len(allowed)
+        batch = np.ascontiguousarray(vectors[chunk_rows])
+        batch_scores, batch_ids = source_index.search(batch, min(k + 1, available), params=params)
+        for i, row in enumerate(chunk_rows):
+            keep = (batch_ids[i] != row) & (batch_ids[i] != -1) & (batch_ids[i] < len(turs))  # Sonradan eklenenler hariç
+            row_ids = batch_ids[i][keep][:k]
+            slot = row_slot[int(row)]
+            ids[slot, :len(row_ids)] = row_ids
+            scores[slot, :len(row_ids)] = batch_scores[i][keep][:k]
+
+    with ThreadPoolExecutor(max_workers=max(1, NEIGHBOR_JOB_THREADS)) as executor:
+        list(executor.map(run, tasks))
+    return ids, scores
+
+
+def expand_affected_rows(
+    source_index, total: int, changed: np.ndarray, table_ids: np.ndarray, table_scores: np.ndarray
+) -> np.ndarray:
+    """
+    Değişen pozisyonların etkilediği satırlar: değişenlerin kendisi, listesinde değişen
+    bir pozisyon olanlar ve değişen vektörü K. komşusundan daha yakın bulanlar.
+    total: hesaba giren satır sayısı (index'in sonraki eklemeleri hariç).
+    """
+    vectors = get_index_vectors(source_index)[:total]
+    n = len(table_ids)
+    affected = np.zeros(len(vectors), dtype=bool)
+    affected[changed] = True
+    affected[n:] = True  # Tabloda henüz satırı olmayan yeni içerikler
+    affected[:n] |= np.isin(table_ids, changed).any(axis=1)
+
+    kth_scores = np.where(table_ids[:, -1] == -1, -np.inf, table_scores[:, -1].astype(np.float32))
+    for start in range(0, len(changed), SIMILAR_PRECOMPUTE_BATCH):
+        chunk = changed[start:start + SIMILAR_PRECOMPUTE_BATCH]
+        similarity = vectors[:n] @ vectors[chunk].T
+        affected[:n] |= (similarity > kth_scores[:, None]).any(axis=1)
+    return np.flatnonzero(affected)
+
+
+def save_neighbor_table(ids: np.ndarray, scores: np.ndarray, fingerprint: str, path: Optional[str] = None):
+    """Komşu tablosunu atomik olarak diske yaz"""
+    try:
+        path = path or snapshot_path(NEIGHBOR_TABLE_PATH)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, ids=ids, scores=scores, fingerprint=np.array(fingerprint))
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"⚠️ Komşu tablosu kaydedilemedi: {e}")
+
+
+def load_neighbor_table_from_disk() -> bool:
+    """Diskteki komşu tablosu mevcut içeriklerle eşleşiyorsa yükle"""
+    global neighbor_ids, neighbor_scores, neighbor_generation
+    path = snapshot_path(NEIGHBOR_TABLE_PATH)
+    if SIMILAR_PRECOMPUTE_K <= 0 or not os.path.exists(path):
+        return False
+    try:
+        with np.load(path) as data:
+            if str(data["fingerprint"]) != content_fingerprint() or data["ids"].shape[1] != SIMILAR_PRECOMPUTE_K:
+                return False
+            neighbor_ids, neighbor_scores = data["ids"], data["scores"]
+        neighbor_generation = index_generation
+        print(f"✅ Komşu tablosu yüklendi: {len(neighbor_ids)} içerik")
+        return True
+    except Exception as e:
+        print(f"⚠️ Komşu tablosu yüklenemedi: {e}")
+        return False
+
+
+def _neighbor_job():
+    """Kirli satırlar bitene kadar komşu tablosunu güncelle (tek seferde tek job)"""
+    global neighbor_ids, neighbor_scores, neighbor_generation, neighbor_dirty_rows, neighbor_job_running
+    while True:
+        with neighbor_lock:
+            dirty = neighbor_dirty_rows
+            neighbor_dirty_rows = set()
+            generation = index_generation
+            source_index = index  # Hesap sürerken index değişse de bu nesne yaşamalı
+            turs = [item.get('tur', '').lower() for item in content_data]
+            fingerprint = content_fingerprint()
+            base_ids, base_scores = neighbor_ids, neighbor_scores
+
+        try:
+            k = SIMILAR_PRECOMPUTE_K
+            # Yakalanan içerik sayısı: upsert aynı nesnenin sonuna satır eklemiş olabilir
+            n = len(turs) if source_index is not None else 0
+            if n == 0:
+                ids, scores = None, None
+            elif dirty is None or base_ids is None or len(base_ids) > n:
+                # Tam hesaplama
+                ids, scores = compute_neighbor_rows(source_index, turs, np.arange(n), k)
+            else:
+                changed = np.array(sorted(dirty), dtype=np.int64)
+                rows = expand_affected_rows(source_index, n, changed, base_ids, base_scores)
+                ids = np.full((n, k), -1, dtype=np.int32)
+                scores = np.zeros((n, k), dtype=np.float16)
+                ids[:len(base_ids)], scores[:len(base_scores)] = base_ids, base_scores
+                if len(rows):
+                    ids[rows], scores[rows] = compute_neighbor_rows(source_index, turs, rows, k)
+                print(f"🔄 Komşu tablosu: {len(rows)}/{n} satır yeniden hesaplandı")
+        except Exception as e:
+            print(f"⚠️ Komşu tablosu hesaplanamadı: {e}")
+            with neighbor_lock:
+                neighbor_job_running = False
+            return
+
+        with neighbor_lock:
+            if generation == index_generation:
+                if ids is not None:
+                    neighbor_ids, neighbor_scores, neighbor_generation = ids, scores, generation
+                    save_neighbor_table(ids, scores, fingerprint)
+                    print(f"✅ Komşu tablosu hazır: {len(ids)} içerik x {SIMILAR_PRECOMPUTE_K}")
+            elif dirty is None or neighbor_dirty_rows is None:
+                # Bu arada index değişti: işlenen satırlar bir sonraki turda tekrar ele alınır
+                neighbor_dirty_rows = None
+            else:
+                neighbor_dirty_rows |= dirty
+            if neighbor_dirty_rows is not None and not neighbor_dirty_rows:
+                neighbor_job_running = False
+                return
+
+
+def schedule_neighbor_refresh(changed_positions: Optional[List[int]] = None):
+    """Komşu tablosunu arka planda güncelle: changed_positions yoksa tamamı yeniden hesaplanır"""
+    global neighbor_dirty_rows, neighbor_job_running
+    if SIMILAR_PRECOMPUTE_K <= 0 or index is None or index.ntotal == 0:
+        return
+    with neighbor_lock:
+        if changed_positions is None or neighbor_dirty_rows is None:
+            neighbor_dirty_rows = None
+        else:
+            neighbor_dirty_rows.update(changed_positions)
+        if neighbor_job_running:
+            return
+        neighbor_job_running = True
+    threading.Thread(target=_neighbor_job, daemon=True).start()
+
+
+async def find_similar(pos: int, limit: int, tur: Optional[str] = None) -> Tuple[List[Tuple[int, float]], str]:
+    """Pozisyondaki içeriğe benzerleri bul: önce komşu tablosu, yetmezse saklı vektörle arama"""
+    if neighbor_generation == index_generation and neighbor_ids is not None:
+        row_ids, row_scores = neighbor_ids[pos], neighbor_scores[pos]
+        hits = [
+            (int(neighbor), float(score))
+            for neighbor, score in zip(row_ids, row_scores)
+            if neighbor != -1 and (not tur or content_data[neighbor].get('tur', '').lower() == tur.lower())
+        ]
+        if len(hits) >= limit:
+            return hits[:limit], "table"
+
+    # Saklı vektörle doğrudan ara - metni yeniden encode etmeye gerek yok
+    query_embedding = np.ascontiguousarray(get_index_vectors()[pos:pos + 1])
+    hits = await search_vectors(query_embedding, limit, tur=tur, exclude=np.array([pos], dtype=np.int64))
+    return hits, "search"
+
+
+# ===== Çoklu Vektör: Alan Bazlı Embedding'ler =====
+# create_search_text tek vektörü ("genel") MiniLM'in 256 token sınırında uzun açıklamaların
+# sonunu kaybeder, kısa başlık da açıklamada boğulur. Bu yüzden başlık ve açıklama
+# pasajları ayrı bir index'te, parent (içerik pozisyonu) eşlemesiyle saklanır;
+# skorlar içerik başına alan ağırlıklarıyla birleştirilir.
+MULTI_VECTOR_ENABLED = os.environ.get("MULTI_VECTOR_ENABLED", "true").lower() == "true"
+PASSAGE_WORDS = 100  # ~256 token sınırının altında kalacak pasaj uzunluğu (kelime)
+PASSAGE_OVERLAP = 20
+FIELD_KINDS = {"baslik": 0, "aciklama": 1}
+DEFAULT_FIELD_WEIGHTS = {"genel": 0.5, "baslik": 0.2, "aciklama": 0.3}
+FIELD_CANDIDATE_FACTOR = 3  # Pasaj index'inden limit'in kaç katı satır alınacak
+
+field_index = None  # faiss.IndexFlatIP: başlık + açıklama pasaj vektörleri
+field_parents = np.zeros(0, dtype=np.int32)  # satır -> içerik pozisyonu
+field_kinds = np.zeros(0, dtype=np.int8)  # satır -> FIELD_KINDS değeri
+field_order = np.zeros(0, dtype=np.int64)  # parent'a göre sıralı satırlar
+field_offsets = np.zeros(1, dtype=np.int64)  # parent p'nin satırları: field_order[offsets[p]:offsets[p+1]]
+field_tur_rows: Dict[str, np.ndarray] = {}  # tür -> pasaj satırları (filtreli arama için)
+field_reserve: tuple = (lambda: None, 0)  # append_to_index kaydı (alan index'i için)
+
+
+def split_passages(text: str) -> List[str]:
+    """Uzun açıklamayı örtüşen kelime pencerelerine böl"""
+    words = text.split()
+    if len(words) <= PASSAGE_WORDS:
+        return [text] if words else []
+    step = PASSAGE_WORDS - PASSAGE_OVERLAP
+    return [" ".join(words[start:start + PASSAGE_WORDS]) for start in range(0, len(words) - PASSAGE_OVERLAP, step)]
+
+
+def encode_fields(items: List[dict], positions: List[int], encoder=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Verilen içerik pozisyonları için alan vektörleri, parent ve tür dizileri"""
+    encoder = encoder or model
+    texts: List[str] = []
+    parents: List[int] = []
+    kinds: List[int] = []
+    for pos in positions:
+        item = items[pos]
+        if item.get('baslik'):
+            texts.append(item['baslik'])
+            parents.append(pos)
+            kinds.append(FIELD_KINDS["baslik"])
+        for passage in split_passages(item.get('aciklama', '')):
+            texts.append(passage)
+            parents.append(pos)
+            kinds.append(FIELD_KINDS["aciklama"])
+
+    if not texts:
+        dimension = encoder.get_sentence_embedding_dimension()
+        return np.zeros((0, dimension), dtype=np.float32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int8)
+    embeddings = encoder.encode(texts, convert_to_numpy=True, show_progress_bar=len(texts) > 100).astype(np.float32)
+    faiss.normalize_L2(embeddings)
+    return embeddings, np.array(parents, dtype=np.int32), np.array(kinds, dtype=np.int8)
+
+
+def rebuild_field_lookup():
+    """Parent -> satır CSR eşlemesini ve tür satırlarını yeniden hesapla"""
+    global field_order, field_offsets, field_tur_rows
+    field_order = np.argsort(field_parents, kind="stable")
+    field_offsets = np.searchsorted(field_parents[field_order], np.arange(len(content_data) + 1)).astype(np.int64)
+    turs = np.array([item.get('tur', '').lower() for item in content_data])
+    parent_turs = turs[field_parents] if len(field_parents) else np.zeros(0, dtype=turs.dtype)
+    field_tur_rows = {tur: np.flatnonzero(parent_turs == tur).astype(np.int64) for tur in np.unique(turs)}
+
+
+def extend_field_lookup(first_row: int):
+    """
+    first_row'dan sonraki satırlar sadece yeni içeriklere aitken (parent'ları eşlemedeki
+    tüm pozisyonlardan büyük) eşlemeyi baştan kurmadan uzat.
+    """
+    global field_order, field_offsets, field_tur_rows
+    parents = field_parents[first_row:]
+    order = np.argsort(parents, kind="stable")
+    known = len(field_offsets) - 1
+    field_order = np.concatenate([field_order, first_row + order])
+    tail = first_row + np.searchsorted(parents[order], np.arange(known, len(content_data) + 1))
+    field_offsets = np.concatenate([field_offsets[:-1], tail]).astype(np.int64)
+    rows_by_tur: Dict[str, List[int]] = {}
+    for row, parent in enumerate(parents.tolist(), first_row):
+        rows_by_tur.setdefault(content_data[parent].get('tur', '').lower(), []).append(row)
+    field_tur_rows = dict(field_tur_rows)
+    for tur, rows in rows_by_tur.items():
+        field_tur_rows[tur] = np.concatenate([field_tur_rows.get(tur, np.zeros(0, dtype=np.int64)), np.array(rows, dtype=np.int64)])
+
+
+def update_field_index(
+    changed_positions: Optional[List[int]] = None,
+    fields: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+    lookup: bool = True
+):
+    """
+    Alan index'ini kur (changed_positions yoksa tamamen) veya değişen içerikler için güncelle.
+    fields: değişen (tam kurulumda tüm) içeriklerin önceden encode edilmiş alanları.
+    lookup=False ile parent eşlemesi çağırana bırakılır (ardışık güncellemelerde bir kez kurulur).
+    """
+    global field_index, field_parents, field_kinds, field_reserve
+    if not MULTI_VECTOR_ENABLED or index is None:
+        return
+
+    if changed_positions is None or field_index is None:
+        full = fields if changed_positions is None and fields is not None else None
+        embeddings, parents, kinds = full or encode_fields(content_data, list(range(len(content_data))))
+        new_index = faiss.IndexFlatIP(index.d)
+        new_index.add(embeddings)
+        field_index, field_parents, field_kinds = new_index, parents, kinds
+    else:
+        keep = ~np.isin(field_parents, changed_positions)
+        embeddings, parents, kinds = fields if fields is not None else encode_fields(content_data, changed_positions)
+        first_row = len(field_parents)
+        if keep.all():
+            # Çıkarılacak satır yok (yeni içerikler): satırlar index'in sonuna eklenir
+            field_index, field_reserve = append_to_index(field_index, field_reserve, embeddings)
+            field_parents = np.concatenate([field_parents, parents])
+            field_kinds = np.concatenate([field_kinds, kinds])
+            if lookup and changed_positions and min(changed_positions) >= len(field_offsets) - 1:
+                extend_field_lookup(first_row)
+                return
+        else:
+            # Değişen içeriklerin eski satırları çıkarılmış kopya + yeni satırlar (yayınlanmış index değişmez)
+            new_index = faiss.IndexFlatIP(index.d)
+            new_index.add(get_index_vectors(field_index)[keep])
+            new_index.add(embeddings)
+            field_index = new_index
+            field_parents = np.concatenate([field_parents[keep], parents])
+            field_kinds = np.concatenate([field_kinds[keep], kinds])
+    if lookup:
+        rebuild_field_lookup()
+
+
+def save_field_index_to_disk(directory: str = ""):
+    """Alan index'ini ve parent eşlemesini kaydet"""
+    if field_index is None:
+        return
+    try:
+        faiss.write_index(field_index, os.path.join(directory, "faiss_fields.bin"))
+        np.savez(os.path.join(directory, "field_meta.npz"), parents=field_parents, kinds=field_kinds, fingerprint=np.array(content_fingerprint()))
+    except Exception as e:
+        print(f"⚠️ Alan index'i kaydedilemedi: {e}")
+
+
+def load_field_index_from_disk() -> bool:
+    """Diskteki alan index'i mevcut içeriklerle eşleşiyorsa yükle"""
+    global field_index, field_parents, field_kinds
+    index_path, meta_path = snapshot_path("faiss_fields.bin"), snapshot_path("field_meta.npz")
+    if not MULTI_VECTOR_ENABLED or not (os.path.exists(index_path) and os.path.exists(meta_path)):
+        return False
+    try:
+        with np.load(meta_path) as meta:
+            if str(meta["fingerprint"]) != content_fingerprint():
+                return False
+            parents, kinds = meta["parents"], meta["kinds"]
+        field_index, field_parents, field_kinds = open_index(index_path), parents, kinds
+        rebuild_field_lookup()
+        return True
+    except Exception as e:
+        print(f"⚠️ Alan index'i yüklenemedi: {e}")
+        return False
+
+
+async def field_aggregate_search(
+    query_embedding: np.ndarray,
+    k: int,
+    tur: Optional[str] = None,
+    weights: Optional[Dict[str, float]] = None,
+    aggregation: Literal["sum", "max"] = "sum"
+) -> List[Tuple[int, float]]:
+    """
+    Genel + alan vektörleri üzerinde arama. Aday içerikler iki index'ten toplanır,
+    her aday için alan başına en yüksek skor alınır ve ağırlıklarla birleştirilir
+    ("sum": ağırlıklı ortalama, "max": en yüksek ağırlıklı alan skoru).
+    """
+    weights = {**DEFAULT_FIELD_WEIGHTS, **(weights or {})}
+    field_names = ["genel"] + list(FIELD_KINDS)
+    weight_arr = np.array([max(weights.get(name, 0.0), 0.0) for name in field_names], dtype=np.float32)
+    if weight_arr.sum() <= 0:
+        return await search_vectors(query_embedding, k, tur=tur)
+
+    # Aday toplama
+    candidates = {pos for pos, _ in await search_vectors(query_embedding, k, tur=tur)}
+    params = None
+    selector = None
+    available = field_index.ntotal
+    if tur:
+        rows = field_tur_rows.get(tur.lower())
+        available = 0 if rows is None else len(rows)
+        if available:
+            selector = faiss.IDSelectorBatch(rows)
+            params = faiss.SearchParameters(sel=selector)
+    if available:
+        started = time.perf_counter()
+        _, row_ids = field_index.search(query_embedding, min(k * FIELD_CANDIDATE_FACTOR, available), params=params)
+        observe_stage("field_search", started)
+        candidates.update(int(field_parents[row]) for row in row_ids[0] if row != -1)
+    if not candidates:
+        return []
+
+    # Aday başına alan skorları: [genel, baslik, aciklama]; eksik alan -inf kalır.
+    # Arama await'i sırasında index değiştiyse artık olmayan pozisyonlar düşer.
+    candidate_arr = np.array(sorted(candidates), dtype=np.int64)
+    candidate_arr = candidate_arr[candidate_arr < index.ntotal]
+    field_scores = np.full((len(candidate_arr), len(field_names)), -np.inf, dtype=np.float32)
+    field_scores[:, 0] = get_index_vectors()[candidate_arr] @ query_embedding[0]
+
+    # Adayların tüm pasaj satırları tek matris çarpımında skorlanır, alan başına max maximum.at ile alınır
+    starts = field_offsets[candidate_arr]
+    lengths = field_offsets[candidate_arr + 1] - starts
+    owners = np.repeat(np.arange(len(candidate_arr)), lengths)
+    flat_starts = np.cumsum(lengths) - lengths  # Adayın satırlarının düz dizideki başlangıcı
+    rows = field_order[np.repeat(starts - flat_starts, lengths) + np.arange(lengths.sum())]
+    if len(rows):
+        kind_columns = np.zeros(max(FIELD_KINDS.values()) + 1, dtype=np.int64)
+        for name, kind in FIELD_KINDS.items():
+            kind_columns[kind] = field_names.index(name)
+        scores = get_index_vectors(field_index)[rows] @ query_embedding[0]
+        np.maximum.at(field_scores, (owners, kind_columns[field_kinds[rows]]), scores)
+
+    # Olmayan alanın ağırlığı o aday için dağıtılmaz, sadece mevcut alanlar sayılır
+    present = np.isfinite(field_scores)
+    effective = weight_arr[None, :] * present
+    if aggregation == "max":
+        aggregated = np.where(present, field_scores * weight_arr[None, :] / weight_arr.max(), -np.inf).max(axis=1)
+    else:
+        aggregated = (np.where(present, field_scores, 0.0) * effective).sum(axis=1) / np.maximum(effective.sum(axis=1), 1e-6)
+
+    order = np.argsort(-aggregated, kind="stable")[:k]
+    return [(int(candidate_arr[i]), float(aggregated[i])) for i in order]
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Uygulama başlarken modeli yükle"""
+    global model_name, migration_task, snapshot_generation, snapshot_watch_task
+    if SHARED_INDEX_DIR:
+        try:
+            import fcntl  # noqa: F401
+        except ImportError:
+            raise RuntimeError("SHARED_INDEX_DIR bu platformda desteklenmiyor (fcntl dosya kilidi gerekir)")
+        os.makedirs(SHARED_INDEX_DIR, exist_ok=True)
+        snapshot_generation = read_current_generation()
+    else:
+        finish_pending_checkpoint()
+    has_index = os.path.exists(snapshot_path("faiss_index.bin")) and os.path.exists(snapshot_path("content_data.json"))
+    
+    # Kayıtlı index başka bir modelle kurulduysa, o modelle servis vermeye devam et
+    # ve ayarlanan modele arka planda geçiş başlat
+    stored_model = read_index_meta().get("model", LEGACY_EMBEDDING_MODEL) if has_index else EMBEDDING_MODEL_NAME
+    model_name = stored_model
+    
+    load_model()
+    load_intent_router()
+    if RERANK_ENABLED:
+        load_rerank_model()
+    start_shards()
+    
+    # Eğer önceden kaydedilmiş index varsa yükle
+    if has_index:
+        load_index_from_disk()
+        if SHARED_INDEX_DIR and snapshot_generation is None and index is not None:
+            # Tek worker düzeninden kalan dosyalar: ilk nesil olarak yayınla
+            async with snapshot_writer():
+                if snapshot_generation is None:
+                    await save_index_to_disk()
+        # Çok worker'da geçişi sadece bir worker başlatır, diğerleri yeni nesli izler
+        if stored_model != EMBEDDING_MODEL_NAME and index is not None and claim_snapshot_job("migrate"):
+            print(f"🔄 Index {stored_model} ile kurulmuş, {EMBEDDING_MODEL_NAME} modeline geçiş başlatılıyor")
+            migration_task = asyncio.create_task(migrate_embedding_model(EMBEDDING_MODEL_NAME))
+    
+    if INDEX_WAL_ENABLED and not SHARED_INDEX_DIR:
+        open_index_wal(has_index)
+    if SHARED_INDEX_DIR:
+        snapshot_watch_task = asyncio.create_task(watch_snapshots())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Shard süreçlerini ve embedding worker'ını kapat; bekleyen WAL kayıtlarını snapshot'a yaz"""
+    stop_shards()
+    if embedding_batcher.worker is not None:
+        embedding_batcher.worker.cancel()
+    if checkpoint_task is not None:
+        checkpoint_task.cancel()
+    if index_wal.active:
+        if index_wal.pending_records and index is not None:
+            await save_index_to_disk()  # Sonraki açılışta tekrar edilecek kayıt kalmaz
+        index_wal.close()
+
+
+def load_index_from_disk() -> bool:
+    """Disk'ten index ve veri yükle"""
+    global neighbor_table_pending
+    try:
+        loaded_index = open_index(snapshot_path("faiss_index.bin"))
+        with open(snapshot_path("content_data.json"), "r", encoding="utf-8") as f:
+            loaded_data = json.load(f)
+        swap_index(loaded_index, loaded_data)
+        rebuild_derived_indexes(refresh_neighbors=False)
+        neighbor_table_pending = False
+        if not load_neighbor_table_from_disk():
+            if claim_snapshot_job("neighbors"):
+                schedule_neighbor_refresh()
+            else:
+                neighbor_table_pending = True  # Başka worker hesaplıyor, yayınlanınca yüklenir
+        if MULTI_VECTOR_ENABLED and not load_field_index_from_disk():
+            load_model()
+            update_field_index()
+        print(f"✅ Index yüklendi: {len(content_data)} içerik")
+        return True
+    except Exception as e:
+        print(f"⚠️ Index yüklenemedi: {e}")
+        return False
+
+
+async def save_index_to_disk():
+    """Index ve veriyi disk'e kaydet (paylaşımlı modda yeni nesil, tek worker'da sıradaki checkpoint)"""
+    if not SHARED_INDEX_DIR:
+        if await checkpoint_index():
+            print(f"✅ Index kaydedildi: {len(content_data)} içerik")
+        return
+    try:
+        publish_snapshot()
+    except Exception as e:
+        print(f"⚠️ Index kaydedilemedi: {e}")
+
+
+# ===== Index Kalıcılığı (WAL + Checkpoint) =====
+# Tek worker düzeninde upsert'ler tüm index'i yeniden yazmaz: değişen içerikler vektörleriyle
+# birlikte append-only bir log'a (CRC'li, sıra numaralı kayıt + fdatasync) eklenir. Arka plan
+# checkpoint'i log belli boyuta ya da yaşa ulaşınca durumu tmp dosyalara yazar, hepsini tek
+# adımda yerine koyar ve snapshot'ın kapsadığı log segmentlerini siler. Açılışta snapshot
+# yüklenir, ardından log'daki daha yeni kayıtlar yeniden encode etmeden uygulanır.
+# Paylaşımlı modda (SHARED_INDEX_DIR) her yazma zaten yeni nesil yayınladığı için WAL kullanılmaz.
+INDEX_WAL_ENABLED = os.environ.get("INDEX_WAL_ENABLED", "true").lower() == "true"
+INDEX_WAL_DIR = os.environ.get("INDEX_WAL_DIR", "index_wal")
+INDEX_WAL_FSYNC = os.environ.get("INDEX_WAL_FSYNC", "true").lower() == "true"
+INDEX_CHECKPOINT_BYTES = int(os.environ.get("INDEX_CHECKPOINT_BYTES", str(64 * 1024 * 1024)))  # Log bu boyutu aşınca checkpoint
+INDEX_CHECKPOINT_SECONDS = float(os.environ.get("INDEX_CHECKPOINT_SECONDS", "300"))  # Bekleyen kayıt varsa en geç bu sürede
+CHECKPOINT_PENDING_PATH = "checkpoint.pending"  # Varsa tmp dosyaların hepsi yazılmış, yerine konmayı bekliyor
+WAL_RECORD_HEADER = struct.Struct("<II")  # payload uzunluğu, crc32
+
+checkpoint_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")  # Checkpoint'ler alındıkları sırayla yazılır
+checkpoint_task: Optional[asyncio.Task] = None
+checkpoint_counter = 0  # Alınan son checkpoint'in numarası (event loop)
+checkpoint_written = 0  # Diske yazılan son checkpoint'in numarası (checkpoint thread'i)
+
+
+class WriteAheadLog:
+    """
+    Segment dosyalarından (wal-<ilk seq>.log) oluşan append-only log.
+    Kayıt: uzunluk + crc32 + payload; payload bir satır JSON başlık ve ardından ham float32 vektörler.
+    """
+
+    def __init__(self, directory: str, fsync: bool):
+        self.directory, self.fsync = directory, fsync
+        self.last_seq = 0
+        self.segment = None  # Aktif segmentin dosya nesnesi; None ise log kapalı
+        self.segment_start = 1
+        self.pending_records = 0  # Son checkpoint'ten beri eklenen kayıt/bayt
+        self.pending_bytes = 0
+        self.last_checkpoint = time.monotonic()
+
+    @property
+    def active(self) -> bool:
+        return self.segment is not None
+
+    def segments(self) -> List[Tuple[int, str]]:
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith("wal-") and name.endswith(".log"))
+        return [(int(name[4:-4]), os.path.join(self.directory, name)) for name in names]
+
+    def read(self, after_seq: int) -> Iterator[Tuple[dict, bytes]]:
+        """after_seq'ten sonraki kayıtlar; yarım yazılmış kuyruk kesilir ve okuma orada biter"""
+        for _, path in self.segments():
+            with open(path, "r+b") as f:
+                offset = 0
+                while True:
+                    head = f.read(WAL_RECORD_HEADER.size)
+                    if not head:
+                        break
+                    payload = b""
+                    if len(head) == WAL_RECORD_HEADER.size:
+                        length, crc = WAL_RECORD_HEADER.unpack(head)
+                        payload = f.read(length)
+                    if len(head) < WAL_RECORD_HEADER.size or len(payload) < length or zlib.crc32(payload) != crc:
+                        print(f"⚠️ WAL {path}: {offset}. bayttan sonrası eksik/bozuk, kesiliyor")
+                        f.truncate(offset)
+                        return
+                    offset += WAL_RECORD_HEADER.size + length
+                    header, _, body = payload.partition(b"\n")  # Başlık JSON'u tek satır (ham \n içermez)
+                    header = json.loads(header)
+                    self.last_seq = max(self.last_seq, header["seq"])
+                    if header["seq"] > after_seq:
+                        yield header, body
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.roll()
+
+    def roll(self):
+        """Yeni segmente geç; öncekiler onları kapsayan checkpoint bitince silinir"""
+        if self.segment is not None:
+            self.segment.close()
+        self.segment_start = self.last_seq + 1
+        self.segment = open(os.path.join(self.directory, f"wal-{self.segment_start:012d}.log"), "ab")
+
+    def append(self, header: dict, body: bytes) -> int:
+        started = time.perf_counter()
+        self.last_seq += 1
+        header["seq"] = self.last_seq
+        payload = json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n" + body
+        record = WAL_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        self.segment.write(record)
+        self.segment.flush()
+        if self.fsync:
+            getattr(os, "fdatasync", os.fsync)(self.segment.fileno())  # fdatasync Windows/macOS'ta yok
+        self.pending_records += 1
+        self.pending_bytes += len(record)
+        observe_stage("wal_append", started)
+        return self.last_seq
+
+    def discard_before(self, segment_start: int):
+        """segment_start'tan önce başlayan (checkpoint'e girmiş) segmentleri sil"""
+        if not self.active:
+            return
+        for start, path in self.segments():
+            if start < segment_start:
+                os.remove(path)
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+
+index_wal = WriteAheadLog(INDEX_WAL_DIR, INDEX_WAL_FSYNC)
+
+
+def log_index_upsert(items: List[dict], embeddings: np.ndarray, positions: List[int], fields: Optional[tuple]):
+    """Uygulanmış bir upsert'ü vektörleriyle log'a yaz; alanların parent'ı items satırı olarak saklanır"""
+    header = {"op": "upsert", "model": model_name, "dim": int(embeddings.shape[1]), "count": len(items), "items": items}
+    body = [np.ascontiguousarray(embeddings, dtype="<f4").tobytes()]
+    if fields is not None:
+        field_vectors, parents, kinds = fields
+        row_of = {pos: row for row, pos in enumerate(positions)}
+        header["fields"] = {"count": len(parents), "rows": [row_of[int(pos)] for pos in parents], "kinds": kinds.tolist()}
+        body.append(np.ascontiguousarray(field_vectors, dtype="<f4").tobytes())
+    index_wal.append(header, b"".join(body))
+
+
+def apply_wal_record(header: dict, body: bytes) -> List[int]:
+    """Log kaydını uygula (türetilmiş index'ler çağıranda bir kez güncellenir); değişen pozisyonlar"""
+    if header["op"] != "upsert":
+        print(f"⚠️ Bilinmeyen WAL kaydı atlandı: {header['op']} (seq {header['seq']})")
+        return []
+    items, count, dim = header["items"], header["count"], header["dim"]
+    vectors = np.frombuffer(body, dtype="<f4", count=count * dim).reshape(count, dim).astype(np.float32)
+    if header["model"] != model_name or (index is not None and dim != index.d):
+        vectors = encode_contents(items)  # Kayıt başka modelle yazılmış: vektörler kullanılamaz
+        header.pop("fields", None)
+    positions = apply_upsert(items, vectors)
+    if MULTI_VECTOR_ENABLED and field_index is not None:
+        fields = None
+        if "fields" in header:
+            meta = header["fields"]
+            field_vectors = np.frombuffer(body, dtype="<f4", count=meta["count"] * dim, offset=count * dim * 4)
+            fields = (
+                field_vectors.reshape(meta["count"], dim).astype(np.float32),
+                np.array(positions, dtype=np.int32)[np.array(meta["rows"], dtype=np.int64)],
+                np.array(meta["kinds"], dtype=np.int8),
+            )
+        update_field_index(positions, fields, lookup=False)
+    return positions
+
+
+def replay_index_wal(after_seq: int) -> int:
+    """Snapshot'tan (after_seq) sonraki log kayıtlarını uygula; uygulanan kayıt sayısı"""
+    index_wal.last_seq = max(index_wal.last_seq, after_seq)  # Yeni kayıtlar snapshot'tan sonra numaralanır
+    changed = set()
+    replayed = 0
+    for header, body in index_wal.read(after_seq):
+        changed.update(apply_wal_record(header, body))
+        replayed += 1
+        index_wal.pending_records += 1
+        index_wal.pending_bytes += WAL_RECORD_HEADER.size + len(body)
+    if replayed:
+        rebuild_derived_indexes(changed_positions=sorted(changed))
+        if MULTI_VECTOR_ENABLED and field_index is not None:
+            rebuild_field_lookup()
+        else:
+            update_field_index()
+        print(f"✅ WAL'dan {replayed} kayıt uygulandı ({len(changed)} içerik)")
+    return replayed
+
+
+def open_index_wal(has_snapshot: bool):
+    """Açılışta log'u snapshot üzerine uygula ve yazmaya aç"""
+    global checkpoint_task
+    if has_snapshot and index is None:
+        # Snapshot okunamadıysa kayıtları boş index'e uygulamak veriyi eksik gösterir
+        print("⚠️ Snapshot yüklenemediği için WAL uygulanmadı; yazmalar tam kayıtla devam ediyor")
+        return
+    replay_index_wal(read_index_meta().get("wal_seq", 0) if has_snapshot else 0)
+    index_wal.open()
+    checkpoint_task = asyncio.create_task(checkpoint_loop())
+
+
+def finish_pending_checkpoint():
+    """Yarıda kalmış checkpoint'i tamamla: marker varsa tmp dosyaların hepsi fsync'li yazılmıştır"""
+    if not os.path.exists(CHECKPOINT_PENDING_PATH):
+        return
+    with open(CHECKPOINT_PENDING_PATH, "r", encoding="utf-8") as f:
+        names = json.load(f)
+    for name in names:
+        if os.path.exists(name + ".tmp"):
+            os.replace(name + ".tmp", name)
+    os.remove(CHECKPOINT_PENDING_PATH)
+
+
+def capture_checkpoint_state() -> dict:
+    """
+    Checkpoint'e girecek durum (event loop thread'inde, await olmadan alınır).
+    Yayınlanmış index nesnelerinin mevcut satırları değişmediği için referans ve satır sayısı
+    yeterli; seri hale getirme checkpoint thread'inde yapılır. Log yeni segmente geçer,
+    sonraki yazmalar bu checkpoint'e girmez.
+    """
+    global checkpoint_counter
+    if index_wal.active:
+        index_wal.roll()
+    checkpoint_counter += 1
+    state = {
+        "number": checkpoint_counter,
+        "wal_seq": index_wal.last_seq,
+        "segment_start": index_wal.segment_start,
+        "pending": (index_wal.pending_records, index_wal.pending_bytes),
+        "index": index,
+        "content_data": content_data,
+        "meta": {"model": model_name, "dimension": index.d, "count": index.ntotal, "wal_seq": index_wal.last_seq},
+        "fields": (field_index, field_parents, field_kinds) if field_index is not None else None,
+    }
+    index_wal.pending_records = index_wal.pending_bytes = 0
+    index_wal.last_checkpoint = time.monotonic()
+    return state
+
+
+def write_checkpoint(state: dict) -> bool:
+    """
+    Durumu tmp dosyalara yaz ve hepsini yerine koy (checkpoint thread'inde).
+    Diske daha yeni bir checkpoint yazılmışsa eskisi atlanır; False döner.
+    """
+    global checkpoint_written
+    if state["number"] < checkpoint_written:
+        return False
+    started = time.perf_counter()
+    files = {
+        "faiss_index.bin": faiss.serialize_index(index_prefix(state["index"], state["meta"]["count"])).tobytes(),
+        "content_data.json": json.dumps(state["content_data"], ensure_ascii=False).encode("utf-8"),
+        INDEX_META_PATH: json.dumps(state["meta"]).encode("utf-8"),
+    }
+    if state["fields"] is not None:
+        source, parents, kinds = state["fields"]
+        buffer = io.BytesIO()
+        np.savez(buffer, parents=parents, kinds=kinds, fingerprint=np.array(content_fingerprint(state["content_data"])))
+        files["faiss_fields.bin"] = faiss.serialize_index(index_prefix(source, len(parents))).tobytes()
+        files["field_meta.npz"] = buffer.getvalue()
+    for name, data in list(files.items()) + [(CHECKPOINT_PENDING_PATH, json.dumps(list(files)).encode("utf-8"))]:
+        with open(name + ".tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(CHECKPOINT_PENDING_PATH + ".tmp", CHECKPOINT_PENDING_PATH)
+    finish_pending_checkpoint()
+    checkpoint_written = state["number"]
+    observe_stage("checkpoint", started)
+    return True
+
+
+async def checkpoint_index() -> bool:
+    """Checkpoint al: durum loop'ta yakalanır, dosyalar tek thread'li kuyrukta sırayla yazılır"""
+    state = capture_checkpoint_state()
+    try:
+        written = await run_in_executor(checkpoint_executor, write_checkpoint, state)
+    except Exception as e:
+        # Segmentler silinmedi; kayıtlar bir sonraki checkpoint'e kalır
+        index_wal.pending_records += state["pending"][0]
+        index_wal.pending_bytes += state["pending"][1]
+        print(f"⚠️ Checkpoint yazılamadı: {e}")
+        return False
+    index_wal.discard_before(state["segment_start"])
+    if written:
+        print(f"✅ Checkpoint yazıldı: {state['meta']['count']} içerik (WAL seq {state['wal_seq']})")
+    return written
+
+
+async def checkpoint_loop():
+    """Log boyut veya yaş eşiğini aşınca checkpoint al"""
+    while True:
+        await asyncio.sleep(1)
+        if index_wal.pending_records == 0 or index is None:
+            continue
+        age = time.monotonic() - index_wal.last_checkpoint
+        if index_wal.pending_bytes >= INDEX_CHECKPOINT_BYTES or age >= INDEX_CHECKPOINT_SECONDS:
+            await checkpoint_index()
+
+
+# ===== Paylaşımlı Index Nesilleri (Çok Worker) =====
+# uvicorn --workers N ile her worker'ın index'i ayrı kopyalaması yerine index,
+# SHARED_INDEX_DIR altında salt okunur nesiller (gen-*) olarak yazılır ve mmap ile açılır;
+# vektörler tüm worker'lar arasında page cache üzerinden paylaşılır. Yazan worker dosya
+# kilidiyle sıraya girer, önce son nesle geçer, değişikliği uygular ve yeni nesli CURRENT
+# ile yayınlar. Diğer worker'lar CURRENT'ı izleyip yeni nesle geçer.
+# Kapsam: sadece vektörler (ana ve alan index'i) paylaşılır. Model, content_data, BM25,
+# başlık önek index'i ve komşu tablosu her worker'da ayrıdır; bunlar worker sayısıyla artar.
+# Upsert'te yazan worker mmap'li index'i append_to_index ile geçici olarak belleğe kopyalar; kopya
+# yeni nesil yayınlanıp mmap'e geçilince bırakılır.
+# IO_FLAG_MMAP_IFC için faiss-cpu >= 1.10 gerekir.
+
+SHARED_INDEX_DIR = os.environ.get("SHARED_INDEX_DIR", "")  # Boş = tek worker, dosyalar çalışma dizininde
+SNAPSHOT_POLL_SECONDS = float(os.environ.get("SNAPSHOT_POLL_SECONDS", "2"))
+SNAPSHOT_KEEP = 3  # Silinmeden tutulan eski nesil sayısı
+
+snapshot_generation: Optional[str] = None  # Bu worker'ın kullandığı nesil
+snapshot_lock = asyncio.Lock()  # Worker içinde nesil geçişi ile yazmaları sıraya sokar
+snapshot_watch_task: Optional[asyncio.Task] = None
+neighbor_table_pending = False  # Komşu tablosunu başka worker hesaplıyor
+
+
+def snapshot_path(name: str) -> str:
+    """Dosyanın aktif nesildeki yolu (paylaşımlı mod kapalıysa çalışma dizini)"""
+    if SHARED_INDEX_DIR and snapshot_generation:
+        return os.path.join(SHARED_INDEX_DIR, snapshot_generation, name)
+    return name
+
+
+def read_current_generation() -> Optional[str]:
+    try:
+        with open(os.path.join(SHARED_INDEX_DIR, "CURRENT"), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def open_index(path: str):
+    """Paylaşımlı modda index'i mmap ile aç: vektörler kopyalanmaz, worker'lar aynı sayfaları kullanır"""
+    if not SHARED_INDEX_DIR:
+        return faiss.read_index(path)
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC)
+
+
+def claim_snapshot_job(name: str) -> bool:
+    """Aktif nesilde bir işi (komşu tablosu, model geçişi) tek worker'ın üstlenmesini sağla"""
+    if not SHARED_INDEX_DIR or snapshot_generation is None:
+        return True
+    try:
+        os.close(os.open(snapshot_path(f"{name}.claim"), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
+
+
+def publish_snapshot():
+    """Mevcut index'i yeni nesil olarak yaz, CURRENT'ı atomik güncelle ve kendi kopyası yerine mmap'e geç"""
+    global snapshot_generation, index, field_index
+    generation = f"gen-{time.time_ns()}-{os.getpid()}"
+    directory = os.path.join(SHARED_INDEX_DIR, generation)
+    os.makedirs(directory)
+    faiss.write_index(index, os.path.join(directory, "faiss_index.bin"))
+    with open(os.path.join(directory, "content_data.json"), "w", encoding="utf-8") as f:
+        json.dump(content_data, f, ensure_ascii=False)
+    with open(os.path.join(directory, INDEX_META_PATH), "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "dimension": index.d, "count": index.ntotal}, f)
+    save_field_index_to_disk(directory)
+    if SIMILAR_PRECOMPUTE_K > 0:
+        # Komşu tablosu bu worker'da hesaplanır; diğer worker'lar hazır olunca diskten yükler
+        open(os.path.join(directory, "neighbors.claim"), "w").close()
+
+    pointer_tmp = os.path.join(SHARED_INDEX_DIR, f"CURRENT.{os.getpid()}.tmp")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(generation)
+    # Komşu job'ı tabloyu kilit altında aktif nesle yazar: ya yeni nesli görür ya da tablo burada yazılır
+    with neighbor_lock:
+        os.replace(pointer_tmp, os.path.join(SHARED_INDEX_DIR, "CURRENT"))
+        snapshot_generation = generation
+        if SIMILAR_PRECOMPUTE_K > 0 and neighbor_ids is not None and neighbor_generation == index_generation:
+            save_neighbor_table(neighbor_ids, neighbor_scores, content_fingerprint(), snapshot_path(NEIGHBOR_TABLE_PATH))
+
+    index = open_index(os.path.join(directory, "faiss_index.bin"))
+    if field_index is not None and os.path.exists(os.path.join(directory, "faiss_fields.bin")):
+        field_index = open_index(os.path.join(directory, "faiss_fields.bin"))
+    prune_snapshots()
+    print(f"✅ Index nesli yayınlandı: {generation}")
+
+
+def prune_snapshots():
+    """Eski nesilleri sil (mmap'leyen worker'lar silinen dosyayı kapatana kadar kullanabilir)"""
+    generations = sorted(name for name in os.listdir(SHARED_INDEX_DIR) if name.startswith("gen-"))
+    for name in generations[:-(SNAPSHOT_KEEP + 1)]:
+        if name != snapshot_generation:
+            shutil.rmtree(os.path.join(SHARED_INDEX_DIR, name), ignore_errors=True)
+
+
+async def refresh_snapshot() -> bool:
+    """CURRENT yeni bir nesli gösteriyorsa ona geç; gerekirse o neslin modelini de yükle"""
+    global snapshot_generation, model, model_name, intent_labels, intent_centroids, nav_urls, nav_centroids
+    generation = read_current_generation()
+    if generation is None or generation == snapshot_generation:
+        return False
+    previous = (snapshot_generation, model, model_name, intent_labels, intent_centroids, nav_urls, nav_centroids)
+    stored_model = read_index_meta(os.path.join(SHARED_INDEX_DIR, generation)).get("model", model_name)
+    if stored_model != model_name:
+        loop = asyncio.get_running_loop()
+        encoder, intents, navigation = await loop.run_in_executor(None, load_encoder_bundle, stored_model)
+        model, model_name = encoder, stored_model
+        (intent_labels, intent_centroids), (nav_urls, nav_centroids) = intents, navigation
+    snapshot_generation = generation
+    if not load_index_from_disk():
+        # Yüklenemedi (ör. nesil silindi): eski duruma dön, bir sonraki kontrolde tekrar denenir
+        snapshot_generation, model, model_name, intent_labels, intent_centroids, nav_urls, nav_centroids = previous
+        return False
+    return True
+
+
+@asynccontextmanager
+async def snapshot_writer():
+    """Index yazma bölümü: worker'lar arası dosya kilidi alınır ve önce son nesle geçilir"""
+    if not SHARED_INDEX_DIR:
+        yield
+        return
+    import fcntl  # Sadece Unix; açılışta SHARED_INDEX_DIR bu yüzden kontrol edilir
+    async with snapshot_lock:
+        lock_file = open(os.path.join(SHARED_INDEX_DIR, "write.lock"), "w")
+        try:
+            await run_in_executor(None, fcntl.flock, lock_file, fcntl.LOCK_EX)
+            await refresh_snapshot()
+            yield
+        finally:
+            lock_file.close()  # Kilit dosya kapanınca bırakılır
+
+
+async def watch_snapshots():
+    """Diğer worker'ların yayınladığı nesilleri izle"""
+    global neighbor_table_pending
+    while True:
+        await asyncio.sleep(SNAPSHOT_POLL_SECONDS)
+        try:
+            async with snapshot_lock:
+                if await refresh_snapshot():
+                    print(f"🔄 Yeni index nesline geçildi: {snapshot_generation} ({len(content_data)} içerik)")
+                elif neighbor_table_pending and load_neighbor_table_from_disk():
+                    neighbor_table_pending = False
+        except Exception as e:
+            print(f"⚠️ Index nesli kontrol edilemedi: {e}")
+
+
+@app.get("/", response_model=HealthResponse)
+async def health_check():
+    """Sağlık kontrolü"""
+    return HealthResponse(
+        status="healthy",
+        model_loaded=model is not None,
         index_size=len(content_data),
-        llm_loaded=True  # HuggingFace Inference API kullanıyoruz, her zaman hazır
+        llm_loaded=USE_GROQ or llm_pipe is not None,
+        embedding_model=model_name,
+        shard_count=len(shard_conns) if shards_ready else 0,
+        snapshot=snapshot_generation
     )
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrikleri"""
+    gauges = [
+        ("saga_requests_in_flight", "İşlenmekte olan istek sayısı", requests_in_flight),
+        ("saga_llm_in_flight", "Çalışan LLM çağrısı sayısı", llm_in_flight),
+        ("saga_index_items", "Index'teki içerik sayısı", len(content_data)),
+        ("saga_index_generation", "Index değişiklik sayacı", index_generation),
+        ("saga_field_index_rows", "Alan index'indeki satır sayısı", field_index.ntotal if field_index is not None else 0),
+        ("saga_neighbor_table_items", "Komşu tablosundaki içerik sayısı", len(neighbor_ids) if neighbor_ids is not None else 0),
+        ("saga_rerank_cache_items", "Rerank cache'indeki skor sayısı", len(rerank_cache)),
+        ("saga_rerank_pending", "Executor'da bekleyen/çalışan rerank işi", rerank_pending),
+        ("saga_embedding_cache_items", "Embedding cache'indeki vektör sayısı", len(embedding_cache)),
+        ("saga_wal_pending_records", "Son checkpoint'ten beri WAL'a yazılan kayıt", index_wal.pending_records),
+        ("saga_wal_pending_bytes", "Son checkpoint'ten beri WAL'a yazılan bayt", index_wal.pending_bytes),
+        ("saga_shards_active", "Aktif shard süreci sayısı", len(shard_conns) if shards_ready else 0),
+        ("saga_inflight_calls", "Single-flight altında çalışan çağrı sayısı", len(inflight_calls)),
+        ("saga_llm_free_slots", "Gateway'de boş LLM slotu", llm_gateway.free_slots),
+    ]
+    lines: List[str] = []
+    for name, help_text, value in gauges:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+    lines += ["# HELP saga_llm_queue_depth Öncelik sınıfına göre bekleyen LLM çağrısı", "# TYPE saga_llm_queue_depth gauge"]
+    lines += [f'saga_llm_queue_depth{{priority="{priority}"}} {len(queue)}' for priority, queue in llm_gateway.queues.items()]
+    lines += ["# HELP saga_embed_queue_depth Encode bekleyen metin sayısı", "# TYPE saga_embed_queue_depth gauge"]
+    lines += [f'saga_embed_queue_depth{{priority="{priority}"}} {len(queue)}' for priority, queue in embedding_batcher.queues.items()]
+    for metric in (STAGE_SECONDS, REQUEST_SECONDS, REQUESTS_TOTAL, CACHE_REQUESTS, GROQ_RESPONSES, FALLBACKS, COALESCED, LLM_ADMITTED, LLM_SHED, STRUCTURED_OUTPUTS, EMBED_BATCH_SIZES):
+        lines += metric.render()
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def check_admin_token(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoint'leri kapalı (ADMIN_TOKEN tanımlı değil)")
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Geçersiz admin token")
+
+
+@app.get("/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """Bellekteki profillerin özeti (en yenisi önce)"""
+    check_admin_token(x_admin_token)
+    summary_keys = ("id", "timestamp", "method", "path", "endpoint", "status", "reason", "mode", "duration_ms", "stages_ms")
+    return {
+        "enabled": PROFILING_ENABLED,
+        "mode": PROFILE_MODE,
+        "sample_rate": PROFILE_SAMPLE_RATE,
+        "slow_ms": PROFILE_SLOW_MS,
+        "profiles": [{key: profile.get(key) for key in summary_keys} for profile in reversed(profiles)],
+    }
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: int, format: str = "json", x_admin_token: Optional[str] = Header(None)):
+    """Tek profil; format=collapsed katlanmış yığınları flamegraph/speedscope formatında döndürür"""
+    check_admin_token(x_admin_token)
+    profile = next((profile for profile in profiles if profile["id"] == profile_id), None)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profil bulunamadı (buffer'dan düşmüş olabilir)")
+    if format == "collapsed":
+        if profile["mode"] == "cprofile":
+            return PlainTextResponse(profile["stats"])
+        return PlainTextResponse("".join(f"{stack} {count}\n" for stack, count in profile["stacks"]))
+    return profile
+
+
+@app.get("/admin/prompts")
+async def list_prompts(x_admin_token: Optional[str] = Header(None)):
+    """Kayıtlı prompt şablonları: versiyon, slotlar ve statik token sayıları"""
+    check_admin_token(x_admin_token)
+    return {
+        "prompts": [
+            {
+                "name": template.name,
+                "version": template.version,
+                "slots": list(dict.fromkeys(template.slots)),
+                "static_tokens": template.static_tokens,
+                "prefix_tokens": template.prefix_tokens,
+            }
+            for template in PROMPTS.templates.values()
+        ]
+    }
+
+
+def encode_contents(items: List[dict], encoder=None) -> np.ndarray:
+    """İçerikler için normalize embedding matrisi"""
+    encoder = encoder or model
+    started = time.perf_counter()
+    texts = [create_search_text(item) for item in items]
+    embeddings = encoder.encode(texts, convert_to_numpy=True, show_progress_bar=len(texts) > 100).astype(np.float32)
+    faiss.normalize_L2(embeddings)
+    observe_stage("index_encode", started)
+    return embeddings
+
+
+def upsert_contents(items: List[dict]) -> List[int]:
+    """Verilen içerikleri encode edip index'e ekle/güncelle; sadece bunlar encode edilir."""
+    return apply_upsert(items, encode_contents(items))
+
+
+def apply_upsert(items: List[dict], embeddings: np.ndarray) -> List[int]:
+    """
+    Hazır vektörlerle upsert (WAL tekrarı da bunu kullanır): mevcut id'lerin vektörü
+    güncellenir, yeni id'ler sona eklenir. Sadece yeni id'ler geldiyse index kopyalanmaz,
+    satırlar append_to_index ile eklenir. Mevcut satırlar yayınlanmış nesnede
+    değiştirilemediği için güncelleme içeren upsert'ler index'i kopyalar (O(N)).
+    Her içeriğin pozisyonunu items sırasıyla döndürür.
+    """
+    global index_reserve
+    new_data = list(content_data) if index is not None else []
+    positions: List[int] = [0] * len(items)
+    updated: List[Tuple[int, int]] = []
+    new_rows: List[int] = []
+    for row, item in enumerate(items):
+        pos = id_positions.get(item['id']) if index is not None else None
+        if pos is not None:
+            updated.append((row, pos))
+            new_data[pos] = item
+            positions[row] = pos
+        else:
+            new_rows.append(row)
+
+    new_index = index
+    if updated:
+        new_index, capacity = reserve_index(index, index.d, index.ntotal + len(new_rows))
+        rows, targets = zip(*updated)
+        get_index_vectors(new_index)[list(targets)] = embeddings[list(rows)]  # Kopya henüz yayınlanmadı
+        index_reserve = (weakref.ref(new_index), capacity)
+    if new_rows or new_index is None:
+        start = len(new_data)
+        new_index, index_reserve = append_to_index(new_index, index_reserve, embeddings[new_rows])
+        for offset, row in enumerate(new_rows):
+            new_data.append(items[row])
+            positions[row] = start + offset
+            id_positions[items[row]['id']] = start + offset  # Tekrar sırasında sonraki kayıtlar da bulabilsin
+    swap_index(new_index, new_data)
+    return positions
+
+
 @app.post("/index", response_model=dict)
 async def index_contents(request: IndexRequest):
-    """İçerikleri indexle (embedding oluştur)"""
+    """İçerikleri indexle (embedding oluştur). mode="upsert" ile artımlı güncelleme."""
     global index, content_data
     
     if not request.contents:
         raise HTTPException(status_code=400, detail="İçerik listesi boş")
+    if request.mode not in ("replace", "upsert"):
+        raise HTTPException(status_code=400, detail="mode 'replace' veya 'upsert' olmalı")
     
     load_model()
     
-    # İçerikleri hazırla
-    content_data = [item.dict() for item in request.contents]
-    texts = [create_search_text(item) for item in content_data]
-    
-    print(f"🔄 {len(texts)} içerik için embedding oluşturuluyor...")
+    # Aynı istekte tekrar eden id'lerde son gelen geçerli
+    items = list({item.id: item.dict() for item in request.contents}.values())
     
-    # Embedding oluştur
-    embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
+    print(f"🔄 {len(items)} içerik için embedding oluşturuluyor ({request.mode})...")
     
-    # Normalize et (cosine similarity için)
-    faiss.normalize_L2(embeddings)
-    
-    # FAISS index oluştur
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dimension)  # Inner Product = Cosine Similarity (normalized için)
-    index.add(embeddings)
-    
-    # Disk'e kaydet
-    save_index_to_disk()
+    # Çok worker'da yazmalar sıraya girer ve son nesil üzerine uygulanır
+    async with snapshot_writer():
+        incremental = request.mode == "upsert" and index is not None
+        # Encode embed worker'ında, index'e dokunmadan önce yapılır: tokenizer tek thread'de
+        # kalır, loop beklerken /search ve /embed sürer
+        embeddings = await run_in_executor(embed_executor, encode_contents, items)
+        fields = None
+        if MULTI_VECTOR_ENABLED and (field_index is not None or not incremental):
+            fields = await run_in_executor(embed_executor, encode_fields, items, list(range(len(items))))
+        if incremental:
+            changed = apply_upsert(items, embeddings)
+            rebuild_derived_indexes(changed_positions=changed)
+            if fields is not None:
+                fields = (fields[0], np.array(changed, dtype=np.int32)[fields[1]], fields[2])  # Satır -> pozisyon
+            update_field_index(changed, fields)
+        else:
+            # Tüm index'i yeniden kur
+            new_index = faiss.IndexFlatIP(embeddings.shape[1])  # Inner Product = Cosine Similarity (normalized için)
+            new_index.add(embeddings)
+            swap_index(new_index, items)
+            changed = list(range(len(items)))
+            rebuild_derived_indexes()
+            update_field_index(fields=fields)
+        
+        # Disk'e kaydet: tek worker'da upsert sadece WAL'a eklenir, snapshot'ı checkpoint yazar
+        if incremental and index_wal.active:
+            log_index_upsert(items, embeddings, changed, fields)
+        else:
+            await save_index_to_disk()
     
-    print(f"✅ Index oluşturuldu: {index.ntotal} içerik")
+    print(f"✅ Index güncellendi: {index.ntotal} içerik")
     
     return {
         "success": True,
         "indexed_count": len(content_data),
-        "dimension": dimension
+        "changed_count": len(changed),
+        "dimension": index.d
     }
 
 
+# ===== Cross-Encoder Yeniden Sıralama =====
+# İlk N FAISS adayı tek batch forward pass ile cross-encoder'dan geçer. İstek başına
+# sert süre bütçesi aşılırsa bi-encoder sırası döner; geç gelen skorlar yine cache'e yazılır.
+# Kuyruk sınırlıdır: RERANK_MAX_PENDING iş bekliyorsa rerank atlanır, sırası geldiğinde
+# bütçesi çoktan dolmuş iş modeli hiç çalıştırmadan düşer.
+RERANK_ENABLED = os.environ.get("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL_NAME = os.environ.get("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_TOP_N = int(os.environ.get("RERANK_TOP_N", "20"))
+RERANK_BUDGET_MS = float(os.environ.get("RERANK_BUDGET_MS", "150"))
+RERANK_CACHE_SIZE = int(os.environ.get("RERANK_CACHE_SIZE", "20000"))
+RERANK_MAX_PENDING = int(os.environ.get("RERANK_MAX_PENDING", "4"))  # Executor'da bekleyen/çalışan en fazla predict
+RERANK_PASSAGE_CHARS = 500
+
+rerank_model = None
+rerank_loading = False
+rerank_cache: "OrderedDict[Tuple[str, int], float]" = OrderedDict()  # (normalize sorgu, içerik id) -> skor
+rerank_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+rerank_pending = 0
+
+
+def load_rerank_model():
+    """Cross-encoder modelini yükle (bloklayıcı)"""
+    global rerank_model, rerank_loading
+    if rerank_model is None:
+        print(f"🔄 Cross-encoder yükleniyor: {RERANK_MODEL_NAME}")
+        try:
+            from sentence_transformers import CrossEncoder
+            rerank_model = CrossEncoder(RERANK_MODEL_NAME)
+            print("✅ Cross-encoder yüklendi!")
+        except Exception as e:
+            print(f"❌ Cross-encoder yüklenemedi: {e}")
+        finally:
+            rerank_loading = False
+    return rerank_model
+
+
+def _store_rerank_scores(keys: List[Tuple[str, int]], scores) -> None:
+    for key, score in zip(keys, scores):
+        rerank_cache[key] = float(score)
+        rerank_cache.move_to_end(key)
+    while len(rerank_cache) > RERANK_CACHE_SIZE:
+        rerank_cache.popitem(last=False)
+
+
+async def rerank_candidates(query: str, ranked: List[Tuple[int, float]]) -> Tuple[List[Tuple[int, float]], Dict[int, float]]:
+    """
+    İlk RERANK_TOP_N adayı cross-encoder skoruna göre yeniden sırala.
+    (yeni sıralama, pozisyon -> cross-encoder skoru) döndürür; bütçe aşılırsa sıralama değişmez.
+    """
+    global rerank_loading, rerank_pending
+    loop = asyncio.get_running_loop()
+    if rerank_model is None:
+        # Model yüklemesi istek yolunu bloklamasın: arka planda başlat, bu istek atlanır
+        if not rerank_loading:
+            rerank_loading = True
+            loop.run_in_executor(rerank_executor, load_rerank_model)
+        return ranked, {}
+
+    head, tail = ranked[:RERANK_TOP_N], ranked[RERANK_TOP_N:]
+    normalized_query = normalize_text(query)
+    keys = [(normalized_query, content_data[pos].get('id', pos)) for pos, _ in head]
+
+    missing = [i for i, key in enumerate(keys) if key not in rerank_cache]
+    CACHE_REQUESTS.inc("rerank", "hit", amount=len(keys) - len(missing))
+    CACHE_REQUESTS.inc("rerank", "miss", amount=len(missing))
+    if missing:
+        if rerank_pending >= RERANK_MAX_PENDING:
+            # Kuyruk dolu: beklemek bütçeyi zaten aşar, bi-encoder sırası kullanılır
+            return ranked, {}
+        pairs = [
+            (query, f"{content_data[head[i][0]].get('baslik', '')}. {content_data[head[i][0]].get('aciklama', '')[:RERANK_PASSAGE_CHARS]}")
+            for i in missing
+        ]
+        missing_keys = [keys[i] for i in missing]
+        deadline = time.monotonic() + RERANK_BUDGET_MS / 1000
+
+        def predict():
+            if time.monotonic() > deadline:
+                return None  # Kuyrukta bütçesi doldu, istek bi-encoder sırasıyla döndü
+            started = time.perf_counter()
+            scores = rerank_model.predict(pairs, batch_size=len(pairs))
+            observe_stage("rerank_model", started)
+            return scores
+
+        rerank_pending += 1
+        future = run_in_executor(rerank_executor, predict)
+        # Bütçe aşılsa bile başlamış hesaplama bitince skorlar cache'e yazılsın
+        # (shield'dan önce eklenen callback, bekleyen coroutine'den önce çalışır)
+        def on_done(done_future):
+            global rerank_pending
+            rerank_pending -= 1
+            if not done_future.cancelled() and done_future.exception() is None and done_future.result() is not None:
+                _store_rerank_scores(missing_keys, done_future.result())
+        future.add_done_callback(on_done)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=RERANK_BUDGET_MS / 1000)
+        except asyncio.TimeoutError:
+            print(f"⏱️ Rerank bütçesi aşıldı ({RERANK_BUDGET_MS:.0f} ms), bi-encoder sırası kullanılıyor")
+            return ranked, {}
+        except Exception as e:
+            print(f"⚠️ Rerank hatası: {e}")
+            return ranked, {}
+
+    cross_scores = {pos: rerank_cache[key] for (pos, _), key in zip(head, keys) if key in rerank_cache}
+    if len(cross_scores) < len(head):
+        return ranked, {}
+    for key in keys:
+        rerank_cache.move_to_end(key)
+    head = sorted(head, key=lambda hit: cross_scores[hit[0]], reverse=True)
+    return head + tail, cross_scores
+
+
+# ===== Embedding Modeli Geçişi (Dual Index) =====
+# Yeni modelle ikinci index arka planda kurulur, eski model/index servis vermeye devam eder;
+# hazır olunca event loop üzerinde tek adımda (istekler arasında) geçiş yapılır.
+migration_status = {"state": "idle", "model": None, "started_at": None, "finished_at": None, "error": None}
+migration_task: Optional[asyncio.Task] = None  # Referans tutulmazsa task GC ile kaybolabilir
+
+
+def read_index_meta(directory: Optional[str] = None) -> dict:
+    """Kayıtlı index'in model adı ve boyutu"""
+    path = os.path.join(directory, INDEX_META_PATH) if directory else snapshot_path(INDEX_META_PATH)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_encoder_bundle(new_model_name: str) -> Tuple[SentenceTransformer, tuple, tuple]:
+    """Model ve ona bağlı intent/navigasyon centroid'leri (arka plan thread'inde çalışır)"""
+    encoder = SentenceTransformer(new_model_name)
+    intents = _build_centroids(INTENT_EXAMPLES, encoder)
+    navigation = _build_centroids(
+        {url: target["examples"] for url, target in NAVIGATION_TARGETS.items()}, encoder
+    )
+    return encoder, intents, navigation
+
+
+def build_model_index(new_model_name: str, items: List[dict]) -> dict:
+    """Yeni model için tüm vektörleri üret (arka plan thread'inde çalışır)"""
+    encoder, intents, navigation = load_encoder_bundle(new_model_name)
+    vectors = encode_contents(items, encoder)
+    built = {"encoder": encoder, "items": items, "vectors": vectors, "intents": intents, "navigation": navigation}
+    if MULTI_VECTOR_ENABLED:
+        built["fields"] = encode_fields(items, list(range(len(items))), encoder)
+    return built
+
+
+def stale_positions(built: dict, items: List[dict]) -> Tuple[np.ndarray, List[int]]:
+    """
+    Kurulum sırasında değişen içerikleri bul. (eski satır eşlemesi, yeniden encode edilecek
+    pozisyonlar) döndürür; eşlemede -1 olan pozisyonların vektörü yok.
+    """
+    built_rows = {item.get('id'): (row, item) for row, item in enumerate(built["items"])}
+    row_map = np.full(len(items), -1, dtype=np.int64)
+    stale: List[int] = []
+    for pos, item in enumerate(items):
+        entry = built_rows.get(item.get('id'))
+        # Upsert sözlüğü değiştirir: aynı nesne ya da (başka worker'ın neslinden okunmuş) eşit içerik değişmemiştir
+        if entry is not None and (entry[1] is item or entry[1] == item):
+            row_map[pos] = entry[0]
+        else:
+            stale.append(pos)
+    return row_map, stale
+
+
+def prepare_model_cutover(built: dict, items: List[dict]) -> Tuple[dict, int]:
+    """
+    Kurulan vektörleri verilen içerik listesine hizala (arka plan thread'inde çalışır).
+    Kurulum sırasında değişen içerikler yeni modelle encode edilir, index'ler burada kurulur.
+    (items'a hizalanmış yeni kurulum, yeniden encode edilen içerik sayısı) döndürür.
+    """
+    encoder = built["encoder"]
+    row_map, stale = stale_positions(built, items)
+
+    vectors = np.zeros((len(items), built["vectors"].shape[1]), dtype=np.float32)
+    reused = np.flatnonzero(row_map >= 0)
+    vectors[reused] = built["vectors"][row_map[reused]]
+    if stale:
+        vectors[stale] = encode_contents([items[pos] for pos in stale], encoder)
+    new_index = faiss.IndexFlatIP(vectors.shape[1])
+    new_index.add(vectors)
+    prepared = {**built, "items": items, "vectors": vectors, "index": new_index}
+
+    if "fields" in built:
+        field_vectors, parents, kinds = built["fields"]
+        # Eski satır -> yeni pozisyon; değişen içeriklerin alanları yeniden encode edilir
+        remap = np.full(len(built["items"]), -1, dtype=np.int64)
+        remap[row_map[reused]] = reused
+        keep = remap[parents] >= 0
+        fresh_vectors, fresh_parents, fresh_kinds = encode_fields(items, stale, encoder)
+        field_vectors = np.concatenate([field_vectors[keep], fresh_vectors])
+        new_field_index = faiss.IndexFlatIP(vectors.shape[1])
+        new_field_index.add(field_vectors)
+        prepared["fields"] = (
+            field_vectors,
+            np.concatenate([remap[parents[keep]].astype(np.int32), fresh_parents]),
+            np.concatenate([kinds[keep], fresh_kinds])
+        )
+        prepared["field_index"] = new_field_index
+    return prepared, len(stale)
+
+
+def cutover_model_index(prepared: dict, new_model_name: str, reencoded: int):
+    """Hazırlanan model ve index'e tek adımda geç (event loop'ta, content_data değişmeden çağrılır)"""
+    global model, model_name, field_index, field_parents, field_kinds
+    global intent_labels, intent_centroids, nav_urls, nav_centroids
+    if "fields" in prepared:
+        field_index = prepared["field_index"]
+        _, field_parents, field_kinds = prepared["fields"]
+    else:
+        field_index = None
+
+    model, model_name = prepared["encoder"], new_model_name
+    swap_index(prepared["index"], prepared["items"])
+    intent_labels, intent_centroids = prepared["intents"]
+    nav_urls, nav_centroids = prepared["navigation"]
+    rebuild_derived_indexes()
+    if field_index is not None:
+        rebuild_field_lookup()
+    print(f"✅ Embedding modeli değişti: {new_model_name} ({reencoded} içerik geçişte yeniden encode edildi)")
+
+
+async def migrate_embedding_model(new_model_name: str):
+    """Yeni modelle ikinci index'i arka planda kur, sonra atomik geçiş yap"""
+    migration_status.update(state="building", model=new_model_name, started_at=time.time(), finished_at=None, error=None)
+    try:
+        loop = asyncio.get_running_loop()
+        built = await loop.run_in_executor(None, build_model_index, new_model_name, list(content_data))
+        async with snapshot_writer():
+            # Başka bir worker geçişi tamamlamış olabilir
+            if model_name != new_model_name:
+                # Hizalama thread'de sürerken /index içerikleri değiştirebilir (upsert/replace
+                # content_data'yı yeni listeyle değiştirir): liste sabit kalana kadar farkı işle
+                reencoded = 0
+                while built["items"] is not content_data:
+                    built, count = await loop.run_in_executor(None, prepare_model_cutover, built, content_data)
+                    reencoded += count
+                cutover_model_index(built, new_model_name, reencoded)
+                await save_index_to_disk()
+        migration_status.update(state="done", finished_at=time.time())
+    except Exception as e:
+        print(f"❌ Model geçişi başarısız: {e}")
+        migration_status.update(state="failed", finished_at=time.time(), error=str(e))
+
+
+@app.post("/index/migrate")
+async def start_model_migration(request: MigrateRequest):
+    """Embedding modelini değiştir: yeni index arka planda kurulur, eski servis vermeye devam eder"""
+    if migration_status["state"] == "building":
+        raise HTTPException(status_code=409, detail="Zaten devam eden bir model geçişi var")
+    if index is None or len(content_data) == 0:
+        raise HTTPException(status_code=400, detail="Index henüz oluşturulmamış")
+    if request.model == model_name:
+        return {"started": False, "model": model_name, "detail": "Index zaten bu modelle kurulu"}
+    
+    global migration_task
+    migration_task = asyncio.create_task(migrate_embedding_model(request.model))
+    return {"started": True, "from_model": model_name, "to_model": request.model}
+
+
+@app.get("/index/migrate")
+async def model_migration_status():
+    """Model geçişinin durumu"""
+    return {**migration_status, "current_model": model_name}
+
+
+# Hibrit arama: semantic + BM25 sıralamaları RRF ile birleşir
+HYBRID_LEXICAL_WEIGHT = float(os.environ.get("HYBRID_LEXICAL_WEIGHT", "0.4"))
+HYBRID_CANDIDATE_FACTOR = 4  # Her iki taraftan limit'in kaç katı aday alınacak
+
+# Sayfalama: ilk sorgunun sıralı aday listesi (birleştirme, rerank ve MMR sonrası) cache'lenir;
+# sonraki sayfalar embedding/arama yapmadan bu listeden dilimlenir. Liste sorgu parametreleri
+# ve index sürümüyle eşleşir, cursor = "<liste anahtarı>:<offset>".
+SEARCH_CANDIDATE_DEPTH = int(os.environ.get("SEARCH_CANDIDATE_DEPTH", "100"))  # Sayfalarla ulaşılabilecek sonuç sayısı
+SEARCH_CURSOR_TTL = float(os.environ.get("SEARCH_CURSOR_TTL", "600"))
+SEARCH_CURSOR_CACHE_SIZE = int(os.environ.get("SEARCH_CURSOR_CACHE_SIZE", "1000"))
+
+# liste anahtarı -> (index sürümü, oluşturulma zamanı, sıralı adaylar, rerank skorları)
+search_candidates: "OrderedDict[str, Tuple[tuple, float, List[Tuple[int, float]], Dict[int, float]]]" = OrderedDict()
+
+
+def search_list_key(request: SearchRequest, use_rerank: bool, diversity: float) -> str:
+    """Aday listesini belirleyen parametreler (limit ve cursor hariç)"""
+    params = json.dumps([
+        request.query, request.tur, request.lexical_weight, request.field_weights,
+        request.field_aggregation, use_rerank, diversity
+    ], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(params.encode("utf-8")).hexdigest()[:16]
+
+
+def parse_search_cursor(cursor: str, list_key: str) -> int:
+    """Cursor'dan offset; başka bir aramaya aitse 400"""
+    cursor_key, _, offset = cursor.partition(":")
+    if cursor_key != list_key or not offset.isdigit():
+        raise HTTPException(status_code=400, detail="Geçersiz cursor: aynı arama parametreleriyle dönen next_cursor kullanılmalı")
+    return int(offset)
+
+
+def cached_search_candidates(list_key: str) -> Optional[Tuple[List[Tuple[int, float]], Dict[int, float]]]:
+    entry = search_candidates.get(list_key)
+    if entry is None or entry[0] != (index_generation, snapshot_generation) or time.monotonic() - entry[1] > SEARCH_CURSOR_TTL:
+        CACHE_REQUESTS.inc("search_candidates", "miss")
+        return None
+    search_candidates.move_to_end(list_key)
+    CACHE_REQUESTS.inc("search_candidates", "hit")
+    return entry[2], entry[3]
+
+
+def store_search_candidates(list_key: str, generation: tuple, ranked: List[Tuple[int, float]], rerank_scores: Dict[int, float]):
+    search_candidates[list_key] = (generation, time.monotonic(), ranked, rerank_scores)
+    search_candidates.move_to_end(list_key)
+    while len(search_candidates) > SEARCH_CURSOR_CACHE_SIZE:
+        search_candidates.popitem(last=False)
+
+
+def truncate_description(text: str, length: int = 200) -> str:
+    """Açıklamayı yanıt için kısalt"""
+    return text[:length] + '...' if len(text) > length else text
+
+
+def to_search_result(pos: int, score: float, neden: str, rerank_score: Optional[float] = None) -> SearchResult:
+    """Index pozisyonundaki içerikten SearchResult oluştur"""
+    item = content_data[pos]
+    return SearchResult(
+        id=item.get('id', pos),
+        baslik=item.get('baslik', ''),
+        tur=item.get('tur', ''),
+        aciklama=truncate_description(item.get('aciklama', '')),
+        yil=item.get('yil'),
+        posterUrl=item.get('posterUrl'),
+        puan=item.get('puan'),
+        score=float(score),
+        neden=neden,
+        rerank_score=rerank_score
+    )
+
+
 @app.post("/search", response_model=SearchResponse)
-async def semantic_search(request: SearchRequest):
-    """Semantic search yap"""
+async def semantic_search(request: SearchRequest, if_none_match: Optional[str] = Header(None), accept: Optional[str] = Header(None)):
+    """Hibrit arama yap (semantic + BM25). next_cursor ile sonraki sayfalar cache'teki listeden gelir."""
     global index, content_data
     
     if index is None or len(content_data) == 0:
         raise HTTPException(status_code=400, detail="Index henüz oluşturulmamış. Önce /index endpoint'ini çağırın.")
     
-    load_model()
-    
+    use_rerank = RERANK_ENABLED if request.rerank is None else request.rerank
+    diversity = min(max(request.diversity, 0.0), 1.0)
+    list_key = search_list_key(request, use_rerank, diversity)
+    offset = parse_search_cursor(request.cursor, list_key) if request.cursor else 0
+    key = json.dumps([
+        request.query, request.limit, request.tur, request.lexical_weight, request.field_weights,
+        request.field_aggregation, use_rerank, diversity, offset, index_generation, snapshot_generation
+    ], ensure_ascii=False, sort_keys=True)
+    media_type = negotiate_media_type(accept)
+    etag = response_etag(key, media_type)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    result = await run_semantic_search(request, use_rerank, diversity, list_key, offset)
+    return encoded_response(result, etag, media_type)
+
+
+async def rank_search_candidates(request: SearchRequest, use_rerank: bool, diversity: float) -> Tuple[List[Tuple[int, float]], Dict[int, float]]:
+    """Tüm sayfalar için sıralı aday listesi: semantic + BM25 birleştirme, rerank ve MMR"""
     # Query embedding
-    query_embedding = model.encode([request.query], convert_to_numpy=True)
-    faiss.normalize_L2(query_embedding)
+    query_embedding = await encode_query(request.query)
+    
+    # Semantic arama (tür filtresi FAISS içinde), alan index'i varsa alan ağırlıklı
+    k = max(request.limit * HYBRID_CANDIDATE_FACTOR, SEARCH_CANDIDATE_DEPTH, RERANK_TOP_N if use_rerank else 0)
+    if field_index is not None and field_index.ntotal > 0:
+        semantic_hits = await field_aggregate_search(
+            query_embedding, k, tur=request.tur,
+            weights=request.field_weights, aggregation=request.field_aggregation
+        )
+    else:
+        semantic_hits = await search_vectors(query_embedding, k, tur=request.tur)
+    
+    # Lexical arama ve RRF birleştirme
+    lexical_weight = HYBRID_LEXICAL_WEIGHT if request.lexical_weight is None else min(max(request.lexical_weight, 0.0), 1.0)
+    lexical_hits = []
+    if lexical_weight > 0 and bm25_index is not None:
+        started = time.perf_counter()
+        allowed = tur_positions.get(request.tur.lower(), np.zeros(0, dtype=np.int64)) if request.tur else None
+        lexical_hits = bm25_index.search(request.query, k, allowed=allowed)
+        observe_stage("lexical_search", started)
+    
+    started = time.perf_counter()
+    if lexical_hits:
+        positions = reciprocal_rank_fusion([semantic_hits, lexical_hits], [1 - lexical_weight, lexical_weight])[:k]
+        # Skor her zaman cosine benzerliği: lexical-only sonuçlar için saklı vektörden hesapla
+        semantic_scores = dict(semantic_hits)
+        missing = [pos for pos in positions if pos not in semantic_scores]
+        if missing:
+            missing_scores = get_index_vectors()[np.array(missing, dtype=np.int64)] @ query_embedding[0]
+            semantic_scores.update(zip(missing, missing_scores.tolist()))
+        ranked = [(pos, semantic_scores[pos]) for pos in positions]
+    else:
+        ranked = semantic_hits[:k]
+    observe_stage("fusion", started)
+    
+    # Opsiyonel ikinci aşama: cross-encoder, süre bütçesi aşılırsa bi-encoder sırası kalır
+    rerank_scores: Dict[int, float] = {}
+    if use_rerank and ranked:
+        started = time.perf_counter()
+        ranked, rerank_scores = await rerank_candidates(request.query, ranked)
+        observe_stage("rerank", started)
     
-    # Arama yap
-    k = min(request.limit * 2, len(content_data))  # Filtreleme için fazla al
-    scores, indices = index.search(query_embedding, k)
+    # Çeşitlilik: aynı serinin devamları ilk sayfayı doldurmasın (tüm liste bir kez sıralanır).
+    # Alaka, birleştirme/rerank sırasından gelir: i. adaya i. en yüksek cosine skoru verilir,
+    # böylece sıra korunur ve ölçek benzerlik cezasıyla aynı kalır.
+    if diversity > 0 and len(ranked) > 1:
+        started = time.perf_counter()
+        vectors = get_index_vectors()[np.array([pos for pos, _ in ranked], dtype=np.int64)]
+        relevance = np.sort(np.array([score for _, score in ranked], dtype=np.float32))[::-1]
+        order = mmr_rerank(query_embedding, vectors, len(ranked), diversity, relevance=relevance)
+        ranked = [ranked[i] for i in order]
+        observe_stage("diversity", started)
+    return ranked, rerank_scores
+
+
+async def build_search_candidates(request: SearchRequest, use_rerank: bool, diversity: float, list_key: str, generation: tuple):
+    """Aday listesini kur ve cache'le (aynı liste için eşzamanlı istekler tek kurulumu bekler)"""
+    cached = await rank_search_candidates(request, use_rerank, diversity)
+    store_search_candidates(list_key, generation, *cached)
+    return cached
+
+
+async def run_semantic_search(request: SearchRequest, use_rerank: bool, diversity: float, list_key: str, offset: int) -> SearchResponse:
+    """Hibrit aramanın kendisi: aday listesi cache'ten ya da single-flight'lı kurulumdan gelir"""
+    cached = cached_search_candidates(list_key)
+    if cached is None:
+        # İlk sayfa ya da liste düştü/index değişti: listeyi yeniden kur. Sürüm await'lerden
+        # önce alınır; arada index değişirse liste eski sürümle etiketlenir ve tekrar kullanılmaz.
+        # Limit ve cursor anahtarda yok: farklı sayfa boyutlu eşzamanlı istekler de birleşir.
+        generation = (index_generation, snapshot_generation)
+        cached = await single_flight(
+            "search", f"{list_key}:{generation}",
+            lambda: build_search_candidates(request, use_rerank, diversity, list_key, generation)
+        )
+    ranked, rerank_scores = cached
+    page = ranked[offset:offset + request.limit]
     
+    started = time.perf_counter()
+    normalized_query = normalize_text(request.query)
     results = []
-    for score, idx in zip(scores[0], indices[0]):
-        if idx == -1:
-            continue
-            
+    for idx, score in page:
         item = content_data[idx]
         
-        # Tür filtresi
-        if request.tur and item.get('tur', '').lower() != request.tur.lower():
-            continue
+        if normalized_query and normalize_text(item.get('baslik', '')) == normalized_query:
+            neden = "🎯 Başlık eşleşmesi"
+        else:
+            neden = generate_reason(request.query, item, float(score))
         
-        results.append(SearchResult(
-            id=item.get('id', idx),
+        results.append(to_search_result(idx, score, neden, rerank_scores.get(idx)))
+    observe_stage("response_build", started)
+    
+    next_offset = offset + len(page)
+    return SearchResponse(
+        results=results,
+        query=request.query,
+        total=len(results),
+        next_cursor=f"{list_key}:{next_offset}" if page and next_offset < len(ranked) else None
+    )
+
+
+@app.get("/autocomplete", response_model=AutocompleteResponse)
+async def autocomplete(q: str, limit: int = 8, tur: Optional[str] = None):
+    """Başlık prefix'i ile typeahead önerileri (embedding kullanmaz)"""
+    if prefix_index is None:
+        return AutocompleteResponse(query=q, suggestions=[])
+    
+    suggestions = []
+    for pos in prefix_index.search(q, max(1, min(limit, 50)), tur=tur):
+        item = content_data[pos]
+        suggestions.append(AutocompleteItem(
+            id=item.get('id', pos),
             baslik=item.get('baslik', ''),
             tur=item.get('tur', ''),
-            aciklama=item.get('aciklama', '')[:200] + '...' if len(item.get('aciklama', '')) > 200 else item.get('aciklama', ''),
             yil=item.get('yil'),
             posterUrl=item.get('posterUrl'),
-            puan=item.get('puan'),
-            score=float(score),
-            neden=generate_reason(request.query, item, float(score))
+            puan=item.get('puan')
         ))
-        
-        if len(results) >= request.limit:
-            break
     
-    return SearchResponse(
-        results=results,
-        query=request.query,
-        total=len(results)
-    )
+    return AutocompleteResponse(query=q, suggestions=suggestions)
 
 
-@app.post("/embed")
-async def get_embedding(text: str):
-    """Tek bir metin için embedding döndür (debug için)"""
-    load_model()
-    embedding = model.encode([text], convert_to_numpy=True)
-    return {"embedding": embedding[0].tolist(), "dimension": len(embedding[0])}
+async def similar_results(pos: int, limit: int, tur: Optional[str] = None) -> Tuple[List[SearchResult], str]:
+    """Benzer içerikleri SearchResult listesine çevir"""
+    source_title = content_data[pos].get('baslik', '')
+    hits, source = await find_similar(pos, limit, tur)
+    return [
+        to_search_result(hit_pos, score, generate_reason(source_title, content_data[hit_pos], score))
+        for hit_pos, score in hits
+    ], source
+
+
+@app.get("/similar/{content_id}", response_model=SimilarResponse)
+async def similar_contents(
+    content_id: int, limit: int = 10, tur: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None), accept: Optional[str] = Header(None)
+):
+    """Bir içeriğe benzer içerikler (saklı vektörden, model çağrısı yok)"""
+    pos = id_positions.get(content_id)
+    if index is None or pos is None:
+        raise HTTPException(status_code=404, detail="İçerik index'te bulunamadı")
+    
+    limit = max(1, min(limit, 100))
+    media_type = negotiate_media_type(accept)
+    # Aynı index nesli komşu tablosundan ya da canlı aramadan cevaplanabilir; tablo hazır
+    # olunca sıralama değişebileceği için tablonun durumu da doğrulayıcıya girer
+    table_generation = neighbor_generation if neighbor_ids is not None and neighbor_generation == index_generation else None
+    etag = response_etag(json.dumps(["similar", content_id, limit, tur, table_generation]), media_type)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    results, source = await similar_results(pos, limit, tur)
+    return encoded_response(SimilarResponse(id=content_id, results=results, total=len(results), source=source), etag, media_type)
+
+
+@app.post("/similar/batch", response_model=SimilarBatchResponse)
+async def similar_contents_batch(request: SimilarBatchRequest, accept: Optional[str] = Header(None)):
+    """Birden çok içerik için benzer içerikler"""
+    if index is None:
+        raise HTTPException(status_code=400, detail="Index henüz oluşturulmamış")
+    
+    limit = max(1, min(request.limit, 100))
+    results: Dict[int, List[SearchResult]] = {}
+    missing: List[int] = []
+    for content_id in request.ids:
+        pos = id_positions.get(content_id)
+        if pos is None:
+            missing.append(content_id)
+            continue
+        results[content_id], _ = await similar_results(pos, limit, request.tur)
+    
+    return encoded_response(SimilarBatchResponse(results=results, missing=missing), media_type=negotiate_media_type(accept))
+
+
+def quantize_embeddings(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """İstenen çıktı tipi; int8'de vektör başına simetrik ölçek döner"""
+    if dtype == "float16":
+        return vectors.astype("<f2"), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype("<f4"), None
+
+
+@app.post("/embed", response_model=EmbedResponse)
+async def get_embedding(
+    request: Optional[EmbedRequest] = None, text: Optional[str] = None, accept: Optional[str] = Header(None)
+):
+    """
+    Metinler için embedding (toplu). Accept ile JSON, MessagePack veya ham little-endian dizi.
+    Eski kullanım (?text=...) tek vektör döndürmeye devam eder.
+    """
+    legacy = request is None
+    if legacy:
+        if text is None:
+            raise HTTPException(status_code=400, detail="'texts' listesi veya 'text' parametresi gerekli")
+        request = EmbedRequest(texts=[text], normalize=False)
+    if not request.texts:
+        raise HTTPException(status_code=400, detail="En az bir metin gerekli")
+    if len(request.texts) > EMBED_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Tek istekte en fazla {EMBED_MAX_BATCH} metin gönderilebilir")
+    if request.pooling not in EMBED_POOLINGS:
+        raise HTTPException(status_code=400, detail=f"Geçersiz pooling: {request.pooling} ({', '.join(EMBED_POOLINGS)})")
+    if request.dtype not in EMBED_DTYPES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz dtype: {request.dtype} ({', '.join(EMBED_DTYPES)})")
+
+    try:
+        vectors, token_counts = await embedding_batcher.encode(request.texts, "bulk", request.pooling)
+    except EmbeddingQueueFull:
+        raise HTTPException(status_code=503, detail="Embedding kuyruğu dolu, biraz sonra tekrar deneyin", headers={"Retry-After": "1"})
+    if request.normalize:
+        faiss.normalize_L2(vectors)
+    max_seq_length = int(getattr(model, "max_seq_length", 0) or 0)
+    truncated = [i for i, count in enumerate(token_counts) if max_seq_length and count > max_seq_length]
+    values, scales = quantize_embeddings(vectors, request.dtype)
+    media_type = negotiate_media_type(accept, raw_vectors=True)
+
+    if legacy and media_type != RAW_VECTOR_TYPE:
+        embedding = {"embedding": values[0] if media_type == MSGPACK_TYPE else values[0].tolist(), "dimension": values.shape[1], "model": model_name}
+        return encoded_response(embedding, media_type=media_type)
+    if media_type == RAW_VECTOR_TYPE:
+        # Satır satır (metin sırasıyla) ham dizi; tip ve boyut başlıklarda
+        headers = {
+            "X-Embedding-Count": str(values.shape[0]),
+            "X-Embedding-Dimension": str(values.shape[1]),
+            "X-Embedding-Dtype": request.dtype,
+            "X-Embedding-Model": model_name,
+            "X-Embedding-Truncated": ",".join(map(str, truncated)),
+            "Vary": "Accept",
+        }
+        if scales is not None:
+            headers["X-Embedding-Scales"] = ",".join(f"{scale:.9g}" for scale in scales)
+        return Response(values.tobytes(), media_type=RAW_VECTOR_TYPE, headers=headers)
+
+    result = {
+        "embeddings": values if media_type == MSGPACK_TYPE else values.tolist(),
+        "dimension": values.shape[1],
+        "model": model_name,
+        "pooling": request.pooling,
+        "dtype": request.dtype,
+        "normalized": request.normalize,
+        "token_counts": token_counts,
+        "truncated": truncated,
+        "max_seq_length": max_seq_length,
+        "scales": scales.tolist() if scales is not None else None,
+    }
+    return encoded_response(result, media_type=media_type)
 
 
 @app.post("/generate", response_model=GenerateResponse)
@@ -579,51 +4193,123 @@ async def generate_text(request: GenerateRequest):
         raise HTTPException(status_code=500, detail=f"Üretim hatası: {str(e)}")
 
 
+# Kişiselleştirme ayarları
+HISTORY_RECENCY_HALF_LIFE = float(os.environ.get("HISTORY_RECENCY_HALF_LIFE", "20"))  # öğe sayısı
+RECOMMEND_CANDIDATE_FACTOR = 4  # MMR için limit'in kaç katı aday alınacak
+
+
+def resolve_history_positions(titles: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Geçmiş başlıklarını katalog pozisyonlarına çöz.
+    (pozisyonlar, her pozisyonun user_history içindeki sırası) döndürür.
+    """
+    positions: List[int] = []
+    orders: List[int] = []
+    for order, title in enumerate(titles):
+        for pos in title_positions.get(normalize_text(title), []):
+            positions.append(pos)
+            orders.append(order)
+    return np.array(positions, dtype=np.int64), np.array(orders, dtype=np.int64)
+
+
+def build_taste_profile(
+    history_vectors: np.ndarray,
+    orders: np.ndarray,
+    ratings: Optional[List[float]] = None
+) -> np.ndarray:
+    """Geçmiş vektörlerinden yakınlık ve puana göre ağırlıklı, normalize profil vektörü"""
+    weights = np.power(0.5, orders / HISTORY_RECENCY_HALF_LIFE).astype(np.float32)
+    if ratings:
+        rating_arr = np.array(ratings, dtype=np.float32)
+        valid = orders < len(rating_arr)
+        rating_weights = np.ones_like(weights)
+        rating_weights[valid] = np.clip(rating_arr[orders[valid]] / 10.0, 0.05, 1.0)
+        weights *= rating_weights
+
+    profile = (weights[:, None] * history_vectors).sum(axis=0, keepdims=True).astype(np.float32)
+    faiss.normalize_L2(profile)
+    return profile
+
+
 @app.post("/recommend")
-async def smart_recommend(request: RecommendRequest):
-    """Semantic search + LLM ile akıllı öneri"""
+async def smart_recommend(request: RecommendRequest, if_none_match: Optional[str] = Header(None), accept: Optional[str] = Header(None)):
+    """Semantic search + kullanıcı geçmişi (zevk profili) ile kişisel öneri"""
     global index, content_data
     
     if index is None or len(content_data) == 0:
         raise HTTPException(status_code=400, detail="Index henüz oluşturulmamış")
     
-    load_model()
-    pipe = load_llm()
+    media_type = negotiate_media_type(accept)
+    etag = response_etag("recommend|" + request.model_dump_json(), media_type)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    load_model()
+    # Görünüm index nesnesine referans tutmaz: await'ler sırasında index değişse de bu nesne yaşamalı
+    source_index, items = index, content_data
+    vectors = get_index_vectors(source_index)
+    
+    # Geçmişi katalog vektörlerine çöz
+    history_positions, history_orders = resolve_history_positions(request.user_history or [])
+    history_vectors = vectors[history_positions] if len(history_positions) else None
+    
+    # Sorgu embedding'i, varsa zevk profiliyle harmanla
+    query_embedding = await encode_query(request.query) if request.query.strip() else None
+    if history_vectors is not None:
+        profile = build_taste_profile(history_vectors, history_orders, request.history_ratings)
+        weight = min(max(request.history_weight, 0.0), 1.0)
+        if query_embedding is None:
+            query_embedding = profile
+        else:
+            query_embedding = ((1 - weight) * query_embedding + weight * profile).astype(np.float32)
+            faiss.normalize_L2(query_embedding)
+    if query_embedding is None:
+        raise HTTPException(status_code=400, detail="Sorgu veya eşleşen kullanıcı geçmişi gerekli")
+    
+    # Tüketilmiş içerikler arama içinde hariç tutulur
+    hits = await search_vectors(
+        query_embedding,
+        request.limit * RECOMMEND_CANDIDATE_FACTOR,
+        tur=request.tur,
+        exclude=history_positions
+    )
+    hits = [(pos, score) for pos, score in hits if pos < len(items)]  # Arada eklenen satırlar bu görünümde yok
     
-    # Önce semantic search ile benzer içerikleri bul
-    query_embedding = model.encode([request.query], convert_to_numpy=True)
-    faiss.normalize_L2(query_embedding)
+    # MMR ile çeşitlendir
+    if hits and request.diversity > 0:
+        hit_positions = np.array([pos for pos, _ in hits], dtype=np.int64)
+        order = mmr_rerank(query_embedding, vectors[hit_positions], request.limit, request.diversity)
+        hits = [hits[i] for i in order]
+    hits = hits[:request.limit]
     
-    k = min(request.limit * 3, len(content_data))
-    scores, indices = index.search(query_embedding, k)
+    # Her sonuç için en yakın geçmiş öğesini bul (tek matris çarpımı)
+    nearest_history = None
+    if history_vectors is not None and hits:
+        result_vectors = vectors[np.array([pos for pos, _ in hits], dtype=np.int64)]
+        similarity = result_vectors @ history_vectors.T
+        nearest_history = (similarity.argmax(axis=1), similarity.max(axis=1))
     
     candidates = []
-    for score, idx in zip(scores[0], indices[0]):
-        if idx == -1:
-            continue
-        item = content_data[idx]
-        if request.tur and item.get('tur', '').lower() != request.tur.lower():
-            continue
+    for i, (pos, score) in enumerate(hits):
+        item = items[pos]
+        if nearest_history is not None and nearest_history[1][i] > 0.5:
+            history_item = items[history_positions[nearest_history[0][i]]]
+            neden = f"'{history_item.get('baslik', '')}' sevdiysen bunu da beğenebilirsin"
+        else:
+            neden = generate_reason(request.query, item, score)
         candidates.append({
             **item,
-            "score": float(score)
+            "score": score,
+            "neden": neden
         })
-        if len(candidates) >= request.limit:
-            break
-    
-    # LLM ile açıklama ekle (opsiyonel, LLM yoksa sadece search sonucu döner)
-    if pipe and candidates:
-        for item in candidates:
-            item["neden"] = f"'{request.query}' aramanıza benzer içerik"
-    else:
-        for item in candidates:
-            item["neden"] = generate_reason(request.query, item, item["score"])
     
-    return {
+    return encoded_response({
         "query": request.query,
         "results": candidates,
-        "total": len(candidates)
-    }
+        "total": len(candidates),
+        "personalized": history_vectors is not None,
+        "history_matched": int(len(set(history_orders.tolist())))
+    }, etag, media_type)
 
 
 @app.post("/yearly-summary", response_model=YearlySummaryResponse)
@@ -631,59 +4317,71 @@ async def generate_yearly_summary(request: YearlySummaryRequest):
     """Yıllık özet için Spotify Wrapped tarzı anlatı üret - Groq API ile"""
     
     try:
-        # Prompt oluştur
-        prompt = f"""Sen bir medya asistanısın. Kullanıcının yıllık izleme/okuma istatistiklerini Spotify Wrapped tarzında, eğlenceli ve samimi bir dille anlat. Türkçe yaz.
-
-Kullanıcı: {request.kullanici_adi}
-Yıl: {request.yil}
-
-İstatistikler:
-- Toplam içerik: {request.toplam_icerik}
-- Film: {request.film_sayisi}
-- Dizi: {request.dizi_sayisi}
-- Kitap: {request.kitap_sayisi}
-- Toplam izleme süresi: {request.toplam_dakika} dakika ({request.toplam_dakika // 60} saat)
-- Okunan sayfa: {request.toplam_sayfa}
-- En sevilen türler: {', '.join(request.en_cok_izlenen_turler[:3]) if request.en_cok_izlenen_turler else 'Belirtilmemiş'}
-- En yüksek puanlananlar: {', '.join(request.en_yuksek_puanlilar[:3]) if request.en_yuksek_puanlilar else 'Belirtilmemiş'}
-- Ortalama puan: {request.ortalama_puan}
-
-Kısa (4-5 cümle), eğlenceli, samimi ve kişisel bir özet yaz. 
-- Kullanıcının izleme alışkanlıklarını analiz et
-- Esprili ve sıcak bir dil kullan
-- Emoji kullan 🎬📺📚
-- Kullanıcıyı özel hissettir"""
-
-        messages = [
-            {"role": "system", "content": "Sen eğlenceli, samimi ve yaratıcı bir medya asistanısın. Spotify Wrapped tarzında kişiselleştirilmiş özetler yazıyorsun."},
-            {"role": "user", "content": prompt}
-        ]
+        prompt = PromptCall().add("system", "yearly_system").add("user", "yearly_user", stats=yearly_stats_block(request))
         
         # Groq API veya lokal LLM kullan
-        narrative = await call_local_llm(messages, max_tokens=400)
+        narrative = await call_local_llm(prompt, max_tokens=400, priority="batch")
         
         if not narrative:
             # API başarısız olursa fallback kullan
+            FALLBACKS.inc("yearly_summary")
             return YearlySummaryResponse(
-                title=f"🎬 {request.kullanici_adi}'ın {request.yil} Yılı",
+                title=yearly_summary_title(request, generated=False),
                 narrative=generate_fallback_narrative(request)
             )
         
-        # Başlık oluştur
-        title = f"🎬 {request.kullanici_adi}'ın {request.yil} Macerası"
-        
         return YearlySummaryResponse(
-            title=title,
+            title=yearly_summary_title(request, generated=True),
             narrative=narrative
         )
     except Exception as e:
         print(f"LLM hatası: {e}")
+        FALLBACKS.inc("yearly_summary")
         return YearlySummaryResponse(
-            title=f"🎬 {request.kullanici_adi}'ın {request.yil} Yılı",
+            title=yearly_summary_title(request, generated=False),
             narrative=generate_fallback_narrative(request)
         )
 
 
+# Tek kullanıcılı endpoint ve toplu üretim (yearly_batch.py) aynı prompt parçalarını kullanır
+YEARLY_SYSTEM_PROMPT = "Sen eğlenceli, samimi ve yaratıcı bir medya asistanısın. Spotify Wrapped tarzında kişiselleştirilmiş özetler yazıyorsun."
+YEARLY_STYLE_RULES = """Kısa (4-5 cümle), eğlenceli, samimi ve kişisel bir özet yaz. 
+- Kullanıcının izleme alışkanlıklarını analiz et
+- Esprili ve sıcak bir dil kullan
+- Emoji kullan 🎬📺📚
+- Kullanıcıyı özel hissettir"""
+
+PROMPTS.register("yearly_system", YEARLY_SYSTEM_PROMPT)
+PROMPTS.register(
+    "yearly_user",
+    "Sen bir medya asistanısın. Kullanıcının yıllık izleme/okuma istatistiklerini Spotify Wrapped tarzında, "
+    "eğlenceli ve samimi bir dille anlat. Türkçe yaz.\n\n" + YEARLY_STYLE_RULES + "\n\n${stats}"
+)
+
+
+def yearly_stats_block(request: YearlySummaryRequest) -> str:
+    """Prompt'taki kullanıcı + istatistik bölümü"""
+    return f"""Kullanıcı: {request.kullanici_adi}
+Yıl: {request.yil}
+
+İstatistikler:
+- Toplam içerik: {request.toplam_icerik}
+- Film: {request.film_sayisi}
+- Dizi: {request.dizi_sayisi}
+- Kitap: {request.kitap_sayisi}
+- Toplam izleme süresi: {request.toplam_dakika} dakika ({request.toplam_dakika // 60} saat)
+- Okunan sayfa: {request.toplam_sayfa}
+- En sevilen türler: {', '.join(request.en_cok_izlenen_turler[:3]) if request.en_cok_izlenen_turler else 'Belirtilmemiş'}
+- En yüksek puanlananlar: {', '.join(request.en_yuksek_puanlilar[:3]) if request.en_yuksek_puanlilar else 'Belirtilmemiş'}
+- Ortalama puan: {request.ortalama_puan}"""
+
+
+def yearly_summary_title(request: YearlySummaryRequest, generated: bool) -> str:
+    if generated:
+        return f"🎬 {request.kullanici_adi}'ın {request.yil} Macerası"
+    return f"🎬 {request.kullanici_adi}'ın {request.yil} Yılı"
+
+
 def generate_fallback_narrative(request: YearlySummaryRequest) -> str:
     """LLM olmadan basit anlatı oluştur"""
     saat = request.toplam_dakika // 60
@@ -920,28 +4618,47 @@ def match_known_content(description: str) -> Optional[IdentifyResponse]:
     return None
 
 
-@app.post("/identify", response_model=IdentifyResponse)
-async def identify_content(request: IdentifyRequest):
+# Katalog eşleşmesi için eşikler. Varsayılanlar MiniLM cosine ölçeğinde elle seçilmiş başlangıç
+# değerleridir, kalibrasyon verisiyle ölçülmedi; model ve katalog için ortam değişkeniyle ayarlayın.
+IDENTIFY_CATALOG_THRESHOLD = float(os.environ.get("IDENTIFY_CATALOG_THRESHOLD", "0.62"))
+IDENTIFY_CATALOG_MIN_MARGIN = float(os.environ.get("IDENTIFY_CATALOG_MIN_MARGIN", "0.04"))
+IDENTIFY_GROUNDING_CANDIDATES = 5
+
+
+async def match_catalog_content(description: str, tur: Optional[str] = None) -> Tuple[Optional[IdentifyResponse], List[Tuple[dict, float]]]:
     """
-    Kullanıcının tanımından veya sorusundan film/dizi/kitap adı döndür.
-    - Tanım: "ellerinden pençe çıkan adam" -> "X-Men"
-    - Soru: "en popüler dizi" -> "Game of Thrones" gibi popüler bir dizi öner
+    Tanımı kendi katalogumuzun FAISS index'inde ara.
+    Skor eşiği geçerse doğrudan yanıt, geçmezse LLM'e verilecek adayları döndür.
     """
-    
-    # Önce bilinen popüler içerikler için pattern matching dene
-    known_content = match_known_content(request.description)
-    if known_content:
-        return known_content
-    
-    # HuggingFace Inference API ile LLM çağır
-    try:
-        tur_hint = ""
-        if request.tur:
-            tur_map = {"film": "film", "dizi": "TV dizisi", "kitap": "kitap"}
-            tur_hint = f"Bu bir {tur_map.get(request.tur, request.tur)} olmalı."
-        
-        # Kimi-K2 için OpenAI uyumlu format
-        system_prompt = """Sen bir film, dizi ve kitap uzmanısın. 
+    if index is None or len(content_data) == 0:
+        return None, []
+
+    query_embedding = await encode_query(description)
+    items = content_data  # Arama sürerken index değişirse pozisyonlar bu listeye aittir
+    hits = await search_vectors(query_embedding, IDENTIFY_GROUNDING_CANDIDATES, tur=tur)
+    candidates = [(items[pos], score) for pos, score in hits if pos < len(items)]
+    if not candidates:
+        return None, []
+
+    best_item, best_score = candidates[0]
+    second_score = candidates[1][1] if len(candidates) > 1 else 0.0
+    if best_score >= IDENTIFY_CATALOG_THRESHOLD and best_score - second_score >= IDENTIFY_CATALOG_MIN_MARGIN:
+        aciklama = best_item.get('aciklama', '')
+        return IdentifyResponse(
+            found=True,
+            title=best_item.get('baslik', ''),
+            title_en=best_item.get('baslik', ''),
+            tur=best_item.get('tur', tur or "film"),
+            year=best_item.get('yil'),
+            explanation=f"Katalogda eşleşti: {aciklama[:150]}" if aciklama else "Katalogda eşleşti",
+            confidence=round(min(best_score, 1.0), 3),
+            search_query=best_item.get('baslik', '')
+        ), candidates
+
+    return None, candidates
+
+
+PROMPTS.register("identify_system", """Sen bir film, dizi ve kitap uzmanısın. 
 
 GÖREV: Kullanıcının isteğine göre GERÇEK, VAR OLAN bir içerik adı döndür!
 
@@ -951,12 +4668,10 @@ KURALLAR:
 3. ASLA kategorik isimler verme (örn: "Best-Selling Book" YANLIŞ, "Don Kişot" DOĞRU)
 4. Kullanıcı "öneri" istiyorsa popüler ve kaliteli bir içerik öner
 
-SADECE JSON formatında cevap ver, başka hiçbir şey yazma."""
-        
-        user_prompt = f"""Kullanıcının metni: "{request.description}"
-{tur_hint}
+SADECE JSON formatında cevap ver, başka hiçbir şey yazma.""")
 
-DOĞRU ÖRNEKLER (GERÇEK İÇERİK ADLARI):
+# Örnekler ve format statik prefix'te, kullanıcının metni en sonda
+PROMPTS.register("identify_user", """DOĞRU ÖRNEKLER (GERÇEK İÇERİK ADLARI):
 - "en popüler dizi" -> title: "Breaking Bad"
 - "iyi bir film öner" -> title: "Esaretin Bedeli", title_en: "The Shawshank Redemption"
 - "kitap öner" -> title: "Suç ve Ceza", title_en: "Crime and Punishment"
@@ -971,7 +4686,7 @@ YANLIŞ ÖRNEKLER (BUNLARI YAPMA):
 - title: "İyi Film" ❌
 
 JSON formatında cevap ver:
-{{
+{
     "found": true,
     "title": "GERÇEK içerik adı (Türkçe)",
     "title_en": "GERÇEK içerik adı (İngilizce)",
@@ -979,9 +4694,56 @@ JSON formatında cevap ver:
     "year": yıl veya null,
     "explanation": "Kısa açıklama",
     "confidence": 0.8
-}}"""
+}
+
+Kullanıcının metni: "${description}"
+${hints}""")
 
-        response_text = await call_hf_inference_api(user_prompt, max_tokens=250, system_prompt=system_prompt)
+
+@app.post("/identify", response_model=IdentifyResponse)
+async def identify_content(request: IdentifyRequest):
+    """
+    Kullanıcının tanımından veya sorusundan film/dizi/kitap adı döndür.
+    - Tanım: "ellerinden pençe çıkan adam" -> "X-Men"
+    - Soru: "en popüler dizi" -> "Game of Thrones" gibi popüler bir dizi öner
+    """
+    
+    # Önce bilinen popüler içerikler için pattern matching dene
+    known_content = match_known_content(request.description)
+    if known_content:
+        return known_content
+    
+    # Sonra kendi katalogumuzda ara - eşik geçilirse LLM'e hiç gitme
+    try:
+        catalog_match, catalog_candidates = await match_catalog_content(request.description, request.tur)
+    except Exception as e:
+        print(f"⚠️ Katalog eşleşmesi başarısız, LLM'e geçiliyor: {e}")
+        catalog_match, catalog_candidates = None, []
+    if catalog_match:
+        return catalog_match
+    
+    # HuggingFace Inference API ile LLM çağır
+    try:
+        tur_hint = ""
+        if request.tur:
+            tur_map = {"film": "film", "dizi": "TV dizisi", "kitap": "kitap"}
+            tur_hint = f"Bu bir {tur_map.get(request.tur, request.tur)} olmalı."
+        
+        # Katalog adaylarını LLM'e dayanak olarak ver
+        catalog_hint = ""
+        if catalog_candidates:
+            candidate_lines = "\n".join(
+                f"- {item.get('baslik', '')} ({item.get('tur', '')}, {item.get('yil') or '?'}): {item.get('aciklama', '')[:150]}"
+                for item, _ in catalog_candidates
+            )
+            catalog_hint = f"\nKatalogumuzdaki olası adaylar (uyuyorsa bunlardan birini seç):\n{candidate_lines}\n"
+        
+        prompt = (
+            PromptCall()
+            .add("system", "identify_system")
+            .add("user", "identify_user", description=request.description, hints=tur_hint + catalog_hint)
+        )
+        parsed, response_text = await call_structured_llm(prompt, IdentifyLLMOutput, 250, priority="interactive")
         
         if not response_text:
             # API çalışmadı, pattern matching sonucunu döndür
@@ -996,19 +4758,12 @@ JSON formatında cevap ver:
                 search_query=request.description
             )
         
-        print(f"LLM yanıtı: {response_text}")
-        
-        # JSON parse et
-        import re
-        json_match = re.search(r'\{[^{}]*\}', response_text, re.DOTALL)
-        
-        if json_match:
-            parsed = json.loads(json_match.group())
-            
-            title = parsed.get("title", "")
-            title_en = parsed.get("title_en", title)
-            tur = parsed.get("tur", "film")
-            confidence = float(parsed.get("confidence", 0.7))
+        if parsed:
+            title = parsed.title
+            title_en = parsed.title_en if "title_en" in parsed.model_fields_set else title
+            tur = parsed.tur
+            confidence = parsed.confidence
+            explanation = parsed.explanation
             
             # Genel/sahte isim kontrolü - bunlar gerçek içerik değil
             fake_patterns = [
@@ -1030,6 +4785,7 @@ JSON formatında cevap ver:
             
             # Başlık yoksa veya sahte isimse fallback öner
             if not title or is_fake_title:
+                FALLBACKS.inc("identify")
                 import random
                 # Tur'a göre popüler içerik listesinden rastgele seç
                 fallback_lists = {
@@ -1059,7 +4815,6 @@ JSON formatında cevap ver:
                 fallback_list = fallback_lists.get(detected_tur, fallback_lists["film"])
                 title, title_en, explanation = random.choice(fallback_list)
                 tur = detected_tur
-                parsed["explanation"] = explanation
             
             # Arama sorgusu oluştur
             search_query = title_en if title_en else title
@@ -1069,13 +4824,14 @@ JSON formatında cevap ver:
                 title=title,
                 title_en=title_en,
                 tur=tur,
-                year=parsed.get("year"),
-                explanation=parsed.get("explanation", ""),
+                year=parsed.year,
+                explanation=explanation,
                 confidence=confidence,
                 search_query=search_query
             )
         else:
-            # JSON bulunamadı
+            # Onarımdan sonra da geçerli JSON yok: sadece bu durumda cevabın başı loglanır
+            print(f"⚠️ Identify cevabı ayrıştırılamadı: {response_text[:200]}")
             return IdentifyResponse(
                 found=False,
                 title="",
@@ -1087,33 +4843,14 @@ JSON formatında cevap ver:
                 search_query=request.description
             )
             
-    except json.JSONDecodeError as e:
-        print(f"JSON parse hatası: {e}")
-        return IdentifyResponse(
-            found=False,
-            title="",
-            title_en=None,
-            tur=request.tur or "film",
-            year=None,
-            explanation="Yanıt işlenemedi",
-            confidence=0.0,
-            search_query=request.description
-        )
     except Exception as e:
         print(f"Identify hatası: {e}")
         raise HTTPException(status_code=500, detail=f"İçerik tanımlama hatası: {str(e)}")
 
 
 # ===== YENİ: Genel AI Chat Endpoint =====
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """
-    Genel sohbet endpoint'i - Kullanıcıyla doğal dilde konuşma
-    Film, dizi, kitap hakkında her türlü soruyu yanıtlar
-    """
-    try:
-        # Saga asistanı system prompt'u
-        system_prompt = """Sen Saga'nın AI asistanısın. Saga, kullanıcıların film, dizi ve kitapları takip ettiği bir platformdur.
+# Saga asistanı system prompt'u
+PROMPTS.register("chat_system", """Sen Saga'nın AI asistanısın. Saga, kullanıcıların film, dizi ve kitapları takip ettiği bir platformdur.
 
 Görevlerin:
 1. Film, dizi ve kitaplar hakkında bilgi vermek (özet, oyuncular, yönetmenler, yazarlar, türler vs.)
@@ -1126,21 +4863,28 @@ Kurallar:
 - Kısa ve öz ol, gereksiz uzatma
 - Spoiler vermekten kaçın (kullanıcı açıkça istemezse)
 - Emin olmadığın bilgileri tahmin olarak belirt
-- Samimi ve yardımsever ol"""
+- Samimi ve yardımsever ol""")
+PROMPTS.register("chat_context", "Kullanıcı şu anda şu sayfada: ${context}")
+
 
-        # Mesajları OpenAI formatına çevir
-        messages = [{"role": "system", "content": system_prompt}]
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    """
+    Genel sohbet endpoint'i - Kullanıcıyla doğal dilde konuşma
+    Film, dizi, kitap hakkında her türlü soruyu yanıtlar
+    """
+    try:
+        prompt = PromptCall().add("system", "chat_system")
         
         # Kontekst varsa ekle
         if request.context:
-            messages.append({"role": "system", "content": f"Kullanıcı şu anda şu sayfada: {request.context}"})
+            prompt.add("system", "chat_context", context=request.context)
         
         # Sohbet geçmişini ekle
         for msg in request.messages:
-            messages.append({"role": msg.role, "content": msg.content})
+            prompt.add_text(msg.role, msg.content)
         
-        # HuggingFace Router API ile çağır
-        response_text = await call_hf_router_api(messages, request.max_tokens)
+        response_text = await call_hf_router_api(prompt, request.max_tokens, priority="interactive")
         
         if not response_text:
             return ChatResponse(
@@ -1168,34 +4912,34 @@ Kurallar:
 
 
 # ===== YENİ: İçerik Hakkında Soru-Cevap =====
-@app.post("/content-question", response_model=ContentQuestionResponse)
-async def content_question(request: ContentQuestionRequest):
-    """
-    Belirli bir içerik hakkında soru yanıtla
-    Örnek: "Inception filminin konusu ne?" veya "Bu kitabın yazarı kim?"
-    """
-    try:
-        system_prompt = f"""Sen bir {request.content_type} uzmanısın. Kullanıcı "{request.content_title}" hakkında soru soruyor.
+PROMPTS.register("content_question_system", """Sen bir ${content_type} uzmanısın. Kullanıcı "${content_title}" hakkında soru soruyor.
 
 İçerik bilgisi:
-- Başlık: {request.content_title}
-- Tür: {request.content_type}
-{f'- Açıklama: {request.content_description}' if request.content_description else ''}
+- Başlık: ${content_title}
+- Tür: ${content_type}
+${description_line}
 
 Kurallar:
 - Türkçe yanıt ver
 - Spoiler vermekten kaçın (açıkça istenmezse)
 - Kısa ve bilgilendirici ol
-- Emin olmadığın bilgileri belirt"""
+- Emin olmadığın bilgileri belirt""")
 
-        user_prompt = request.question
-        
-        # HuggingFace Router API ile çağır
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        answer = await call_hf_router_api(messages, 400)
+
+@app.post("/content-question", response_model=ContentQuestionResponse)
+async def content_question(request: ContentQuestionRequest):
+    """
+    Belirli bir içerik hakkında soru yanıtla
+    Örnek: "Inception filminin konusu ne?" veya "Bu kitabın yazarı kim?"
+    """
+    try:
+        prompt = PromptCall().add(
+            "system", "content_question_system",
+            content_type=request.content_type,
+            content_title=request.content_title,
+            description_line=f'- Açıklama: {request.content_description}' if request.content_description else ''
+        ).add_text("user", request.question)
+        answer = await call_hf_router_api(prompt, 400, priority="interactive")
         
         if not answer:
             return ContentQuestionResponse(
@@ -1220,7 +4964,202 @@ Kurallar:
         raise HTTPException(status_code=500, detail=f"Soru yanıtlama hatası: {str(e)}")
 
 
+# ===== YENİ: Embedding Tabanlı Intent Router =====
+# Yüklü SentenceTransformer ile nearest-centroid sınıflandırma.
+# Yüksek güvenli navigate/search istekleri LLM'e gitmeden yanıtlanır.
+INTENT_CONFIDENCE_THRESHOLD = float(os.environ.get("INTENT_CONFIDENCE_THRESHOLD", "0.6"))
+INTENT_MIN_MARGIN = float(os.environ.get("INTENT_MIN_MARGIN", "0.05"))
+
+INTENT_EXAMPLES = {
+    "navigate": [
+        "kütüphaneme git", "listelerimi aç", "profilime git", "keşfet sayfasını aç",
+        "aktivite sayfasına git", "beni kütüphaneye götür", "listeler sayfasına gitmek istiyorum",
+        "profil sayfamı göster", "ana sayfaya dön", "go to my library", "open my lists",
+    ],
+    "search": [
+        "inception ara", "breaking bad'i bul", "harry potter arat", "suç ve ceza kitabını ara",
+        "interstellar filmini bul", "game of thrones diye arama yap", "search for the matrix",
+        "dune kitabını aratır mısın", "bana 1984'ü bul",
+    ],
+    "recommend": [
+        "bana bir film öner", "ne izlesem", "iyi bir kitap tavsiye et", "bu akşam ne izleyebilirim",
+        "bilim kurgu dizisi öner", "bana göre ne var", "sevdiğim filmlere benzer öneriler",
+        "recommend me a movie", "okuyacak bir şey öner",
+    ],
+    "identify": [
+        "adını unuttuğum bir film vardı", "bir dizi vardı hatırlamaya çalışıyorum",
+        "ellerinden pençe çıkan adamın filmi neydi", "kimya öğretmeninin uyuşturucu yaptığı dizi",
+        "çocukken okuduğum bir kitabı bulmaya çalışıyorum", "rüya içinde rüya olan film hangisiydi",
+        "what was that movie where",
+    ],
+    "info": [
+        "kütüphaneye nasıl içerik eklerim", "liste nasıl oluşturulur", "saga nedir",
+        "puanlama nasıl çalışıyor", "arkadaşlarımı nasıl takip ederim", "bu sitede neler yapabilirim",
+        "inception filminin yönetmeni kim", "how do i add a book",
+    ],
+}
+
+NAVIGATION_TARGETS = {
+    "/kutuphane": {
+        "label": "Kütüphane",
+        "examples": ["kütüphaneme git", "kütüphanemi aç", "izlediklerime git", "okuduğum kitapları göster"],
+    },
+    "/listeler": {
+        "label": "Listeler",
+        "examples": ["listelerimi aç", "listeler sayfasına git", "koleksiyonlarımı göster"],
+    },
+    "/kesfet": {
+        "label": "Keşfet",
+        "examples": ["keşfet sayfasını aç", "keşfete git", "yeni içerik keşfetmek istiyorum"],
+    },
+    "/profil": {
+        "label": "Profil",
+        "examples": ["profilime git", "profil sayfamı göster", "istatistiklerimi göster"],
+    },
+    "/aktivite": {
+        "label": "Aktivite",
+        "examples": ["aktivite sayfasına git", "arkadaşlarımın aktivitelerini göster", "akışı aç"],
+    },
+}
+
+# Arama terimini çıkarırken atılacak tetikleyici kelimeler
+SEARCH_TRIGGER_PATTERN = re.compile(
+    r"\b(arama yap|aratır mısın|arar mısın|bulur musun|diye|arat|ara|bul|search for|search|find|"
+    r"bana|lütfen|filmini|filmi|dizisini|dizisi|kitabını|kitabı|'[ıiuü]|'y[ıiuü])\b",
+    re.IGNORECASE
+)
+
+intent_labels: List[str] = []
+intent_centroids: Optional[np.ndarray] = None
+nav_urls: List[str] = []
+nav_centroids: Optional[np.ndarray] = None
+
+
+def _build_centroids(groups: Dict[str, List[str]], encoder=None) -> Tuple[List[str], np.ndarray]:
+    """Etiketli örneklerden normalize edilmiş centroid matrisi oluştur"""
+    encoder = encoder or model
+    labels = list(groups.keys())
+    texts = [text for label in labels for text in groups[label]]
+    embeddings = encoder.encode(texts, convert_to_numpy=True).astype(np.float32)
+    faiss.normalize_L2(embeddings)
+
+    centroids = np.zeros((len(labels), embeddings.shape[1]), dtype=np.float32)
+    offset = 0
+    for i, label in enumerate(labels):
+        count = len(groups[label])
+        centroids[i] = embeddings[offset:offset + count].mean(axis=0)
+        offset += count
+    faiss.normalize_L2(centroids)
+    return labels, centroids
+
+
+def load_intent_router():
+    """Intent centroid'lerini bir kez hesapla"""
+    global intent_labels, intent_centroids, nav_urls, nav_centroids
+    if intent_centroids is None:
+        load_model()
+        intent_labels, intent_centroids = encode_on_worker(_build_centroids, INTENT_EXAMPLES)
+        nav_urls, nav_centroids = encode_on_worker(
+            _build_centroids, {url: target["examples"] for url, target in NAVIGATION_TARGETS.items()}
+        )
+        print(f"✅ Intent router hazır: {len(intent_labels)} intent")
+
+
+def classify_intent(query_embedding: np.ndarray) -> Tuple[str, float, float]:
+    """Sorgu embedding'i için (intent, skor, ikinciye fark) döndür"""
+    load_intent_router()
+    scores = intent_centroids @ query_embedding[0]
+    order = np.argsort(-scores)
+    best, second = order[0], order[1]
+    return intent_labels[best], float(scores[best]), float(scores[best] - scores[second])
+
+
+def resolve_navigation_target(query_embedding: np.ndarray) -> Tuple[str, float]:
+    """Navigate intent'i için en yakın sayfa URL'ini bul"""
+    load_intent_router()
+    scores = nav_centroids @ query_embedding[0]
+    best = int(np.argmax(scores))
+    return nav_urls[best], float(scores[best])
+
+
+def extract_search_term(query: str) -> str:
+    """Arama isteğinden tetikleyici kelimeleri atıp terimi çıkar"""
+    term = SEARCH_TRIGGER_PATTERN.sub(" ", query)
+    term = re.sub(r"[?!.,]", " ", term)
+    return " ".join(term.split())
+
+
+async def route_assistant_intent(query: str) -> Tuple[Optional[AssistantResponse], Optional[str]]:
+    """
+    Sorguyu sınıflandır. Yüksek güvenli navigate/search için doğrudan yanıt döndür,
+    diğer durumlarda (None, güvenilir intent veya None) döner.
+    """
+    query_embedding = await encode_query(query)
+
+    intent, score, margin = classify_intent(query_embedding)
+    if score < INTENT_CONFIDENCE_THRESHOLD or margin < INTENT_MIN_MARGIN:
+        return None, None
+
+    if intent == "navigate":
+        url, _ = resolve_navigation_target(query_embedding)
+        label = NAVIGATION_TARGETS[url]["label"]
+        return AssistantResponse(
+            message=f"{label} sayfasına yönlendiriyorum...",
+            action="navigate",
+            action_data={"url": url},
+            suggestions=None
+        ), intent
+
+    if intent == "search":
+        term = extract_search_term(query)
+        if len(term) >= 2:
+            return AssistantResponse(
+                message=f'"{term}" için arama yapıyorum...',
+                action="search",
+                action_data={"query": term},
+                suggestions=[f"{term} hakkında bilgi ver", "Benzer içerikler öner"]
+            ), intent
+
+    return None, intent
+
+
 # ===== YENİ: Site Asistanı =====
+PROMPTS.register("assistant_system", """Sen Saga platformunun yardımcı asistanısın. Kullanıcılara kısa ve net yardım et.
+
+Platform özellikleri:
+- Kütüphane (/kutuphane): İzlenen film/dizi ve okunan kitaplar. Bir içeriği kütüphaneye eklemek için içerik sayfasındaki "Kütüphaneye Ekle" butonuna tıklanır.
+- Listeler (/listeler): Özel koleksiyonlar oluşturma
+- Keşfet (/kesfet): Yeni içerik arama ve keşfetme
+- Profil (/profil): Kullanıcı istatistikleri
+- Aktivite (/aktivite): Arkadaşların aktiviteleri
+
+KURALLAR:
+1. Sadece bilgi sorusu ise action=null olsun, sadece message ile yanıtla
+2. Kullanıcı sayfaya gitmek istiyorsa action="navigate", action_data={"url": "/sayfa"}
+3. Kullanıcı arama yapmak istiyorsa action="search", action_data={"query": "arama terimi"}
+4. Kullanıcı öneri istiyorsa action="recommend"
+5. message içine JSON yazma, düz metin yaz
+6. Önceki sohbeti dikkate al ve bağlamı koru
+
+Yanıt formatı (SADEce bu formatta):
+{"message": "Kısa yanıt", "action": null, "action_data": null, "suggestions": ["Öneri"]}""")
+PROMPTS.register("assistant_user", "Soru: ${query}${page_context}${user_context}")
+PROMPTS.register("assistant_identify_system", "Sen bir film, dizi ve kitap uzmanısın. Tanımlardan içerikleri bul.")
+PROMPTS.register("assistant_identify_user", """Kullanıcı bir film, dizi veya kitap tanımlamaya çalışıyor. 
+Tanımdan içeriğin adını bul.
+
+Sadece JSON formatında yanıt ver:
+{
+    "found": true/false,
+    "title": "İçeriğin Türkçe adı",
+    "title_en": "İçeriğin İngilizce adı (varsa)",
+    "content_type": "film/dizi/kitap",
+    "message": "Kullanıcıya gösterilecek samimi mesaj"
+}
+
+Tanım: ${query}""")
+
+
 @app.post("/assistant", response_model=AssistantResponse)
 async def assistant(request: AssistantRequest):
     """
@@ -1229,7 +5168,13 @@ async def assistant(request: AssistantRequest):
     """
     try:
         query_lower = request.query.lower()
-        
+
+        # Önce embedding tabanlı intent router: basit navigasyon/arama LLM'siz yanıtlanır
+        load_model()
+        routed_response, routed_intent = await route_assistant_intent(request.query)
+        if routed_response:
+            return routed_response
+
         # İçerik tanımlama isteği mi kontrol et
         # "bir film vardı", "şu dizi", "hangi kitap", "bulmaya çalışıyorum" gibi ifadeler
         identify_keywords = [
@@ -1241,55 +5186,35 @@ async def assistant(request: AssistantRequest):
             "ne filmdi", "ne dizisi", "ne kitabı", "hangi", "hangisi"
         ]
         
-        is_identify_request = any(kw in query_lower for kw in identify_keywords)
+        # Router emin ise onun kararı, değilse anahtar kelime kontrolü geçerli
+        if routed_intent:
+            is_identify_request = routed_intent == "identify"
+        else:
+            is_identify_request = any(kw in query_lower for kw in identify_keywords)
         
         if is_identify_request:
             # İçerik tanımlama moduna geç
-            identify_prompt = f"""Kullanıcı bir film, dizi veya kitap tanımlamaya çalışıyor. 
-Tanımdan içeriğin adını bul.
-
-Tanım: {request.query}
-
-Sadece JSON formatında yanıt ver:
-{{
-    "found": true/false,
-    "title": "İçeriğin Türkçe adı",
-    "title_en": "İçeriğin İngilizce adı (varsa)",
-    "content_type": "film/dizi/kitap",
-    "message": "Kullanıcıya gösterilecek samimi mesaj"
-}}"""
-            
-            messages = [
-                {"role": "system", "content": "Sen bir film, dizi ve kitap uzmanısın. Tanımlardan içerikleri bul."},
-                {"role": "user", "content": identify_prompt}
-            ]
-            
-            response_text = await call_hf_router_api(messages, 250)
+            prompt = (
+                PromptCall()
+                .add("system", "assistant_identify_system")
+                .add("user", "assistant_identify_user", query=request.query)
+            )
+            parsed, _ = await call_structured_llm(prompt, AssistantIdentifyOutput, 250, priority="interactive")
             
-            if response_text:
-                # JSON parse et
-                json_str = extract_json(response_text)
-                if json_str:
-                    try:
-                        parsed = json.loads(json_str)
-                        if parsed.get("found") and parsed.get("title"):
-                            title = parsed.get("title")
-                            title_en = parsed.get("title_en")
-                            content_type = parsed.get("content_type", "film")
-                            
-                            # Arama query'si oluştur
-                            search_query = title_en if title_en else title
-                            
-                            message = parsed.get("message", f'"{title}" buldum! Aramaya yönlendiriyorum...')
-                            
-                            return AssistantResponse(
-                                message=message,
-                                action="search",
-                                action_data={"query": search_query, "title": title, "type": content_type},
-                                suggestions=[f"{title} hakkında bilgi ver", "Benzer içerikler öner"]
-                            )
-                    except json.JSONDecodeError:
-                        pass
+            if parsed and parsed.found and parsed.title:
+                title = parsed.title
+                
+                # Arama query'si oluştur
+                search_query = parsed.title_en if parsed.title_en else title
+                
+                message = parsed.message if parsed.message is not None else f'"{title}" buldum! Aramaya yönlendiriyorum...'
+                
+                return AssistantResponse(
+                    message=message,
+                    action="search",
+                    action_data={"query": search_query, "title": title, "type": parsed.content_type},
+                    suggestions=[f"{title} hakkında bilgi ver", "Benzer içerikler öner"]
+                )
             
             # Bulunamadıysa
             return AssistantResponse(
@@ -1300,26 +5225,6 @@ Sadece JSON formatında yanıt ver:
             )
         
         # Normal asistan modu
-        system_prompt = """Sen Saga platformunun yardımcı asistanısın. Kullanıcılara kısa ve net yardım et.
-
-Platform özellikleri:
-- Kütüphane (/kutuphane): İzlenen film/dizi ve okunan kitaplar. Bir içeriği kütüphaneye eklemek için içerik sayfasındaki "Kütüphaneye Ekle" butonuna tıklanır.
-- Listeler (/listeler): Özel koleksiyonlar oluşturma
-- Keşfet (/kesfet): Yeni içerik arama ve keşfetme
-- Profil (/profil): Kullanıcı istatistikleri
-- Aktivite (/aktivite): Arkadaşların aktiviteleri
-
-KURALLAR:
-1. Sadece bilgi sorusu ise action=null olsun, sadece message ile yanıtla
-2. Kullanıcı sayfaya gitmek istiyorsa action="navigate", action_data={"url": "/sayfa"}
-3. Kullanıcı arama yapmak istiyorsa action="search", action_data={"query": "arama terimi"}
-4. Kullanıcı öneri istiyorsa action="recommend"
-5. message içine JSON yazma, düz metin yaz
-6. Önceki sohbeti dikkate al ve bağlamı koru
-
-Yanıt formatı (SADEce bu formatta):
-{"message": "Kısa yanıt", "action": null, "action_data": null, "suggestions": ["Öneri"]}"""
-
         user_context_str = ""
         if request.user_context:
             user_context_str = f"\nKullanıcı: {request.user_context.get('username', 'misafir')}"
@@ -1328,21 +5233,18 @@ Yanıt formatı (SADEce bu formatta):
         if request.current_page:
             page_context = f" (Sayfa: {request.current_page})"
         
-        user_prompt = f"Soru: {request.query}{page_context}{user_context_str}"
-
         # Mesaj listesi oluştur
-        messages = [{"role": "system", "content": system_prompt}]
+        prompt = PromptCall().add("system", "assistant_system")
         
         # Sohbet geçmişini ekle (varsa)
         if request.chat_history:
             for msg in request.chat_history[-6:]:  # Son 6 mesaj (3 tur)
-                messages.append({"role": msg.role, "content": msg.content})
+                prompt.add_text(msg.role, msg.content)
         
         # Son kullanıcı mesajını ekle
-        messages.append({"role": "user", "content": user_prompt})
+        prompt.add("user", "assistant_user", query=request.query, page_context=page_context, user_context=user_context_str)
         
-        # HuggingFace Router API ile çağır
-        response_text = await call_hf_router_api(messages, 400)
+        parsed, response_text = await call_structured_llm(prompt, AssistantResponse, 400, priority="interactive")
         
         if not response_text:
             return AssistantResponse(
@@ -1352,15 +5254,11 @@ Yanıt formatı (SADEce bu formatta):
                 suggestions=["Keşfet sayfasına git", "Kütüphaneme bak"]
             )
         
-        # Yeni parse fonksiyonunu kullan (iç içe JSON desteği)
-        parsed = parse_assistant_response(response_text)
+        # JSON alınamadıysa cevap düz metin olarak gösterilir
+        if parsed is None:
+            return AssistantResponse(message=response_text.strip())
         
-        return AssistantResponse(
-            message=parsed.get("message", response_text),
-            action=parsed.get("action"),
-            action_data=parsed.get("action_data"),
-            suggestions=parsed.get("suggestions")
-        )
+        return unwrap_assistant_response(parsed)
         
     except Exception as e:
         print(f"Assistant hatası: {e}")
@@ -1368,6 +5266,12 @@ Yanıt formatı (SADEce bu formatta):
 
 
 # ===== YENİ: Özet İste =====
+PROMPTS.register("summarize_system", """Sen bir ${content_type} uzmanısın. "${content_title}" için kısa bir özet yaz.
+${spoiler_note}
+Türkçe yaz. 2-3 paragraf yeterli.""")
+PROMPTS.register("summarize_user", "${content_title} hakkında özet ver.")
+
+
 @app.post("/summarize")
 async def summarize_content(content_title: str, content_type: str, spoiler_free: bool = True):
     """
@@ -1376,16 +5280,12 @@ async def summarize_content(content_title: str, content_type: str, spoiler_free:
     try:
         spoiler_note = "SPOILER VERME!" if spoiler_free else "Spoiler verebilirsin."
         
-        system_prompt = f"""Sen bir {content_type} uzmanısın. "{content_title}" için kısa bir özet yaz.
-{spoiler_note}
-Türkçe yaz. 2-3 paragraf yeterli."""
-
-        # HuggingFace Router API ile çağır
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"{content_title} hakkında özet ver."}
-        ]
-        summary = await call_hf_router_api(messages, 500)
+        prompt = (
+            PromptCall()
+            .add("system", "summarize_system", content_type=content_type, content_title=content_title, spoiler_note=spoiler_note)
+            .add("user", "summarize_user", content_title=content_title)
+        )
+        summary = await call_hf_router_api(prompt, 500)
         
         if not summary:
             return {"summary": "AI servisi şu anda kullanılamıyor.", "spoiler_free": spoiler_free}
@@ -1414,7 +5314,7 @@ def create_gradio_interface():
             
             tur_filter = tur if tur != "Hepsi" else None
             
-            query_embedding = model.encode([query], convert_to_numpy=True)
+            query_embedding = encode_on_worker(model.encode, [query]).astype(np.float32)
             faiss.normalize_L2(query_embedding)
             
             scores, indices = index.search(query_embedding, limit)
@@ -0,0 +1,531 @@
+"""
+Saga AI - Benchmark ve yük testi
+Sentetik katalog (Türkçe/İngilizce) üretir, servisi ayrı süreçte başlatır ve ölçer:
+index throughput'u, /search p50/p95/p99 ve QPS (farklı eşzamanlılıklarda), içerik başına
+bellek, soğuk başlangıç süresi ve mock Groq sunucusuna karşı LLM endpoint'leri.
+Sonuçlar JSON'a yazılır; --baseline ile önceki bir sonuçla karşılaştırılır.
+
+Kullanım:
+    python benchmark.py --sizes 10000 100000 --concurrency 1 8 32 --out bench_results.json
+    python benchmark.py --sizes 1000000 --encoder hash      # Model maliyeti olmadan index/arama yükü
+    python benchmark.py --sizes 10000 --baseline bench_results.json
+
+--encoder model, EMBEDDING_MODEL'i kullanır (çevrimdışı çalışmak için model önceden
+HuggingFace cache'inde olmalı). --encoder hash, kelime hash'inden vektör üreten
+deterministik bir encoder'dır: kalite ölçmez, index/arama/API maliyetini modelden ayırır.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import httpx
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# ===== Sentetik Katalog =====
+
+TR_ADJECTIVES = ["Karanlık", "Kayıp", "Son", "Sessiz", "Kırmızı", "Gizli", "Uzak", "Sonsuz", "Yalnız", "Büyük",
+                 "Küçük", "Eski", "Soğuk", "Altın", "Kırık", "Unutulmuş", "Vahşi", "Beyaz", "Derin", "Yasak"]
+TR_NOUNS = ["Şehir", "Yolculuk", "Ada", "Gece", "Rüya", "Savaş", "Aşk", "Hırsız", "Krallık", "Deniz",
+            "Orman", "Yıldız", "Kule", "Sır", "Miras", "Liman", "Kış", "Çöl", "Ayna", "Sürgün"]
+EN_ADJECTIVES = ["Dark", "Lost", "Last", "Silent", "Red", "Hidden", "Distant", "Endless", "Lonely", "Broken",
+                 "Golden", "Cold", "Wild", "Forgotten", "Deep", "Forbidden", "Pale", "Iron", "Burning", "Hollow"]
+EN_NOUNS = ["City", "Journey", "Island", "Night", "Dream", "War", "Heart", "Thief", "Kingdom", "Sea",
+            "Forest", "Star", "Tower", "Secret", "Legacy", "Harbor", "Winter", "Desert", "Mirror", "Exile"]
+
+TR_HEROES = ["genç bir dedektif", "emekli bir asker", "yetim bir kız", "hırslı bir bilim insanı", "yorgun bir öğretmen",
+             "gizemli bir yabancı", "genç bir büyücü", "iflas etmiş bir iş insanı", "bir grup arkadaş", "yaşlı bir balıkçı"]
+TR_PLACES = ["İstanbul'un arka sokaklarında", "uzak bir gezegende", "küçük bir Anadolu kasabasında", "ortaçağ krallığında",
+             "terk edilmiş bir uzay istasyonunda", "karlı dağ köyünde", "savaş sonrası Berlin'de", "bir okyanus gemisinde"]
+TR_GOALS = ["kayıp kardeşini bulmak", "geçmişinin sırrını çözmek", "tahtı geri almak", "insanlığı kurtarmak",
+            "bir cinayeti aydınlatmak", "ailesini korumak", "imkansız bir aşkı yaşamak", "hayatta kalmak"]
+TR_CONFLICTS = ["tehlikeli bir yolculuğa çıkar", "eski düşmanlarıyla yüzleşir", "zamana karşı yarışır",
+                "kendi vicdanıyla hesaplaşır", "güçlü bir örgütün hedefi olur", "beklenmedik bir ihanete uğrar"]
+TR_GENRES = ["bilim kurgu", "dram", "gerilim", "komedi", "fantastik", "suç", "romantik", "tarih", "korku", "macera"]
+
+EN_HEROES = ["a young detective", "a retired soldier", "an orphan girl", "an ambitious scientist", "a tired teacher",
+             "a mysterious stranger", "a young wizard", "a bankrupt businessman", "a group of friends", "an old fisherman"]
+EN_PLACES = ["in the back streets of London", "on a distant planet", "in a small desert town", "in a medieval kingdom",
+             "on an abandoned space station", "in a snowy mountain village", "in post-war Berlin", "aboard an ocean liner"]
+EN_GOALS = ["find a lost brother", "uncover the secret of the past", "reclaim the throne", "save humanity",
+            "solve a murder", "protect the family", "live an impossible love", "survive"]
+EN_CONFLICTS = ["sets out on a dangerous journey", "faces old enemies", "races against time",
+                "struggles with conscience", "becomes the target of a powerful organization", "suffers an unexpected betrayal"]
+EN_GENRES = ["science fiction", "drama", "thriller", "comedy", "fantasy", "crime", "romance", "history", "horror", "adventure"]
+
+TURS = ["film", "dizi", "kitap"]
+TUR_WEIGHTS = [0.45, 0.2, 0.35]
+TURKISH_SHARE = 0.7
+
+
+def synthetic_item(rng: random.Random, content_id: int) -> dict:
+    """Gerçekçi uzunlukta tek bir içerik (başlık, 1-4 cümle açıklama)"""
+    turkish = rng.random() < TURKISH_SHARE
+    if turkish:
+        adjectives, nouns, heroes, places, goals, conflicts, genres = TR_ADJECTIVES, TR_NOUNS, TR_HEROES, TR_PLACES, TR_GOALS, TR_CONFLICTS, TR_GENRES
+        sentence = "{place} {hero}, {goal} için {conflict}."
+    else:
+        adjectives, nouns, heroes, places, goals, conflicts, genres = EN_ADJECTIVES, EN_NOUNS, EN_HEROES, EN_PLACES, EN_GOALS, EN_CONFLICTS, EN_GENRES
+        sentence = "{place}, {hero} {conflict} to {goal}."
+
+    title = f"{rng.choice(adjectives)} {rng.choice(nouns)}"
+    if rng.random() < 0.3:
+        title += f" {rng.randint(2, 5)}" if rng.random() < 0.5 else f" {rng.choice(nouns)}"
+    sentences = [
+        sentence.format(place=rng.choice(places), hero=rng.choice(heroes), goal=rng.choice(goals), conflict=rng.choice(conflicts))
+        for _ in range(rng.randint(1, 4))
+    ]
+    sentences[0] = sentences[0][0].upper() + sentences[0][1:]
+    sentences.append(f"{rng.choice(genres).capitalize()}, {rng.choice(genres)}.")
+    return {
+        "id": content_id,
+        "baslik": title,
+        "tur": rng.choices(TURS, TUR_WEIGHTS)[0],
+        "aciklama": " ".join(sentences),
+        "yil": rng.randint(1950, 2025),
+        "puan": round(rng.uniform(4.0, 9.5), 1),
+        "populerlik": rng.randint(0, 100000),
+    }
+
+
+def synthetic_catalog(size: int, seed: int = 42) -> List[dict]:
+    rng = random.Random(seed)
+    return [synthetic_item(rng, content_id) for content_id in range(1, size + 1)]
+
+
+def synthetic_queries(catalog: List[dict], count: int, seed: int = 7) -> List[dict]:
+    """Başlık, açıklama parçası ve anahtar kelime sorguları; bir kısmı tür filtreli"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        item = rng.choice(catalog)
+        kind = rng.random()
+        if kind < 0.3:
+            query = item["baslik"]
+        elif kind < 0.7:
+            words = item["aciklama"].split()
+            start = rng.randint(0, max(0, len(words) - 6))
+            query = " ".join(words[start:start + rng.randint(3, 6)])
+        else:
+            query = f"{rng.choice(TR_GENRES + EN_GENRES)} {rng.choice(TR_NOUNS + EN_NOUNS).lower()}"
+        request = {"query": query, "limit": 10}
+        if rng.random() < 0.3:
+            request["tur"] = item["tur"]
+        queries.append(request)
+    return queries
+
+
+# ===== Hash Encoder (modelsiz mod) =====
+
+class HashEncoder:
+    """SentenceTransformer arayüzünü taklit eden deterministik kelime-hash encoder'ı"""
+
+    def __init__(self, model_name: str = "hash", dimension: int = 384, **kwargs):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.max_seq_length = 256
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts, convert_to_numpy: bool = True, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else texts
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in TOKEN_PATTERN.findall(text.lower()):
+                h = zlib.crc32(token.encode("utf-8"))
+                embeddings[row, h % self.dimension] += 1.0 if h & 0x80000000 else -1.0
+        return embeddings[0] if single else embeddings
+
+
+# ===== Alt komutlar: servis ve mock Groq =====
+
+def serve_app(args):
+    """Servisi bu süreçte başlat (benchmark'ın kendi alt süreci olarak çalışır)"""
+    import uvicorn
+    sys.path.insert(0, SCRIPT_DIR)
+    import app as saga_app
+    if args.encoder == "hash":
+        saga_app.SentenceTransformer = HashEncoder
+    uvicorn.run(saga_app.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+MOCK_NARRATIVE = (
+    "Bu yıl tam bir keşif yılıydı! 🎬 Filmlerde karanlık gerilimlerden vazgeçmedin, "
+    "dizilerde ise her bölümü dikkatle izledin 📺. Kitaplarda da sayfaları hızla çevirdin 📚. "
+    "Puanların seçici bir zevke sahip olduğunu gösteriyor. Gelecek yıl seni neler bekliyor, merakla izliyoruz!"
+)
+MOCK_JSON = '{"found": true, "title": "Inception", "title_en": "Inception", "tur": "film", "year": 2010, "confidence": 0.8, "explanation": "Rüya içinde rüya"}'
+
+
+def serve_mock_groq(args):
+    """Groq chat completions API'sini taklit eden yerel sunucu (gecikme ve 429 oranı ayarlanabilir)"""
+    import uvicorn
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse
+
+    mock = FastAPI()
+    rng = random.Random(0)
+
+    @mock.post("/openai/v1/chat/completions")
+    async def completions(body: dict):
+        await asyncio.sleep(args.latency_ms / 1000 * rng.uniform(0.5, 1.5))
+        if rng.random() < args.rate_limit:
+            return JSONResponse(status_code=429, content={"error": {"message": "Rate limit reached", "type": "rate_limit"}})
+        prompt = " ".join(str(message.get("content", "")) for message in body.get("messages", []))
+        if "ozetler" in prompt:
+            # yearly_batch.py paketli istek: her id için bir anlatı
+            ids = [int(found) for found in re.findall(r"### id: (\d+)", prompt)]
+            content = json.dumps({"ozetler": [{"id": found, "narrative": MOCK_NARRATIVE} for found in ids]}, ensure_ascii=False)
+        else:
+            content = MOCK_JSON if "JSON" in prompt else MOCK_NARRATIVE
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+        return {
+            "id": f"chatcmpl-{rng.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    uvicorn.run(mock, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+# ===== Süreç yönetimi =====
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_rss_mb(pid: int) -> float:
+    """Sürecin (ve varsa shard alt süreçlerinin) resident bellek kullanımı"""
+    total_kb = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    for current in pids:
+        try:
+            with open(f"/proc/{current}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return total_kb / 1024
+
+
+class ServiceProcess:
+    """benchmark.py serve alt sürecini başlat/durdur"""
+
+    def __init__(self, workdir: str, encoder: str, env: Dict[str, str]):
+        self.workdir, self.encoder, self.env = workdir, encoder, env
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.process: Optional[subprocess.Popen] = None
+
+    def start(self, timeout: float = 600) -> float:
+        """Başlat, sağlık kontrolü cevap verene kadar geçen süreyi döndür"""
+        started = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(SCRIPT_DIR, "benchmark.py"), "serve", "--port", str(self.port), "--encoder", self.encoder],
+            cwd=self.workdir,
+            env=self.env,
+            stdout=open(os.path.join(self.workdir, "service.log"), "a"),
+            stderr=subprocess.STDOUT,
+        )
+        while time.perf_counter() - started < timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Servis başlatılamadı, log: {os.path.join(self.workdir, 'service.log')}")
+            try:
+                if httpx.get(self.base_url + "/", timeout=1).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.05)
+        raise TimeoutError("Servis zamanında hazır olmadı")
+
+    def rss_mb(self) -> float:
+        return process_rss_mb(self.process.pid)
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+# ===== Yük üretimi =====
+
+def summarize(latencies: List[float], errors: int, wall_seconds: float) -> dict:
+    values = np.array(latencies, dtype=np.float64) * 1000
+    if len(values) == 0:
+        return {"requests": 0, "errors": errors}
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "qps": round(len(values) / wall_seconds, 1),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+async def run_load(base_url: str, make_request: Callable[[int], Tuple[str, dict]], total: int, concurrency: int) -> dict:
+    """total isteği concurrency kadar eşzamanlı istemciyle gönder"""
+    latencies: List[float] = []
+    errors = 0
+    counter = itertools.count()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        async def worker():
+            nonlocal errors
+            while (i := next(counter)) < total:
+                path, payload = make_request(i)
+                started = time.perf_counter()
+                try:
+                    response = await client.post(path, json=payload)
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    return summarize(latencies, errors, wall)
+
+
+def stage_breakdown(base_url: str) -> Dict[str, dict]:
+    """/metrics'ten aşama bazında ortalama süreler"""
+    sums: Dict[str, float] = {}
+    counts: Dict[str, float] = {}
+    pattern = re.compile(r'^saga_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} ([0-9.eE+-]+)$')
+    try:
+        text = httpx.get(base_url + "/metrics", timeout=10).text
+    except httpx.HTTPError:
+        return {}
+    for line in text.splitlines():
+        match = pattern.match(line)
+        if match:
+            target = sums if match.group(1) == "sum" else counts
+            target[match.group(2)] = float(match.group(3))
+    return {
+        stage: {"count": int(counts[stage]), "mean_ms": round(sums.get(stage, 0.0) / counts[stage] * 1000, 3)}
+        for stage in sorted(counts) if counts[stage]
+    }
+
+
+def yearly_summary_payload(i: int) -> dict:
+    return {
+        "kullanici_adi": f"kullanici{i}", "yil": 2024, "toplam_icerik": 40 + i % 50,
+        "film_sayisi": 20, "dizi_sayisi": 8, "kitap_sayisi": 12, "toplam_dakika": 5400, "toplam_sayfa": 3200,
+        "en_cok_izlenen_turler": ["Bilim Kurgu", "Dram"], "en_yuksek_puanlilar": ["Inception", "Suç ve Ceza"],
+        "ortalama_puan": 8.1,
+    }
+
+
+def chat_payload(i: int) -> dict:
+    return {"messages": [{"role": "user", "content": f"Bu akşam ne izlesem? ({i})"}], "max_tokens": 200}
+
+
+# ===== Senaryo =====
+
+def post_json_bytes(base_url: str, path: str, body: bytes) -> httpx.Response:
+    return httpx.post(base_url + path, content=body, headers={"Content-Type": "application/json"}, timeout=None)
+
+
+def benchmark_size(size: int, args, env: Dict[str, str]) -> dict:
+    print(f"\n🔄 {size} içerik: katalog üretiliyor...")
+    catalog = synthetic_catalog(size)
+    queries = synthetic_queries(catalog, max(args.requests, 1000))
+    workdir = tempfile.mkdtemp(prefix=f"saga-bench-{size}-", dir=args.workdir)
+    service = ServiceProcess(workdir, args.encoder, env)
+    result: Dict[str, object] = {"size": size}
+    try:
+        result["startup_empty_seconds"] = round(service.start(), 3)
+        rss_empty = service.rss_mb()
+
+        # Index throughput (istemci tarafı JSON üretimi ölçüme dahil değil)
+        batch = args.index_batch or size
+        batches = [json.dumps({"contents": catalog[i:i + batch], "mode": "replace" if i == 0 else "upsert"}).encode("utf-8")
+                   for i in range(0, size, batch)]
+        started = time.perf_counter()
+        for body in batches:
+            response = post_json_bytes(service.base_url, "/index", body)
+            response.raise_for_status()
+        index_seconds = time.perf_counter() - started
+        rss_indexed = service.rss_mb()
+        result["index"] = {
+            "seconds": round(index_seconds, 2),
+            "items_per_second": round(size / index_seconds, 1),
+            "batches": len(batches),
+        }
+        result["memory"] = {
+            "rss_empty_mb": round(rss_empty, 1),
+            "rss_indexed_mb": round(rss_indexed, 1),
+            "bytes_per_item": round((rss_indexed - rss_empty) * 1024 * 1024 / size, 1),
+        }
+        print(f"✅ Index: {result['index']['items_per_second']} içerik/sn, {result['memory']['bytes_per_item']} bayt/içerik")
+
+        # Arama: ısınma + eşzamanlılık seviyeleri
+        asyncio.run(run_load(service.base_url, lambda i: ("/search", queries[i % len(queries)]), min(50, args.requests), 1))
+        result["search"] = {}
+        for concurrency in args.concurrency:
+            stats = asyncio.run(run_load(service.base_url, lambda i: ("/search", queries[i % len(queries)]), args.requests, concurrency))
+            result["search"][str(concurrency)] = stats
+            print(f"   /search c={concurrency}: {stats.get('qps')} qps, p50 {stats.get('p50_ms')} ms, p95 {stats.get('p95_ms')} ms, p99 {stats.get('p99_ms')} ms")
+        result["search_stages"] = stage_breakdown(service.base_url)
+
+        # LLM endpoint'leri (mock Groq)
+        if args.llm_requests > 0:
+            result["llm"] = {}
+            for name, path, make_payload in (("yearly_summary", "/yearly-summary", yearly_summary_payload), ("chat", "/chat", chat_payload)):
+                result["llm"][name] = {}
+                for concurrency in args.concurrency:
+                    stats = asyncio.run(run_load(service.base_url, lambda i: (path, make_payload(i)), args.llm_requests, concurrency))
+                    result["llm"][name][str(concurrency)] = stats
+                    print(f"   {path} c={concurrency}: {stats.get('qps')} qps, p95 {stats.get('p95_ms')} ms")
+        service.stop()
+
+        # Soğuk başlangıç: diskteki index ile yeniden başlat
+        result["cold_start_seconds"] = round(service.start(), 3)
+        result["memory"]["rss_cold_start_mb"] = round(service.rss_mb(), 1)
+        print(f"✅ Soğuk başlangıç: {result['cold_start_seconds']} sn")
+    finally:
+        service.stop()
+    return result
+
+
+def environment_info(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "encoder": args.encoder,
+        "embedding_model": os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2") if args.encoder == "model" else "hash",
+        "requests_per_level": args.requests,
+        "mock_groq": {"latency_ms": args.groq_latency_ms, "rate_limit": args.groq_rate_limit},
+        "env": {key: os.environ[key] for key in ("SHARD_COUNT", "SHARD_PARTITION", "MULTI_VECTOR_ENABLED", "RERANK_ENABLED", "SIMILAR_PRECOMPUTE_K") if key in os.environ},
+    }
+
+
+def compare_with_baseline(results: List[dict], baseline_path: str):
+    """Aynı boyut/eşzamanlılık için p95 ve QPS değişimini yazdır"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {entry["size"]: entry for entry in json.load(f)["results"]}
+
+    def change(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "-"
+
+    print(f"\n📊 Baseline karşılaştırması: {baseline_path}")
+    for entry in results:
+        old = baseline.get(entry["size"])
+        if old is None:
+            continue
+        print(f"   {entry['size']} içerik: index {change(entry['index']['items_per_second'], old['index']['items_per_second'])} içerik/sn, "
+              f"bellek {change(entry['memory']['bytes_per_item'], old['memory']['bytes_per_item'])}, "
+              f"soğuk başlangıç {change(entry['cold_start_seconds'], old['cold_start_seconds'])}")
+        for concurrency, stats in entry["search"].items():
+            old_stats = old.get("search", {}).get(concurrency)
+            if old_stats and stats.get("qps") and old_stats.get("qps"):
+                print(f"      /search c={concurrency}: p95 {change(stats['p95_ms'], old_stats['p95_ms'])}, qps {change(stats['qps'], old_stats['qps'])}")
+
+
+def run(args):
+    mock_port = free_port()
+    mock = None
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    if args.llm_requests > 0:
+        mock = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "mock-groq", "--port", str(mock_port),
+             "--latency-ms", str(args.groq_latency_ms), "--rate-limit", str(args.groq_rate_limit)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+        )
+        env.update(GROQ_API_KEY="benchmark", GROQ_API_URL=f"http://127.0.0.1:{mock_port}/openai/v1/chat/completions")
+
+    try:
+        results = [benchmark_size(size, args, env) for size in args.sizes]
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+
+    report = {"environment": environment_info(args), "results": results}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Sonuçlar kaydedildi: {args.out}")
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Saga AI benchmark ve yük testi")
+    subparsers = parser.add_subparsers(dest="command")
+
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10000], help="Katalog boyutları (ör. 10000 100000 1000000)")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32], help="Eşzamanlı istemci sayıları")
+    parser.add_argument("--requests", type=int, default=500, help="Her eşzamanlılık seviyesinde /search istek sayısı")
+    parser.add_argument("--llm-requests", type=int, default=50, help="LLM endpoint'leri için istek sayısı (0 = atla)")
+    parser.add_argument("--index-batch", type=int, default=0, help="/index parti boyutu (0 = tek istek; >0 ilk parti replace, sonrakiler upsert)")
+    parser.add_argument("--encoder", choices=["model", "hash"], default="model", help="Embedding: gerçek model veya modelsiz hash encoder")
+    parser.add_argument("--groq-latency-ms", type=float, default=300, help="Mock Groq ortalama gecikmesi")
+    parser.add_argument("--groq-rate-limit", type=float, default=0.0, help="Mock Groq 429 oranı (0-1)")
+    parser.add_argument("--workdir", default=None, help="Geçici index dizinlerinin oluşturulacağı yer")
+    parser.add_argument("--out", default="bench_results.json", help="Sonuç JSON dosyası")
+    parser.add_argument("--baseline", default=None, help="Karşılaştırılacak önceki sonuç dosyası")
+
+    serve_parser = subparsers.add_parser("serve", help="(dahili) servisi başlat")
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--encoder", choices=["model", "hash"], default="model")
+
+    mock_parser = subparsers.add_parser("mock-groq", help="(dahili) mock Groq sunucusu")
+    mock_parser.add_argument("--port", type=int, required=True)
+    mock_parser.add_argument("--latency-ms", type=float, default=300)
+    mock_parser.add_argument("--rate-limit", type=float, default=0.0)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve_app(args)
+    elif args.command == "mock-groq":
+        serve_mock_groq(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Saga AI - Embedding modeli değerlendirme aracı
+Etiketli Türkçe sorgu seti üzerinde her model için recall@k, MRR ve gecikme raporlar.
+Sorgular servisin /search sıralamasından geçer: alan index'i, BM25 birleştirme,
+isteğe bağlı cross-encoder ve MMR dahil.
+
+Kullanım:
+    python evaluate.py --catalog content_data.json --queries eval_queries_tr.jsonl \
+        --models all-MiniLM-L6-v2 sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2
+
+Sorgu dosyası (JSONL), her satır:
+    {"query": "ellerinden pençe çıkan adam", "relevant_titles": ["X-Men"], "tur": "film"}
+    {"query": "...", "relevant_ids": [42, 43]}
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+os.environ.setdefault("SIMILAR_PRECOMPUTE_K", "0")  # Komşu tablosu değerlendirmede kullanılmaz
+
+import app as service
+from app import SearchRequest, normalize_text
+
+
+def load_queries(path: str, catalog: List[dict]) -> List[dict]:
+    """Sorguları oku, relevant_titles'ı katalog id'lerine çöz"""
+    title_ids: Dict[str, List[int]] = {}
+    for item in catalog:
+        title_ids.setdefault(normalize_text(item.get('baslik', '')), []).append(item['id'])
+
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            relevant = set(row.get("relevant_ids", []))
+            for title in row.get("relevant_titles", []):
+                relevant.update(title_ids.get(normalize_text(title), []))
+            if not relevant:
+                print(f"⚠️ Satır {line_no}: katalogda ilgili içerik yok, atlanıyor ({row['query']})")
+                continue
+            queries.append({"query": row["query"], "relevant": relevant, "tur": row.get("tur")})
+    return queries
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+async def run_queries(queries: List[dict], max_k: int, use_rerank: bool, diversity: float) -> dict:
+    """Sorguları servisin arama sıralamasıyla çalıştır"""
+    ranked_ids, encode_ms, search_ms = [], [], []
+    for query in queries:
+        # Önce encode: embedding cache'e girer, arama süresi encode'u içermez
+        started = time.perf_counter()
+        await service.encode_query(query["query"])
+        encode_ms.append((time.perf_counter() - started) * 1000)
+
+        request = SearchRequest(query=query["query"], limit=max_k, tur=query["tur"], diversity=diversity)
+        started = time.perf_counter()
+        ranked, _ = await service.rank_search_candidates(request, use_rerank, diversity)
+        search_ms.append((time.perf_counter() - started) * 1000)
+        ranked_ids.append([int(service.content_data[pos]['id']) for pos, _ in ranked[:max_k]])
+    return {"ranked_ids": ranked_ids, "encode_ms": encode_ms, "search_ms": search_ms}
+
+
+def evaluate_model(model_name: str, catalog: List[dict], queries: List[dict], ks: List[int],
+                   use_rerank: bool = False, diversity: float = 0.0) -> dict:
+    """Tek model için servis index'ini kur, sorguları çalıştır, metrikleri döndür"""
+    print(f"🔄 {model_name} değerlendiriliyor...")
+    started = time.perf_counter()
+    encoder, intents, navigation = service.load_encoder_bundle(model_name)
+    load_seconds = time.perf_counter() - started
+
+    # Model geçişiyle aynı yol: vektörler, alan index'i, BM25 ve tür filtreleri kurulur
+    started = time.perf_counter()
+    built = {
+        "encoder": encoder, "items": catalog, "intents": intents, "navigation": navigation,
+        "vectors": service.encode_contents(catalog, encoder)
+    }
+    if service.MULTI_VECTOR_ENABLED:
+        built["fields"] = service.encode_fields(catalog, list(range(len(catalog))), encoder)
+    prepared, _ = service.prepare_model_cutover(built, catalog)
+    service.cutover_model_index(prepared, model_name, 0)
+    index_seconds = time.perf_counter() - started
+
+    max_k = max(ks)
+    run = asyncio.run(run_queries(queries, max_k, use_rerank, diversity))
+    encode_ms, search_ms = run["encode_ms"], run["search_ms"]
+
+    hits_at = {k: [] for k in ks}
+    reciprocal_ranks = []
+    for query, ranked_ids in zip(queries, run["ranked_ids"]):
+        for k in ks:
+            found = len(query["relevant"].intersection(ranked_ids[:k]))
+            hits_at[k].append(found / len(query["relevant"]))
+        first = next((rank for rank, content_id in enumerate(ranked_ids, 1) if content_id in query["relevant"]), None)
+        reciprocal_ranks.append(1.0 / first if first else 0.0)
+
+    return {
+        "model": model_name,
+        "dimension": int(prepared["vectors"].shape[1]),
+        "catalog_size": len(catalog),
+        "query_count": len(queries),
+        "recall": {f"@{k}": round(float(np.mean(hits_at[k])), 4) for k in ks},
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        "load_seconds": round(load_seconds, 2),
+        "index_seconds": round(index_seconds, 2),
+        "index_items_per_second": round(len(catalog) / max(index_seconds, 1e-9), 1),
+        "encode_ms": {"p50": round(percentile(encode_ms, 50), 2), "p95": round(percentile(encode_ms, 95), 2)},
+        "search_ms": {"p50": round(percentile(search_ms, 50), 3), "p95": round(percentile(search_ms, 95), 3)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding modellerini etiketli sorgu setiyle karşılaştır")
+    parser.add_argument("--catalog", default="content_data.json", help="İçerik listesi (content_data.json formatı)")
+    parser.add_argument("--queries", default="eval_queries_tr.jsonl", help="Etiketli sorgular (JSONL)")
+    parser.add_argument("--models", nargs="+", default=["all-MiniLM-L6-v2"], help="Karşılaştırılacak modeller")
+    parser.add_argument("--k", nargs="+", type=int, default=[1, 5, 10], help="Recall@k değerleri")
+    parser.add_argument("--rerank", action="store_true", help="Cross-encoder yeniden sıralamayı aç")
+    parser.add_argument("--diversity", type=float, default=0.0, help="MMR çeşitlilik katsayısı (0-1)")
+    parser.add_argument("--out", default=None, help="Sonuçların yazılacağı JSON dosyası")
+    args = parser.parse_args()
+    if args.rerank and service.load_rerank_model() is None:
+        raise SystemExit("❌ Cross-encoder yüklenemedi")
+
+    with open(args.catalog, "r", encoding="utf-8") as f:
+        catalog = json.load(f)
+    queries = load_queries(args.queries, catalog)
+    if not queries:
+        raise SystemExit("❌ Değerlendirilecek sorgu yok")
+
+    results = [evaluate_model(name, catalog, queries, args.k, args.rerank, args.diversity) for name in args.models]
+
+    print(f"\n{'Model':<60} " + " ".join(f"{'R' + k:>7}" for k in results[0]["recall"]) + f" {'MRR':>7} {'enc p50':>9} {'enc p95':>9}")
+    for result in results:
+        recalls = " ".join(f"{value:>7.3f}" for value in result["recall"].values())
+        print(f"{result['model']:<60} {recalls} {result['mrr']:>7.3f} {result['encode_ms']['p50']:>7.1f}ms {result['encode_ms']['p95']:>7.1f}ms")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ Sonuçlar kaydedildi: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
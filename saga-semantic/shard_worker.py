@@ -0,0 +1,117 @@
+"""
+Saga AI - FAISS shard süreci
+app.py tarafından SHARD_COUNT > 1 olduğunda başlatılır (python -m shard_worker <fd> <threads>).
+Katalogun bir bölümünü kendi index'inde tutar ve ön süreçten gelen sorguları cevaplar.
+Sadece numpy + faiss yükler; embedding modeli ve LLM ön süreçte kalır.
+
+Mesajlar (ön süreç -> shard), her birine ("ok", sonuç) veya ("error", mesaj) döner:
+    ("load", dim, ids, vectors, turs)        Shard'ı baştan kur
+    ("update", remove_ids, ids, vectors, turs) Verilen id'leri sil, yenilerini ekle
+    ("search", query, k, tur, exclude)       Top-k (ids, scores)
+    ("stop",)
+Id'ler ön süreçteki index pozisyonlarıdır; sonuçlar doğrudan birleştirilebilir.
+"""
+
+import sys
+from multiprocessing.connection import Connection
+from typing import Dict, List, Optional
+
+import numpy as np
+import faiss
+
+
+class Shard:
+    def __init__(self):
+        self.index: Optional[faiss.IndexIDMap2] = None
+        self.turs: Dict[int, str] = {}  # id -> tür
+        self.tur_ids: Dict[str, np.ndarray] = {}  # tür -> id'ler (filtreli arama için)
+
+    def load(self, dim: int, ids: np.ndarray, vectors: np.ndarray, turs: List[str]) -> int:
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.turs = {}
+        if len(ids):
+            self.index.add_with_ids(vectors, ids)
+        self.turs.update(zip(ids.tolist(), turs))
+        self._rebuild_tur_ids()
+        return self.index.ntotal
+
+    def update(self, remove_ids: np.ndarray, ids: np.ndarray, vectors: np.ndarray, turs: List[str]) -> int:
+        if len(remove_ids):
+            self.index.remove_ids(faiss.IDSelectorBatch(remove_ids))
+            for content_id in remove_ids.tolist():
+                self.turs.pop(content_id, None)
+        if len(ids):
+            self.index.add_with_ids(vectors, ids)
+        self.turs.update(zip(ids.tolist(), turs))
+        self._rebuild_tur_ids()
+        return self.index.ntotal
+
+    def _rebuild_tur_ids(self):
+        groups: Dict[str, List[int]] = {}
+        for content_id, tur in self.turs.items():
+            groups.setdefault(tur, []).append(content_id)
+        self.tur_ids = {tur: np.array(ids, dtype=np.int64) for tur, ids in groups.items()}
+
+    def search(self, query: np.ndarray, k: int, tur: Optional[str], exclude: Optional[np.ndarray]):
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        if self.index is None or self.index.ntotal == 0:
+            return empty
+
+        # Selector'lar arama bitene kadar referansta kalmalı
+        selectors = []
+        available = self.index.ntotal
+        if tur:
+            ids = self.tur_ids.get(tur)
+            if ids is None:
+                return empty
+            selectors.append(faiss.IDSelectorBatch(ids))
+            available = len(ids)
+        if exclude is not None and len(exclude) > 0:
+            selectors.append(faiss.IDSelectorNot(faiss.IDSelectorBatch(exclude)))
+
+        params = None
+        if len(selectors) == 1:
+            params = faiss.SearchParameters(sel=selectors[0])
+        elif len(selectors) == 2:
+            selectors.append(faiss.IDSelectorAnd(selectors[0], selectors[1]))
+            params = faiss.SearchParameters(sel=selectors[-1])
+
+        k = min(k, available)
+        if k <= 0:
+            return empty
+        scores, ids = self.index.search(query, k, params=params)
+        keep = ids[0] != -1
+        return ids[0][keep], scores[0][keep]
+
+
+def serve(conn: Connection, threads: int = 1):
+    """Shard süreci ana döngüsü; ön süreç kapanınca (EOF) çıkar"""
+    faiss.omp_set_num_threads(threads)
+    shard = Shard()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        op = message[0]
+        try:
+            if op == "load":
+                result = shard.load(*message[1:])
+            elif op == "update":
+                result = shard.update(*message[1:])
+            elif op == "search":
+                result = shard.search(*message[1:])
+            elif op == "stop":
+                conn.send(("ok", None))
+                break
+            else:
+                raise ValueError(f"Bilinmeyen işlem: {op}")
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", str(e)))
+    conn.close()
+
+
+if __name__ == "__main__":
+    # python -m shard_worker <socket fd> <faiss thread sayısı>
+    serve(Connection(int(sys.argv[1])), int(sys.argv[2]) if len(sys.argv) > 2 else 1)
@@ -0,0 +1,72 @@
+"""BM25 lexical arama, Türkçe normalizasyon ve Reciprocal Rank Fusion testleri"""
+import numpy as np
+import pytest
+
+import app
+
+
+ITEMS = [
+    {"id": 1, "baslik": "Yüzüklerin Efendisi", "aciklama": "Orta Dünya'da bir yüzüğü yok etme yolculuğu"},
+    {"id": 2, "baslik": "Savaş ve Barış", "aciklama": "Napolyon savaşları sırasında Rus aristokrasisi"},
+    {"id": 3, "baslik": "Suç ve Ceza", "aciklama": "Raskolnikov'un işlediği cinayet ve vicdan azabı"},
+    {"id": 4, "baslik": "Yıldızlararası", "aciklama": "Uzay yolculuğu, kara delik ve zaman; savaş yok"},
+]
+
+
+@pytest.fixture
+def bm25():
+    return app.BM25Index.build(ITEMS)
+
+
+def test_normalize_folds_turkish_characters_and_punctuation():
+    assert app.normalize_text("İstanbul'da ŞİİR, Ölüm & Çığ!") == "istanbul da siir olum cig"
+    assert app.tokenize_text("Suç ve Ceza") == ["suc", "ceza"]  # "ve" stopword
+
+
+def test_folded_query_matches_original_spelling(bm25):
+    assert [pos for pos, _ in bm25.search("suc ceza", 5)] == [2]
+
+
+def test_title_match_outranks_description_match(bm25):
+    ranked = bm25.search("savaş", 5)
+    assert [pos for pos, _ in ranked] == [1, 3]
+    assert ranked[0][1] > ranked[1][1] > 0
+
+
+def test_prefix_expansion_matches_longer_terms(bm25):
+    ranked = dict(bm25.search("yolcu", 5))
+    assert set(ranked) == {0, 3}
+    exact = dict(bm25.search("yolculugu", 5))
+    assert ranked[0] == pytest.approx(app.BM25_PREFIX_WEIGHT * exact[0], rel=1e-5)
+
+
+def test_short_tokens_are_not_prefix_expanded(bm25):
+    assert bm25.search("sa", 5) == []
+
+
+def test_allowed_positions_filter_results(bm25):
+    assert [pos for pos, _ in bm25.search("savaş", 5, np.array([3]))] == [3]
+    assert bm25.search("savaş", 5, np.array([0, 2])) == []
+
+
+def test_top_k_is_sorted_by_score(bm25):
+    ranked = bm25.search("yolculuğu savaş ceza", 2)
+    assert len(ranked) == 2
+    assert ranked[0][1] >= ranked[1][1]
+
+
+def test_empty_index_returns_nothing():
+    assert app.BM25Index.build([]).search("savaş", 5) == []
+
+
+def test_rrf_rewards_agreement_between_rankings():
+    dense = [(10, 0.9), (20, 0.8), (30, 0.7)]
+    lexical = [(20, 12.0), (40, 8.0), (10, 1.0)]
+    assert app.reciprocal_rank_fusion([dense, lexical], [1.0, 1.0]) == [20, 10, 40, 30]
+
+
+def test_rrf_weights_and_disabled_rankings():
+    dense = [(10, 0.9), (20, 0.8)]
+    lexical = [(20, 5.0), (10, 1.0)]
+    assert app.reciprocal_rank_fusion([dense, lexical], [2.0, 1.0])[0] == 10
+    assert app.reciprocal_rank_fusion([dense, lexical], [1.0, 0.0]) == [10, 20]
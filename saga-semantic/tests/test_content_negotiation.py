@@ -0,0 +1,100 @@
+"""Accept pazarlığı: JSON, MessagePack ve ham little-endian vektör cevapları, MessagePack istek gövdesi"""
+import zlib
+
+import msgpack
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+
+DIM = 8
+
+
+class HashEncoder:
+    """Metnin crc32'sinden tekrarlanabilir vektör üreten sahte model"""
+    tokenizer = None
+    max_seq_length = 0
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+    def encode(self, texts, output_value=None, **kwargs):
+        return np.stack([
+            np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(DIM) for text in texts
+        ]).astype(np.float32)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, "model", HashEncoder())
+    monkeypatch.setattr(app, "model_name", "test-hash")
+    return TestClient(app.app)
+
+
+def expected_vectors(texts):
+    vectors = HashEncoder().encode(texts)
+    app.faiss.normalize_L2(vectors)
+    return vectors
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, app.JSON_TYPE),
+    ("application/msgpack", app.MSGPACK_TYPE),
+    ("application/x-msgpack;q=0.9, application/json;q=0.5", app.MSGPACK_TYPE),
+    ("application/json, application/msgpack", app.JSON_TYPE),
+    ("application/msgpack;q=0, */*", app.JSON_TYPE),
+    ("application/octet-stream", app.JSON_TYPE),  # Sadece vektör dönen endpoint'lerde
+    ("text/html", app.JSON_TYPE),
+])
+def test_negotiate_media_type(accept, expected):
+    assert app.negotiate_media_type(accept) == expected
+
+
+def test_raw_vectors_only_when_allowed():
+    assert app.negotiate_media_type("application/octet-stream, application/json;q=0.5", raw_vectors=True) == app.RAW_VECTOR_TYPE
+
+
+def test_msgpack_encodes_arrays_as_little_endian_bytes():
+    packed = msgpack.packb({"v": np.arange(3, dtype=np.float64)}, default=app.msgpack_default, use_bin_type=True)
+    np.testing.assert_array_equal(np.frombuffer(msgpack.unpackb(packed)["v"], dtype="<f4"), [0, 1, 2])
+    assert msgpack.unpackb(msgpack.packb(np.int64(5), default=app.msgpack_default)) == 5
+
+
+def test_embed_json(client):
+    response = client.post("/embed", json={"texts": ["bir", "iki"]})
+    assert response.headers["content-type"].startswith(app.JSON_TYPE)
+    np.testing.assert_allclose(response.json()["embeddings"], expected_vectors(["bir", "iki"]), rtol=1e-5)
+
+
+def test_embed_msgpack_request_and_response(client):
+    response = client.post(
+        "/embed", content=msgpack.packb({"texts": ["bir", "iki"], "dtype": "float16"}),
+        headers={"Content-Type": "application/msgpack", "Accept": "application/msgpack"},
+    )
+    assert response.headers["content-type"] == app.MSGPACK_TYPE
+    body = msgpack.unpackb(response.content)
+    assert body["dtype"] == "float16" and body["dimension"] == DIM
+    vectors = np.frombuffer(body["embeddings"], dtype="<f2").reshape(-1, DIM)
+    np.testing.assert_allclose(vectors, expected_vectors(["bir", "iki"]), atol=1e-3)
+
+
+def test_embed_raw_float32(client):
+    response = client.post("/embed", json={"texts": ["bir", "iki", "üç"]}, headers={"Accept": "application/octet-stream"})
+    assert response.headers["content-type"] == app.RAW_VECTOR_TYPE
+    assert response.headers["x-embedding-count"] == "3" and response.headers["x-embedding-dtype"] == "float32"
+    vectors = np.frombuffer(response.content, dtype="<f4").reshape(3, int(response.headers["x-embedding-dimension"]))
+    np.testing.assert_allclose(vectors, expected_vectors(["bir", "iki", "üç"]), rtol=1e-5)
+
+
+def test_embed_raw_int8_sends_scales(client):
+    response = client.post("/embed", json={"texts": ["bir", "iki"], "dtype": "int8"}, headers={"Accept": "application/octet-stream"})
+    scales = np.array(response.headers["x-embedding-scales"].split(","), dtype=np.float32)
+    values = np.frombuffer(response.content, dtype=np.int8).reshape(2, DIM)
+    np.testing.assert_allclose(values * scales[:, None], expected_vectors(["bir", "iki"]), atol=float(scales.max()))
+
+
+def test_invalid_msgpack_body_is_rejected(client):
+    response = client.post("/embed", content=msgpack.packb({"texts": "tek metin"}), headers={"Content-Type": "application/msgpack"})
+    assert response.status_code == 422
@@ -0,0 +1,47 @@
+"""/embed çıktı tipleri: float16 ve vektör başına ölçekli int8 nicemleme testleri"""
+import numpy as np
+import pytest
+
+import app
+
+
+@pytest.fixture
+def vectors():
+    vectors = np.random.default_rng(0).standard_normal((5, 16)).astype(np.float32)
+    vectors[3] = 0.0  # Sıfır vektör ölçeği 0'a bölmemeli
+    return vectors
+
+
+def test_float32_is_unchanged(vectors):
+    values, scales = app.quantize_embeddings(vectors, "float32")
+    assert values.dtype == np.dtype("<f4") and scales is None
+    np.testing.assert_array_equal(values, vectors)
+
+
+def test_float16_halves_size_with_small_error(vectors):
+    values, scales = app.quantize_embeddings(vectors, "float16")
+    assert values.dtype == np.dtype("<f2") and scales is None
+    assert values.nbytes == vectors.nbytes // 2
+    np.testing.assert_allclose(values.astype(np.float32), vectors, rtol=1e-3, atol=1e-3)
+
+
+def test_int8_round_trips_through_scales(vectors):
+    values, scales = app.quantize_embeddings(vectors, "int8")
+    assert values.dtype == np.int8 and scales.dtype == np.float32
+    assert scales.shape == (len(vectors),)
+    assert np.abs(values).max(axis=1).tolist() == [127, 127, 127, 0, 127]  # Her satır tam aralığı kullanır
+    assert scales[3] == 1.0
+    restored = values.astype(np.float32) * scales[:, None]
+    np.testing.assert_allclose(restored, vectors, atol=float(scales.max()) / 2 + 1e-6)
+
+
+def test_int8_keeps_cosine_ranking():
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((50, 64)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    values, scales = app.quantize_embeddings(vectors, "int8")
+    restored = values.astype(np.float32) * scales[:, None]
+    query = vectors[0]
+    exact = np.argsort(-(vectors @ query))[:5]
+    approximate = np.argsort(-(restored @ query))[:5]
+    assert exact.tolist() == approximate.tolist()
@@ -0,0 +1,96 @@
+"""Canlı modelle yapılan tüm encode'ların tek embed worker'ında sıralandığını doğrulayan testler"""
+import asyncio
+import threading
+import time
+import zlib
+
+import numpy as np
+import pytest
+
+import app
+
+
+DIM = 8
+
+
+class ExclusiveEncoder:
+    """Hızlı tokenizer gibi eşzamanlı çağrıda 'Already borrowed' hatası veren sahte model"""
+    tokenizer = None
+
+    def __init__(self):
+        self.busy = threading.Lock()
+        self.threads = set()
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+    def encode(self, texts, output_value=None, **kwargs):
+        if not self.busy.acquire(blocking=False):
+            raise RuntimeError("Already borrowed")
+        try:
+            self.threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+            vectors = np.stack([
+                np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(DIM) for text in texts
+            ]).astype(np.float32)
+        finally:
+            self.busy.release()
+        return vectors
+
+
+@pytest.fixture
+def encoder(monkeypatch):
+    async def skip_save():
+        pass
+
+    encoder = ExclusiveEncoder()
+    monkeypatch.setattr(app, "model", encoder)
+    monkeypatch.setattr(app, "model_name", "test-exclusive")
+    monkeypatch.setattr(app, "MULTI_VECTOR_ENABLED", True)
+    monkeypatch.setattr(app, "SIMILAR_PRECOMPUTE_K", 0)
+    monkeypatch.setattr(app, "index", None)
+    monkeypatch.setattr(app, "content_data", [])
+    monkeypatch.setattr(app, "id_positions", {})
+    monkeypatch.setattr(app, "field_index", None)
+    monkeypatch.setattr(app, "save_index_to_disk", skip_save)
+    return encoder
+
+
+def index_request(ids, mode, title="İçerik"):
+    contents = [
+        app.ContentItem(id=i, baslik=f"{title} {i}", tur="film", aciklama=f"Uzun açıklama {i} " * 3) for i in ids
+    ]
+    return app.IndexRequest(contents=contents, mode=mode)
+
+
+def test_index_and_embed_run_concurrently_on_one_worker(encoder):
+    async def scenario():
+        await app.index_contents(index_request(range(40), "replace"))
+        embeds = [
+            app.get_embedding(app.EmbedRequest(texts=[f"sorgu {n} {k}" for k in range(4)]), accept=None) for n in range(6)
+        ]
+        upsert = app.index_contents(index_request(range(30, 70), "upsert", "Yeni"))
+        return await asyncio.gather(upsert, *embeds)
+
+    indexed, *embedded = asyncio.run(scenario())
+
+    assert indexed["indexed_count"] == 70 and indexed["changed_count"] == 40
+    assert len(embedded) == 6
+    assert encoder.threads and all(name.startswith("embed") for name in encoder.threads)
+
+
+def test_upsert_field_rows_point_at_content_positions(encoder):
+    async def scenario():
+        await app.index_contents(index_request(range(5), "replace"))
+        await app.index_contents(index_request([3, 7], "upsert", "Yeni"))
+
+    asyncio.run(scenario())
+
+    assert [item["id"] for item in app.content_data] == [0, 1, 2, 3, 4, 7]
+    assert sorted(set(app.field_parents.tolist())) == list(range(6))
+    assert app.field_index.ntotal == len(app.field_parents)
+    updated = app.field_parents == 3
+    title_rows = updated & (app.field_kinds == app.FIELD_KINDS["baslik"])
+    expected = encoder.encode(["Yeni 3"])
+    app.faiss.normalize_L2(expected)
+    np.testing.assert_allclose(app.get_index_vectors(app.field_index)[title_rows], expected, rtol=1e-5)
@@ -0,0 +1,101 @@
+"""ETag / If-None-Match: koşullu istekler, index sürümü ve cevap tipine bağlı doğrulayıcı testleri"""
+import asyncio
+
+import faiss
+import numpy as np
+import pytest
+
+import app
+
+
+DIM = 8
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    monkeypatch.setattr(app, "ETAG_ENABLED", True)
+    monkeypatch.setattr(app, "MULTI_VECTOR_ENABLED", False)
+    monkeypatch.setattr(app, "SIMILAR_PRECOMPUTE_K", 0)
+    monkeypatch.setattr(app, "RERANK_ENABLED", False)
+    monkeypatch.setattr(app, "SHARED_INDEX_DIR", "")
+    for name, value in [("index", None), ("content_data", []), ("id_positions", {}), ("position_keys", []),
+                        ("tur_positions", {}), ("title_positions", {}), ("bm25_index", None), ("prefix_index", None),
+                        ("field_index", None), ("neighbor_ids", None), ("neighbor_scores", None),
+                        ("index_reserve", (lambda: None, 0))]:
+        monkeypatch.setattr(app, name, value)
+    monkeypatch.setattr(app, "search_candidates", app.OrderedDict())
+
+    async def fake_encode_query(text):
+        query = np.ones((1, DIM), dtype=np.float32)
+        faiss.normalize_L2(query)
+        return query
+
+    monkeypatch.setattr(app, "encode_query", fake_encode_query)
+    upsert([{"id": i, "baslik": f"İçerik {i}", "tur": "film", "aciklama": "macera"} for i in range(10)], seed=1)
+
+
+def upsert(items, seed):
+    vectors = np.random.default_rng(seed).standard_normal((len(items), DIM)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    positions = app.apply_upsert(items, vectors)
+    app.rebuild_derived_indexes(changed_positions=positions if app.bm25_index is not None else None)
+
+
+def search(if_none_match=None, accept=None, **fields):
+    request = app.SearchRequest(**{"query": "macera", "limit": 3, **fields})
+    return asyncio.run(app.semantic_search(request, if_none_match=if_none_match, accept=accept))
+
+
+def similar(content_id, if_none_match=None, accept=None):
+    return asyncio.run(app.similar_contents(content_id, 3, None, if_none_match=if_none_match, accept=accept))
+
+
+def test_etag_matching_rules():
+    assert app.etag_matches('W/"abc"', 'W/"abc"')
+    assert app.etag_matches('"abc"', 'W/"abc"')  # Zayıf karşılaştırma
+    assert app.etag_matches('"x", W/"abc"', 'W/"abc"')
+    assert app.etag_matches("*", 'W/"abc"')
+    assert not app.etag_matches('W/"abd"', 'W/"abc"')
+    assert not app.etag_matches(None, 'W/"abc"')
+    assert not app.etag_matches('W/"abc"', None)
+
+
+def test_search_revalidates_with_304(catalog):
+    first = search()
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and first.headers["cache-control"] == app.RESPONSE_CACHE_CONTROL
+
+    again = search(if_none_match=etag)
+    assert again.status_code == 304 and again.body == b""
+    assert again.headers["etag"] == etag
+    assert search(if_none_match=etag, limit=4).status_code == 200  # Başka parametre, başka doğrulayıcı
+
+
+def test_index_change_invalidates_etags(catalog):
+    search_etag = search().headers["etag"]
+    similar_etag = similar(1).headers["etag"]
+    upsert([{"id": 50, "baslik": "Yeni", "tur": "film", "aciklama": "macera"}], seed=2)
+    assert search(if_none_match=search_etag).status_code == 200
+    assert similar(1, if_none_match=similar_etag).status_code == 200
+
+
+def test_etag_depends_on_media_type(catalog):
+    json_etag = search().headers["etag"]
+    msgpack = search(if_none_match=json_etag, accept=app.MSGPACK_TYPE)
+    assert msgpack.status_code == 200 and msgpack.headers["etag"] != json_etag
+    assert msgpack.headers["vary"] == "Accept"
+
+
+def test_similar_etag_follows_the_neighbour_table(catalog, monkeypatch):
+    live_etag = similar(1).headers["etag"]
+    assert similar(1, if_none_match=live_etag).status_code == 304
+    monkeypatch.setattr(app, "neighbor_ids", np.full((len(app.content_data), 1), -1, dtype=np.int32))
+    monkeypatch.setattr(app, "neighbor_scores", np.zeros((len(app.content_data), 1), dtype=np.float16))
+    monkeypatch.setattr(app, "neighbor_generation", app.index_generation)
+    assert similar(1, if_none_match=live_etag).status_code == 200
+
+
+def test_disabled_etags(catalog, monkeypatch):
+    monkeypatch.setattr(app, "ETAG_ENABLED", False)
+    response = search(if_none_match="*")
+    assert response.status_code == 200 and "etag" not in response.headers
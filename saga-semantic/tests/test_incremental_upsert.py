@@ -0,0 +1,138 @@
+"""Artımlı upsert'ün (index sonuna ekleme, BM25 segmentleri, haritalar) baştan kurulumla aynı sonucu verdiği testler"""
+import random
+
+import faiss
+import numpy as np
+import pytest
+
+import app
+
+
+DIM = 8
+WORDS = ["yuzuk", "kardesligi", "savas", "baris", "uzay", "yolculugu", "ask", "suc", "ceza", "kayip", "sehir", "gece"]
+TURS = ["film", "kitap", "dizi"]
+
+
+def make_item(item_id, rng):
+    return {
+        "id": item_id,
+        "baslik": " ".join(rng.sample(WORDS, 2)),
+        "tur": rng.choice(TURS),
+        "aciklama": " ".join(rng.choices(WORDS, k=6)),
+    }
+
+
+def make_vectors(n, seed):
+    vectors = np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+@pytest.fixture
+def empty_index(monkeypatch):
+    monkeypatch.setattr(app, "MULTI_VECTOR_ENABLED", False)
+    monkeypatch.setattr(app, "SIMILAR_PRECOMPUTE_K", 0)
+    monkeypatch.setattr(app, "BM25_MERGE_RATIO", 0.5)
+    for name, value in [("index", None), ("content_data", []), ("id_positions", {}), ("position_keys", []),
+                        ("tur_positions", {}), ("title_positions", {}), ("bm25_index", None), ("prefix_index", None),
+                        ("index_reserve", (lambda: None, 0))]:
+        monkeypatch.setattr(app, name, value)
+
+
+def upsert(items, seed):
+    positions = app.apply_upsert(items, make_vectors(len(items), seed))
+    app.rebuild_derived_indexes(changed_positions=positions)
+    return positions
+
+
+def test_appends_reuse_the_published_index(empty_index):
+    rng = random.Random(1)
+    upsert([make_item(i, rng) for i in range(10)], 1)
+    first = app.index
+    view = app.get_index_vectors(first)
+    before = view.copy()
+    upsert([make_item(i, rng) for i in range(10, 15)], 2)
+
+    assert app.index is first and app.index.ntotal == 15
+    np.testing.assert_array_equal(view, before)  # Eski görünüm taşınmadı, satırları değişmedi
+    upsert([make_item(3, rng)], 3)
+    assert app.index is not first and first.ntotal == 15  # Güncelleme kopyada yapıldı
+    np.testing.assert_array_equal(app.get_index_vectors(first)[:10], before)
+
+
+def test_index_prefix_ignores_rows_added_later(empty_index):
+    rng = random.Random(2)
+    upsert([make_item(i, rng) for i in range(4)], 1)
+    source = app.index
+    upsert([make_item(i, rng) for i in range(4, 9)], 2)
+    assert app.index is source
+    assert app.index_prefix(source, 4).ntotal == 4
+
+
+def test_incremental_state_matches_full_rebuild(empty_index):
+    rng = random.Random(3)
+    next_id = 0
+    for step in range(30):
+        items = []
+        for _ in range(rng.randint(1, 6)):
+            if next_id and rng.random() < 0.4:
+                items.append(make_item(rng.randrange(next_id), rng))
+            else:
+                items.append(make_item(next_id, rng))
+                next_id += 1
+        items = list({item["id"]: item for item in items}.values())
+        upsert(items, step)
+
+    incremental = (app.bm25_index, dict(app.tur_positions), dict(app.title_positions), dict(app.id_positions), app.prefix_index)
+    assert len(app.bm25_index.segments) > 1
+    app.rebuild_derived_indexes()
+    bm25, tur_positions, title_positions, id_positions, prefix_index = incremental
+
+    assert id_positions == app.id_positions
+    assert title_positions == app.title_positions
+    assert tur_positions.keys() == app.tur_positions.keys()
+    for tur, positions in app.tur_positions.items():
+        np.testing.assert_array_equal(tur_positions[tur], positions)
+    for query in ["savas", "yuz", "uzay yolculugu", "kayip sehir gece", "ceza"]:
+        expected = app.bm25_index.search(query, 50)
+        got = bm25.search(query, 50)
+        assert [pos for pos, _ in got] == [pos for pos, _ in expected]
+        np.testing.assert_allclose([score for _, score in got], [score for _, score in expected], rtol=1e-5)
+        allowed = app.tur_positions["film"]
+        assert [pos for pos, _ in bm25.search(query, 5, allowed)] == [pos for pos, _ in app.bm25_index.search(query, 5, allowed)]
+    for prefix in ["s", "ka", "gece", "uzay y"]:
+        assert set(prefix_index.search(prefix, 100)) == set(app.prefix_index.search(prefix, 100))
+        assert set(prefix_index.search(prefix, 100, "kitap")) == set(app.prefix_index.search(prefix, 100, "kitap"))
+
+
+def test_field_index_appends_and_extends_lookup(monkeypatch, empty_index):
+    monkeypatch.setattr(app, "MULTI_VECTOR_ENABLED", True)
+    monkeypatch.setattr(app, "field_index", None)
+    monkeypatch.setattr(app, "field_reserve", (lambda: None, 0))
+    rng = random.Random(4)
+
+    def field_upsert(items, seed):
+        positions = upsert(items, seed)
+        count = sum(1 + len(app.split_passages(item["aciklama"])) for item in items)
+        vectors = make_vectors(count, seed + 100)
+        parents, kinds = [], []
+        for pos, item in zip(positions, items):
+            parents += [pos] * (1 + len(app.split_passages(item["aciklama"])))
+            kinds += [app.FIELD_KINDS["baslik"]] + [app.FIELD_KINDS["aciklama"]] * len(app.split_passages(item["aciklama"]))
+        fields = (vectors, np.array(parents, dtype=np.int32), np.array(kinds, dtype=np.int8))
+        app.update_field_index(positions if app.field_index is not None else None, fields)
+
+    field_upsert([make_item(i, rng) for i in range(6)], 1)
+    field_upsert([make_item(i, rng) for i in range(6, 8)], 2)  # Kapasiteli kopyaya geçer
+    first = app.field_index
+    field_upsert([make_item(i, rng) for i in range(8, 10)], 2)
+    assert app.field_index is first
+    field_upsert([make_item(2, rng), make_item(10, rng)], 3)
+
+    incremental = (app.field_order.copy(), app.field_offsets.copy(), {tur: rows.copy() for tur, rows in app.field_tur_rows.items()})
+    app.rebuild_field_lookup()
+    order, offsets, tur_rows = incremental
+    np.testing.assert_array_equal(offsets, app.field_offsets)
+    np.testing.assert_array_equal(app.field_parents[order], app.field_parents[app.field_order])
+    for tur, rows in app.field_tur_rows.items():
+        np.testing.assert_array_equal(np.sort(tur_rows.get(tur, np.zeros(0, dtype=np.int64))), rows)
@@ -0,0 +1,148 @@
+"""WAL tekrarı, yarım kayıt kesme ve checkpoint tamamlama testleri"""
+import json
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+import app
+
+
+DIM = 8
+
+
+def make_items(ids, title="İçerik"):
+    return [{"id": i, "baslik": f"{title} {i}", "tur": "film", "aciklama": f"Açıklama {i}"} for i in ids]
+
+
+def make_vectors(n, seed):
+    vectors = np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+@pytest.fixture
+def empty_index(tmp_path, monkeypatch):
+    """Boş index + geçici dizinde açık bir log"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, "MULTI_VECTOR_ENABLED", False)
+    monkeypatch.setattr(app, "SIMILAR_PRECOMPUTE_K", 0)
+    monkeypatch.setattr(app, "model_name", "test-model")
+    monkeypatch.setattr(app, "index", None)
+    monkeypatch.setattr(app, "content_data", [])
+    monkeypatch.setattr(app, "id_positions", {})
+    monkeypatch.setattr(app, "field_index", None)
+    wal = app.WriteAheadLog(str(tmp_path / "wal"), fsync=False)
+    wal.open()
+    monkeypatch.setattr(app, "index_wal", wal)
+    return wal
+
+
+def reset_index(monkeypatch):
+    monkeypatch.setattr(app, "index", None)
+    monkeypatch.setattr(app, "content_data", [])
+    monkeypatch.setattr(app, "id_positions", {})
+
+
+def log_upsert(items, vectors):
+    positions = app.apply_upsert(items, vectors)
+    app.log_index_upsert(items, vectors, positions, None)
+
+
+def test_replay_restores_upserts(empty_index, monkeypatch):
+    first, second = make_vectors(3, 1), make_vectors(2, 2)
+    log_upsert(make_items([1, 2, 3]), first)
+    log_upsert(make_items([2, 4], "Yeni"), second)  # 2 güncellenir, 4 eklenir
+
+    reset_index(monkeypatch)
+    reader = app.WriteAheadLog(empty_index.directory, fsync=False)
+    monkeypatch.setattr(app, "index_wal", reader)
+    assert app.replay_index_wal(0) == 2
+
+    assert [item["id"] for item in app.content_data] == [1, 2, 3, 4]
+    assert app.content_data[1]["baslik"] == "Yeni 2"
+    vectors = app.get_index_vectors()
+    np.testing.assert_array_equal(vectors[[0, 2]], first[[0, 2]])
+    np.testing.assert_array_equal(vectors[[1, 3]], second)
+    assert reader.last_seq == 2
+
+
+def test_replay_skips_records_covered_by_snapshot(empty_index, monkeypatch):
+    log_upsert(make_items([1]), make_vectors(1, 1))
+    log_upsert(make_items([2]), make_vectors(1, 2))
+
+    reset_index(monkeypatch)
+    reader = app.WriteAheadLog(empty_index.directory, fsync=False)
+    monkeypatch.setattr(app, "index_wal", reader)
+    assert app.replay_index_wal(1) == 1
+    assert [item["id"] for item in app.content_data] == [2]
+
+
+def test_sequence_continues_after_snapshot(empty_index, monkeypatch):
+    """Log boşken açılış snapshot'ın wal_seq'inden devam etmeli, yoksa yeni kayıtlar atlanır"""
+    reader = app.WriteAheadLog(empty_index.directory, fsync=False)
+    monkeypatch.setattr(app, "index_wal", reader)
+    app.replay_index_wal(7)
+    reader.open()
+    assert reader.append({"op": "upsert", "items": []}, b"") == 8
+
+
+def test_torn_tail_is_truncated(empty_index):
+    log_upsert(make_items([1]), make_vectors(1, 1))
+    log_upsert(make_items([2]), make_vectors(1, 2))
+    path = empty_index.segments()[-1][1]
+    complete = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(app.WAL_RECORD_HEADER.pack(500, 0) + b"partial")
+
+    reader = app.WriteAheadLog(empty_index.directory, fsync=False)
+    assert [header["seq"] for header, _ in reader.read(0)] == [1, 2]
+    assert os.path.getsize(path) == complete
+
+
+def test_corrupt_record_stops_replay(empty_index):
+    log_upsert(make_items([1]), make_vectors(1, 1))
+    path = empty_index.segments()[-1][1]
+    first = os.path.getsize(path)
+    log_upsert(make_items([2]), make_vectors(1, 2))
+    with open(path, "r+b") as f:
+        f.seek(first + app.WAL_RECORD_HEADER.size + 3)
+        f.write(b"X")  # CRC tutmaz
+
+    reader = app.WriteAheadLog(empty_index.directory, fsync=False)
+    assert [header["seq"] for header, _ in reader.read(0)] == [1]
+    assert os.path.getsize(path) == first
+
+
+def test_finish_pending_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name, old, new in (("a.bin", b"eski", b"yeni"), ("b.json", b"{}", b"[1]")):
+        (tmp_path / name).write_bytes(old)
+        (tmp_path / (name + ".tmp")).write_bytes(new)
+    (tmp_path / app.CHECKPOINT_PENDING_PATH).write_text(json.dumps(["a.bin", "b.json"]))
+
+    app.finish_pending_checkpoint()
+    assert (tmp_path / "a.bin").read_bytes() == b"yeni"
+    assert (tmp_path / "b.json").read_bytes() == b"[1]"
+    assert not (tmp_path / app.CHECKPOINT_PENDING_PATH).exists()
+    app.finish_pending_checkpoint()  # Marker yoksa bir şey yapmaz
+
+
+def test_checkpoint_round_trip_and_order(empty_index, monkeypatch):
+    log_upsert(make_items([1, 2]), make_vectors(2, 1))
+    older = app.capture_checkpoint_state()
+    log_upsert(make_items([3]), make_vectors(1, 2))
+    newer = app.capture_checkpoint_state()
+
+    assert app.write_checkpoint(newer)
+    assert not app.write_checkpoint(older)  # Daha yeni snapshot'ın üzerine yazmaz
+
+    with open(app.INDEX_META_PATH, encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["wal_seq"] == 2 and meta["count"] == 3
+    with open("content_data.json", encoding="utf-8") as f:
+        assert [item["id"] for item in json.load(f)] == [1, 2, 3]
+    stored = faiss.read_index("faiss_index.bin")  # Görünüm index'e referans tutmaz
+    np.testing.assert_array_equal(app.get_index_vectors(stored), app.get_index_vectors())
+    assert not any(name.endswith(".tmp") for name in os.listdir("."))
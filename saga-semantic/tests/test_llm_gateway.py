@@ -0,0 +1,134 @@
+"""LLM gateway: slot/bütçe kabulü, yük atma ve token iadesi testleri"""
+import asyncio
+
+import httpx
+import pytest
+
+import app
+
+
+def make_gateway(monkeypatch, slots=2, rpm=60, tpm=6000):
+    gateway = app.LLMGateway(slots, rpm, tpm)
+    monkeypatch.setattr(app, "llm_gateway", gateway)
+    return gateway
+
+
+def test_acquire_charges_budget_and_release_frees_slot(monkeypatch):
+    gateway = make_gateway(monkeypatch)
+
+    async def scenario():
+        assert await gateway.acquire("interactive", 500) is None
+        assert gateway.free_slots == 1
+        gateway.tokens.refill()
+        assert gateway.tokens.level == pytest.approx(5500, abs=5)
+        gateway.release()
+        assert gateway.free_slots == 2
+
+    asyncio.run(scenario())
+
+
+def test_batch_leaves_reserve_for_interactive(monkeypatch):
+    monkeypatch.setattr(app, "LLM_BATCH_RESERVE", 0.3)
+    gateway = make_gateway(monkeypatch, slots=4, tpm=1000)
+    gateway.tokens.level = 500  # Rezerv (300) + 400 token'lık çağrı sığmaz
+    assert gateway.admission_wait("interactive", 400) == 0.0
+    assert gateway.admission_wait("batch", 400) > 0
+
+
+def test_batch_never_takes_the_last_slot(monkeypatch):
+    gateway = make_gateway(monkeypatch, slots=2)
+    gateway.free_slots = 1
+    assert gateway.admission_wait("batch", 10) is None
+    assert gateway.admission_wait("interactive", 10) == 0.0
+
+
+def test_full_queue_is_shed(monkeypatch):
+    monkeypatch.setitem(app.LLM_QUEUE_LIMITS, "standard", 1)
+    gateway = make_gateway(monkeypatch, slots=1)
+
+    async def scenario():
+        assert await gateway.acquire("standard", 10) is None  # Tek slotu tutar
+        waiting = asyncio.ensure_future(gateway.acquire("standard", 10))
+        await asyncio.sleep(0)
+        assert await gateway.acquire("standard", 10) == "queue_full"
+        gateway.release()
+        assert await waiting is None
+
+    asyncio.run(scenario())
+
+
+def test_request_budget_beyond_deadline_is_shed(monkeypatch):
+    gateway = make_gateway(monkeypatch, rpm=1)
+    gateway.requests.level = 0  # Bir sonraki istek hakkı 60 sn sonra, sınır 8 sn
+
+    async def scenario():
+        return await gateway.acquire("interactive", 10)
+
+    assert asyncio.run(scenario()) == "budget"
+
+
+def test_settle_refunds_difference_up_to_capacity(monkeypatch):
+    gateway = make_gateway(monkeypatch, tpm=1000)
+    gateway.tokens.level = 200
+    gateway.settle(600, 100)
+    assert gateway.tokens.level == pytest.approx(700, abs=1)
+    gateway.settle(600, 0)
+    assert gateway.tokens.level == pytest.approx(1000)
+    gateway.settle(100, 400)  # Tahmin düşük kaldıysa fark da düşülür
+    assert gateway.tokens.level == pytest.approx(700, abs=1)
+
+
+def groq_transport(monkeypatch, handler):
+    real_client = httpx.AsyncClient
+
+    class Client(real_client):
+        def __init__(self, *args, **kwargs):
+            kwargs["transport"] = httpx.MockTransport(handler)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(app.httpx, "AsyncClient", Client)
+
+
+def charged_call(monkeypatch, handler, cost=800, response_format=None):
+    """Gateway'den geçmiş gibi cost düşülür, çağrıdan sonra kalan seviye döner"""
+    gateway = make_gateway(monkeypatch, tpm=1000)
+    groq_transport(monkeypatch, handler)
+    gateway.tokens.level -= cost
+    result = asyncio.run(app.call_groq_api([{"role": "user", "content": "selam"}], 300, response_format, cost))
+    gateway.tokens.refill()
+    return result, gateway.tokens.level
+
+
+def test_groq_success_keeps_reported_usage(monkeypatch):
+    def handler(request):
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}], "usage": {"total_tokens": 150}})
+
+    result, level = charged_call(monkeypatch, handler)
+    assert result == "ok"
+    assert level == pytest.approx(850, abs=1)
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_groq_error_refunds_whole_estimate(monkeypatch, status):
+    result, level = charged_call(monkeypatch, lambda request: httpx.Response(status, json={}))
+    assert result is None
+    assert level == pytest.approx(1000)
+
+
+def test_groq_connection_error_refunds_whole_estimate(monkeypatch):
+    def handler(request):
+        raise httpx.ConnectError("bağlantı yok", request=request)
+
+    result, level = charged_call(monkeypatch, handler)
+    assert result is None
+    assert level == pytest.approx(1000)
+
+
+def test_groq_failed_json_generation_keeps_estimate(monkeypatch):
+    def handler(request):
+        error = {"code": "json_validate_failed", "failed_generation": "{\"a\": "}
+        return httpx.Response(400, json={"error": error})
+
+    result, level = charged_call(monkeypatch, handler, response_format={"type": "json_object"})
+    assert result == "{\"a\": "
+    assert level == pytest.approx(200, abs=1)
@@ -0,0 +1,62 @@
+"""Başlık prefix index'i (autocomplete) arama ve artımlı güncelleme testleri"""
+import app
+
+
+ITEMS = [
+    {"baslik": "Harry Potter ve Felsefe Taşı", "tur": "Kitap", "populerlik": 900, "puan": 8.0},
+    {"baslik": "Harry Potter ve Sırlar Odası", "tur": "Film", "populerlik": 100, "puan": 7.0},
+    {"baslik": "Hayalet Avcıları", "tur": "Film", "populerlik": 50, "puan": 6.0},
+    {"baslik": "Şeker Portakalı", "tur": "Kitap", "populerlik": 300, "puan": 9.0},
+]
+
+
+def test_search_orders_by_popularity():
+    prefix_index = app.TitlePrefixIndex.build(ITEMS)
+    assert prefix_index.search("har", 10) == [0, 1]
+    assert prefix_index.search("h", 2) == [0, 1]
+
+
+def test_search_matches_word_starts_and_folds_turkish():
+    prefix_index = app.TitlePrefixIndex.build(ITEMS)
+    assert prefix_index.search("potter", 10) == [0, 1]
+    assert prefix_index.search("SEKER", 10) == [3]
+    assert prefix_index.search("sirlar", 10) == [1]
+
+
+def test_title_start_outranks_word_match():
+    items = [
+        {"baslik": "Dev Portakal", "tur": "film", "populerlik": 0, "puan": 0},
+        {"baslik": "Portakal", "tur": "film", "populerlik": 0, "puan": 0},
+    ]
+    assert app.TitlePrefixIndex.build(items).search("porta", 10) == [1, 0]
+
+
+def test_tur_filter():
+    prefix_index = app.TitlePrefixIndex.build(ITEMS)
+    assert prefix_index.search("har", 10, tur="film") == [1]
+    assert prefix_index.search("har", 10, tur="dizi") == []
+
+
+def test_empty_or_unmatched_prefix():
+    prefix_index = app.TitlePrefixIndex.build(ITEMS)
+    assert prefix_index.search("", 10) == []
+    assert prefix_index.search("  !", 10) == []
+    assert prefix_index.search("zzz", 10) == []
+
+
+def test_update_replaces_changed_and_adds_new_positions():
+    items = [dict(item) for item in ITEMS]
+    prefix_index = app.TitlePrefixIndex.build(items)
+    items[2] = {"baslik": "Karanlık Oda", "tur": "Dizi", "populerlik": 10, "puan": 5.0}
+    items.append({"baslik": "Hayat Bilgisi", "tur": "Kitap", "populerlik": 5, "puan": 4.0})
+    prefix_index.update(items, [2, 4])
+
+    assert prefix_index.search("hayalet", 10) == []
+    assert prefix_index.search("oda", 10) == [1, 2]
+    assert prefix_index.search("hay", 10) == [4]
+    assert prefix_index.search("kar", 10, tur="dizi") == [2]
+    assert prefix_index.keys == sorted(prefix_index.keys)
+
+    rebuilt = app.TitlePrefixIndex.build(items)
+    for prefix in ["h", "o", "k", "s", "potter"]:
+        assert prefix_index.search(prefix, 10) == rebuilt.search(prefix, 10)
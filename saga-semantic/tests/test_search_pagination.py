@@ -0,0 +1,120 @@
+"""/search cursor sayfalaması (cache'lenmiş aday listesi) ve MMR çeşitlilik testleri"""
+import asyncio
+import json
+
+import faiss
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import app
+
+
+DIM = 8
+
+
+def unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, DIM).copy()
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    monkeypatch.setattr(app, "MULTI_VECTOR_ENABLED", False)
+    monkeypatch.setattr(app, "SIMILAR_PRECOMPUTE_K", 0)
+    monkeypatch.setattr(app, "RERANK_ENABLED", False)
+    monkeypatch.setattr(app, "SEARCH_CANDIDATE_DEPTH", 30)
+    for name, value in [("index", None), ("content_data", []), ("id_positions", {}), ("position_keys", []),
+                        ("tur_positions", {}), ("title_positions", {}), ("bm25_index", None), ("prefix_index", None),
+                        ("field_index", None), ("index_reserve", (lambda: None, 0))]:
+        monkeypatch.setattr(app, name, value)
+    monkeypatch.setattr(app, "search_candidates", app.OrderedDict())
+
+    query = unit(np.random.default_rng(0).standard_normal(DIM))
+    encodes = []
+
+    async def fake_encode_query(text):
+        encodes.append(text)
+        return query.copy()
+
+    monkeypatch.setattr(app, "encode_query", fake_encode_query)
+    items = [{"id": i, "baslik": f"İçerik {i}", "tur": "film" if i % 2 else "dizi", "aciklama": "macera"} for i in range(40)]
+    vectors = unit(np.random.default_rng(1).standard_normal((len(items), DIM)))
+    app.apply_upsert(items, vectors)
+    app.rebuild_derived_indexes()
+    return encodes
+
+
+def search(**fields):
+    response = asyncio.run(app.semantic_search(app.SearchRequest(**fields), if_none_match=None, accept=None))
+    return json.loads(response.body)
+
+
+def collect_pages(**fields):
+    pages = [search(**fields)]
+    while pages[-1]["next_cursor"]:
+        pages.append(search(cursor=pages[-1]["next_cursor"], **fields))
+    return pages
+
+
+def test_pages_follow_the_cached_list_without_reencoding(catalog):
+    pages = collect_pages(query="macera", limit=7, lexical_weight=0.0)
+    ids = [result["id"] for page in pages for result in page["results"]]
+
+    assert len(catalog) == 1
+    assert len(ids) == len(set(ids)) == 30
+    assert [len(page["results"]) for page in pages] == [7, 7, 7, 7, 2]
+    whole = search(query="macera", limit=30, lexical_weight=0.0)
+    assert [result["id"] for result in whole["results"]] == ids
+    assert whole["next_cursor"] is None
+
+
+def test_limit_does_not_change_the_list(catalog):
+    small = [result["id"] for page in collect_pages(query="macera", limit=4, tur="film") for result in page["results"]]
+    large = [result["id"] for page in collect_pages(query="macera", limit=9, tur="film") for result in page["results"]]
+    assert small == large
+    assert len(catalog) == 1  # İkinci sayfa boyutu aynı listeyi kullandı
+
+
+def test_cursor_from_another_query_is_rejected(catalog):
+    cursor = search(query="macera", limit=5)["next_cursor"]
+    with pytest.raises(HTTPException) as error:
+        search(query="başka", limit=5, cursor=cursor)
+    assert error.value.status_code == 400
+    with pytest.raises(HTTPException):
+        search(query="macera", limit=5, cursor=cursor.split(":")[0] + ":x")
+
+
+def test_index_change_rebuilds_the_list(catalog):
+    cursor = search(query="macera", limit=5)["next_cursor"]
+    app.apply_upsert([{"id": 100, "baslik": "Yeni", "tur": "film", "aciklama": "macera"}], unit(np.ones(DIM)))
+    app.rebuild_derived_indexes(changed_positions=[40])
+    page = search(query="macera", limit=5, cursor=cursor)
+    assert len(page["results"]) == 5
+    assert len(catalog) == 2
+
+
+def test_mmr_pushes_near_duplicates_down():
+    query = unit([1, 0, 0, 0, 0, 0, 0, 0])
+    candidates = unit([
+        [1, 0.1, 0, 0, 0, 0, 0, 0],
+        [1, 0.1, 0.001, 0, 0, 0, 0, 0],  # İlkinin neredeyse aynısı
+        [0.8, 0, 0.6, 0, 0, 0, 0, 0],
+    ])
+    assert app.mmr_rerank(query, candidates, 3, diversity=0.0) == [0, 1, 2]
+    assert app.mmr_rerank(query, candidates, 3, diversity=0.5) == [0, 2, 1]
+
+
+def test_mmr_uses_given_relevance_and_limit():
+    candidates = unit(np.eye(DIM)[:4])
+    relevance = np.array([0.1, 0.9, 0.5, 0.3], dtype=np.float32)
+    assert app.mmr_rerank(unit(np.ones(DIM)), candidates, 2, diversity=0.3, relevance=relevance) == [1, 2]
+    assert app.mmr_rerank(unit(np.ones(DIM)), candidates[:0], 2) == []
+
+
+def test_diversity_keeps_every_candidate_once(catalog):
+    ids = [result["id"] for page in collect_pages(query="macera", limit=8, diversity=0.7) for result in page["results"]]
+    assert len(ids) == len(set(ids))
+    plain = [result["id"] for page in collect_pages(query="macera", limit=8) for result in page["results"]]
+    assert set(ids) == set(plain) and ids != plain
@@ -0,0 +1,104 @@
+"""Shard süreci: tür filtresi ve hariç tutma ile arama, güncelleme ve mesaj döngüsü testleri"""
+import threading
+from multiprocessing import Pipe
+
+import faiss
+import numpy as np
+import pytest
+
+import shard_worker
+
+
+DIM = 8
+TURS = ["film", "dizi", "kitap"]
+
+
+@pytest.fixture
+def data():
+    vectors = np.random.default_rng(0).standard_normal((30, DIM)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    ids = np.arange(100, 130, dtype=np.int64)  # Ön süreç pozisyonları, 0'dan başlamak zorunda değil
+    turs = [TURS[i % 3] for i in range(len(ids))]
+    return ids, vectors, turs
+
+
+@pytest.fixture
+def shard(data):
+    shard = shard_worker.Shard()
+    assert shard.load(DIM, *data) == 30
+    return shard
+
+
+def brute_force(data, query, k, allowed=lambda content_id, tur: True):
+    ids, vectors, turs = data
+    scores = vectors @ query[0]
+    order = [i for i in np.argsort(-scores) if allowed(int(ids[i]), turs[i])]
+    return ids[order[:k]].tolist()
+
+
+def test_search_matches_brute_force(shard, data):
+    query = data[1][:1]
+    ids, scores = shard.search(query, 5, None, None)
+    assert ids.tolist() == brute_force(data, query, 5)
+    assert ids[0] == 100 and scores[0] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_type_filter(shard, data):
+    query = data[1][:1]
+    ids, _ = shard.search(query, 4, "dizi", None)
+    assert ids.tolist() == brute_force(data, query, 4, lambda content_id, tur: tur == "dizi")
+    assert shard.search(query, 50, "dizi", None)[0].size == 10  # k türdeki sayıyla sınırlanır
+    assert shard.search(query, 5, "belgesel", None)[0].size == 0
+
+
+def test_exclude(shard, data):
+    query = data[1][:1]
+    exclude = np.array([100, 103], dtype=np.int64)
+    ids, _ = shard.search(query, 5, None, exclude)
+    assert ids.tolist() == brute_force(data, query, 5, lambda content_id, tur: content_id not in (100, 103))
+
+
+def test_type_filter_and_exclude_together(shard, data):
+    query = data[1][3:4]
+    exclude = np.array([103, 106], dtype=np.int64)
+    ids, _ = shard.search(query, 50, "film", exclude)
+    expected = brute_force(data, query, 50, lambda content_id, tur: tur == "film" and content_id not in (103, 106))
+    assert ids.tolist() == expected and len(expected) == 8
+
+
+def test_update_replaces_and_adds(shard, data):
+    vectors = np.random.default_rng(1).standard_normal((2, DIM)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    assert shard.update(np.array([100], dtype=np.int64), np.array([100, 200], dtype=np.int64), vectors, ["kitap", "dizi"]) == 31
+    ids, scores = shard.search(vectors[:1], 1, None, None)
+    assert ids.tolist() == [100] and scores[0] == pytest.approx(1.0, abs=1e-5)
+    assert 100 not in shard.search(vectors[:1], 50, "film", None)[0].tolist()
+    assert 200 in shard.search(vectors[1:], 3, "dizi", None)[0].tolist()
+
+
+def test_empty_shard_returns_nothing():
+    shard = shard_worker.Shard()
+    assert shard.search(np.ones((1, DIM), dtype=np.float32), 5, None, None)[0].size == 0
+    shard.load(DIM, np.zeros(0, dtype=np.int64), np.zeros((0, DIM), dtype=np.float32), [])
+    assert shard.search(np.ones((1, DIM), dtype=np.float32), 5, "film", None)[0].size == 0
+
+
+def test_serve_loop_answers_and_reports_errors(data):
+    front, worker = Pipe()
+    thread = threading.Thread(target=shard_worker.serve, args=(worker,), daemon=True)
+    thread.start()
+    try:
+        front.send(("load", DIM, *data))
+        assert front.recv() == ("ok", 30)
+        front.send(("search", data[1][:1], 2, "film", None))
+        status, (ids, _) = front.recv()
+        assert status == "ok" and ids.tolist() == brute_force(data, data[1][:1], 2, lambda content_id, tur: tur == "film")
+        front.send(("siralama",))
+        status, message = front.recv()
+        assert status == "error" and "siralama" in message
+        front.send(("stop",))
+        assert front.recv() == ("ok", None)
+    finally:
+        thread.join(timeout=5)
+        front.close()
+    assert not thread.is_alive()
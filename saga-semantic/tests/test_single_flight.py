@@ -0,0 +1,116 @@
+"""Single-flight: eşzamanlı aynı çağrıların birleştirilmesi, hata paylaşımı ve iptal testleri"""
+import asyncio
+
+import pytest
+
+import app
+
+
+class Upstream:
+    """Çağrı sayısını tutan, release edilene kadar bekleyen sahte upstream"""
+
+    def __init__(self, result="cevap", error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def test_concurrent_callers_share_one_call():
+    upstream = Upstream()
+
+    async def scenario():
+        upstream.release = asyncio.Event()
+        waiters = [asyncio.ensure_future(app.single_flight("test", "k", upstream)) for _ in range(5)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await asyncio.gather(*waiters)
+
+    assert run(scenario) == ["cevap"] * 5
+    assert upstream.calls == 1
+    assert app.inflight_calls == {}
+
+
+def test_different_keys_are_not_coalesced():
+    upstream = Upstream()
+
+    async def scenario():
+        upstream.release = asyncio.Event()
+        upstream.release.set()
+        return await asyncio.gather(app.single_flight("test", "a", upstream), app.single_flight("test", "b", upstream))
+
+    run(scenario)
+    assert upstream.calls == 2
+
+
+def test_finished_call_is_not_reused():
+    upstream = Upstream()
+
+    async def scenario():
+        upstream.release = asyncio.Event()
+        upstream.release.set()
+        await app.single_flight("test", "k", upstream)
+        await app.single_flight("test", "k", upstream)
+
+    run(scenario)
+    assert upstream.calls == 2
+
+
+def test_error_reaches_every_waiter():
+    upstream = Upstream(error=RuntimeError("upstream düştü"))
+
+    async def scenario():
+        upstream.release = asyncio.Event()
+        waiters = [asyncio.ensure_future(app.single_flight("test", "k", upstream)) for _ in range(3)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await asyncio.gather(*waiters, return_exceptions=True)
+
+    results = run(scenario)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert upstream.calls == 1
+    assert app.inflight_calls == {}
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    upstream = Upstream()
+
+    async def scenario():
+        upstream.release = asyncio.Event()
+        leader = asyncio.ensure_future(app.single_flight("test", "k", upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(app.single_flight("test", "k", upstream))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert run(scenario) == "cevap"
+    assert upstream.calls == 1
+
+
+def test_disabled_single_flight_calls_every_time(monkeypatch):
+    monkeypatch.setattr(app, "SINGLE_FLIGHT_ENABLED", False)
+    upstream = Upstream()
+
+    async def scenario():
+        upstream.release = asyncio.Event()
+        upstream.release.set()
+        return await asyncio.gather(*(app.single_flight("test", "k", upstream) for _ in range(3)))
+
+    assert run(scenario) == ["cevap"] * 3
+    assert upstream.calls == 3
@@ -0,0 +1,84 @@
+"""JSON tarayıcı, şemaya doğrulama ve tek seferlik onarım çağrısı testleri"""
+import asyncio
+from typing import List
+
+from pydantic import BaseModel
+
+import app
+
+
+class Answer(BaseModel):
+    message: str
+    ids: List[int] = []
+
+
+def test_scanner_ignores_braces_inside_strings():
+    text = 'Cevap: {"message": "a { b } \\" }", "ids": [1]} sonra'
+    assert app.extract_json(text) == '{"message": "a { b } \\" }", "ids": [1]}'
+
+
+def test_scanner_finds_nested_and_multiple_objects():
+    text = 'x {"a": {"b": 1}} y {"c": 2}'
+    assert app.JsonObjectScanner().feed(text) == ['{"a": {"b": 1}}', '{"c": 2}']
+
+
+def test_scanner_joins_objects_across_chunks():
+    scanner = app.JsonObjectScanner()
+    chunks = ['önce {"message": "x\\', '"y}", "ids"', ': [1, 2]', '} sonra {"m', 'essage": "z"}']
+    completed = [obj for chunk in chunks for obj in scanner.feed(chunk)]
+    assert completed == ['{"message": "x\\"y}", "ids": [1, 2]}', '{"message": "z"}']
+
+
+def test_extract_json_without_object():
+    assert app.extract_json("JSON yok") is None
+    assert app.extract_json('{"acik": ') is None
+    assert app.extract_json(None) is None
+
+
+def test_parse_structured_skips_objects_that_do_not_match_schema():
+    text = '{"baska": 1} ardından {"message": "tamam", "ids": [3]}'
+    assert app.parse_structured(text, Answer) == Answer(message="tamam", ids=[3])
+    assert app.parse_structured('{"message": 5}', Answer) is None
+    assert app.parse_structured("", Answer) is None
+
+
+def structured_call(monkeypatch, replies):
+    calls = []
+
+    async def fake_llm(messages, max_tokens=300, priority="standard", response_format=None):
+        calls.append(messages)
+        return replies[len(calls) - 1]
+
+    monkeypatch.setattr(app, "call_local_llm", fake_llm)
+    prompt = app.PromptCall().add_text("user", "soru")
+    result = asyncio.run(app.call_structured_llm(prompt, Answer, 100))
+    return result, calls
+
+
+def test_valid_reply_needs_no_repair(monkeypatch):
+    (parsed, raw), calls = structured_call(monkeypatch, ['Tabii: {"message": "selam"}'])
+    assert parsed == Answer(message="selam")
+    assert raw == 'Tabii: {"message": "selam"}'
+    assert len(calls) == 1
+
+
+def test_broken_reply_is_repaired_once(monkeypatch):
+    before = app.STRUCTURED_OUTPUTS.values.get(("Answer", "repaired"), 0)
+    (parsed, raw), calls = structured_call(monkeypatch, ['{"message": "selam", ', '{"message": "selam"}'])
+    assert parsed == Answer(message="selam")
+    assert raw == '{"message": "selam", '
+    assert len(calls) == 2
+    assert '{"message": "selam", ' in calls[1].messages[-1]["content"]
+    assert app.STRUCTURED_OUTPUTS.values[("Answer", "repaired")] == before + 1
+
+
+def test_failed_repair_returns_none(monkeypatch):
+    (parsed, raw), calls = structured_call(monkeypatch, ["düz metin", "yine düz metin"])
+    assert parsed is None and raw == "düz metin"
+    assert len(calls) == 2
+
+
+def test_empty_reply_skips_repair(monkeypatch):
+    (parsed, raw), calls = structured_call(monkeypatch, [None])
+    assert (parsed, raw) == (None, None)
+    assert len(calls) == 1
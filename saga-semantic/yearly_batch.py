@@ -0,0 +1,291 @@
+"""
+Saga AI - Toplu yıllık özet (Wrapped) üretimi
+NDJSON dosyasındaki her YearlySummaryRequest satırı için anlatı üretir. Bir Groq
+çağrısına birden çok kullanıcı paketlenir, dakikalık istek/token ve günlük istek
+bütçesine uyulur. Başarısız, zaman aşımına uğrayan veya cevapta eksik kalan kullanıcılar
+generate_fallback_narrative ile tamamlanır.
+
+Kullanım:
+    python yearly_batch.py --input users_2024.ndjson --out summaries_2024.ndjson
+    python yearly_batch.py --input users_2024.ndjson --out summaries_2024.ndjson --retry-fallbacks
+
+Çıktı (NDJSON), her satır:
+    {"line": 17, "kullanici_adi": "...", "yil": 2024, "title": "...", "narrative": "...", "source": "llm"}
+
+Çıktı dosyası aynı zamanda checkpoint'tir: yeniden çalıştırıldığında işlenmiş satırlar
+atlanır. --retry-fallbacks ile yedek anlatı almış satırlar yeniden denenir; aynı satır
+için dosyadaki son kayıt geçerlidir. Günlük istek limiti dolarsa iş durur, ertesi gün
+aynı komutla kaldığı yerden devam eder.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from pydantic import BaseModel, ValidationError
+
+from app import (
+    GROQ_API_KEY, GROQ_API_URL, GROQ_MODEL, GROQ_RPM, GROQ_TPM, PROMPTS, YEARLY_STYLE_RULES,
+    PromptCall, TokenBucket, YearlySummaryRequest, generate_fallback_narrative, parse_structured,
+    yearly_stats_block, yearly_summary_title,
+)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Aynı Groq anahtarını canlı servis de kullanır: iş dakikalık limitlerin sadece bu payını harcar
+BATCH_GROQ_SHARE = float(os.environ.get("BATCH_GROQ_SHARE", "0.5"))
+
+# Kullanıcı blokları en sonda: talimat kısmı her çağrıda aynı prefix
+PROMPTS.register(
+    "yearly_batch_user",
+    "Sen bir medya asistanısın. Aşağıdaki her kullanıcı için yıllık izleme/okuma istatistiklerini Spotify Wrapped "
+    "tarzında, eğlenceli ve samimi bir dille anlat. Türkçe yaz. Her özet sadece kendi kullanıcısının istatistiklerine "
+    "dayansın.\n\nHer kullanıcı için: " + YEARLY_STYLE_RULES + "\n\nSadece JSON formatında yanıt ver:\n"
+    '{"ozetler": [{"id": 12, "narrative": "..."}]}\n\n${users}'
+)
+
+
+def read_requests(path: str) -> Tuple[List[Tuple[int, YearlySummaryRequest]], int]:
+    """(satır no, istek) listesi ve geçersiz satır sayısı"""
+    rows, invalid = [], 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append((line_no, YearlySummaryRequest(**json.loads(line))))
+            except (json.JSONDecodeError, ValidationError, TypeError) as e:
+                invalid += 1
+                print(f"⚠️ Satır {line_no} geçersiz, atlanıyor: {str(e).splitlines()[0]}")
+    return rows, invalid
+
+
+def read_checkpoint(path: str) -> Dict[int, str]:
+    """Çıktı dosyasından satır no -> son kaydın kaynağı (llm/fallback)"""
+    done: Dict[int, str] = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Yarım yazılmış son satır
+                done[record["line"]] = record["source"]
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def batch_prompt(chunk: List[Tuple[int, YearlySummaryRequest]]) -> PromptCall:
+    """Birden çok kullanıcı için tek prompt; cevap satır no ile eşleştirilir"""
+    users = "\n\n".join(f"### id: {line_no}\n{yearly_stats_block(request)}" for line_no, request in chunk)
+    return PromptCall().add("system", "yearly_system").add("user", "yearly_batch_user", users=users)
+
+
+class BatchNarrative(BaseModel):
+    id: int
+    narrative: str
+
+
+class BatchOutput(BaseModel):
+    ozetler: List[dict] = []
+
+
+def parse_narratives(text: Optional[str]) -> Dict[int, str]:
+    """LLM cevabından id -> anlatı; bozuk veya eksik girdiler atlanır (o kullanıcılar yedeğe düşer)"""
+    output = parse_structured(text, BatchOutput)
+    if output is None:
+        return {}
+    narratives = {}
+    for entry in output.ozetler:
+        try:
+            item = BatchNarrative.model_validate(entry)
+        except ValidationError:
+            continue
+        if item.narrative.strip():
+            narratives[item.id] = item.narrative.strip()
+    return narratives
+
+
+class RateBudget:
+    """
+    Dakikalık istek/token ve günlük istek bütçesi; yetmiyorsa bekler.
+    share, dakikalık limitlerin bu işe ayrılan payıdır (kalanı canlı servise kalır).
+    """
+
+    def __init__(self, rpm: int, tpm: int, daily_requests: int, share: float = BATCH_GROQ_SHARE):
+        self.requests = TokenBucket(max(1.0, rpm * share))
+        self.tokens = TokenBucket(max(1.0, tpm * share))
+        self.daily_left = daily_requests
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, cost: int) -> bool:
+        """Bütçe açılınca düş ve True dön; günlük limit dolduysa False"""
+        async with self.lock:
+            if self.daily_left <= 0:
+                return False
+            while True:
+                self.requests.refill()
+                self.tokens.refill()
+                wait = max(self.requests.seconds_until(1), self.tokens.seconds_until(cost))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.requests.level -= 1
+            self.tokens.level -= cost
+            self.daily_left -= 1
+            return True
+
+    def settle(self, charged: int, used: int):
+        """Çağrı bitti: tahmini token maliyetini Groq'un bildirdiği gerçek kullanıma göre düzelt"""
+        self.tokens.refill()
+        self.tokens.level = min(self.tokens.capacity, self.tokens.level + charged - used)
+
+    def pause(self, seconds: float):
+        """429 sonrası: istek bütçesini Retry-After kadar geriye it"""
+        self.requests.refill()
+        self.requests.level = min(self.requests.level, -seconds * self.requests.rate)
+
+
+class BatchJob:
+    def __init__(self, args, out_file):
+        self.args = args
+        self.out_file = out_file
+        self.budget = RateBudget(args.rpm, args.tpm, args.daily_requests, args.share)
+        self.stats = {"llm": 0, "fallback": 0, "calls": 0, "failed_calls": 0}
+        self.daily_cap_hit = False
+
+    async def complete(self, client: httpx.AsyncClient, prompt: PromptCall, max_tokens: int) -> Optional[str]:
+        """Bütçe dahilinde tek Groq çağrısı, geçici hatalarda tekrar"""
+        cost = prompt.tokens + max_tokens
+        for attempt in range(self.args.retries + 1):
+            if not await self.budget.acquire(cost):
+                self.daily_cap_hit = True
+                return None
+            self.stats["calls"] += 1
+            try:
+                response = await client.post(
+                    GROQ_API_URL,
+                    json={
+                        "model": GROQ_MODEL,
+                        "messages": prompt.messages,
+                        "max_tokens": max_tokens,
+                        "temperature": 0.7,
+                        "response_format": {"type": "json_object"},
+                    },
+                    headers={"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"},
+                )
+            except httpx.HTTPError as e:
+                print(f"⚠️ Groq çağrı hatası (deneme {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+                continue
+            if response.status_code == 200:
+                result = response.json()
+                used = (result.get("usage") or {}).get("total_tokens")
+                if used is not None:
+                    self.budget.settle(cost, int(used))
+                return result["choices"][0]["message"]["content"]
+            if response.status_code not in RETRYABLE_STATUS:
+                print(f"❌ Groq API hatası: {response.status_code} - {response.text[:200]}")
+                return None
+            retry_after = float(response.headers.get("retry-after", 2 ** attempt))
+            if response.status_code == 429:
+                self.budget.pause(retry_after)
+            else:
+                await asyncio.sleep(retry_after)
+        return None
+
+    async def process(self, client: httpx.AsyncClient, chunk: List[Tuple[int, YearlySummaryRequest]]):
+        text = await self.complete(client, batch_prompt(chunk), self.args.tokens_per_user * len(chunk))
+        narratives = parse_narratives(text)
+        if text is None and self.daily_cap_hit:
+            return  # Günlük limit: bu satırlar checkpoint'e yazılmaz, sonraki çalıştırmada denenir
+        if text is None:
+            self.stats["failed_calls"] += 1
+        for line_no, request in chunk:
+            narrative = narratives.get(line_no)
+            source = "llm" if narrative else "fallback"
+            record = {
+                "line": line_no,
+                "kullanici_adi": request.kullanici_adi,
+                "yil": request.yil,
+                "title": yearly_summary_title(request, generated=narrative is not None),
+                "narrative": narrative or generate_fallback_narrative(request),
+                "source": source,
+            }
+            self.stats[source] += 1
+            self.out_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.out_file.flush()
+
+    async def run(self, chunks: List[List[Tuple[int, YearlySummaryRequest]]]):
+        queue: asyncio.Queue = asyncio.Queue()
+        for chunk in chunks:
+            queue.put_nowait(chunk)
+        started = time.perf_counter()
+        processed = 0
+
+        async def worker(client: httpx.AsyncClient):
+            nonlocal processed
+            while not queue.empty() and not self.daily_cap_hit:
+                chunk = queue.get_nowait()
+                await self.process(client, chunk)
+                processed += 1
+                done = self.stats["llm"] + self.stats["fallback"]
+                if processed % self.args.progress_every == 0:
+                    elapsed = time.perf_counter() - started
+                    print(f"🔄 {done} kullanıcı ({done / elapsed:.1f}/sn), {self.stats['fallback']} yedek anlatı")
+
+        async with httpx.AsyncClient(timeout=self.args.timeout) as client:
+            await asyncio.gather(*(worker(client) for _ in range(self.args.concurrency)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Yıllık özetleri toplu üret (NDJSON -> NDJSON)")
+    parser.add_argument("--input", required=True, help="YearlySummaryRequest satırları (NDJSON)")
+    parser.add_argument("--out", required=True, help="Sonuç dosyası (NDJSON, checkpoint olarak da kullanılır)")
+    parser.add_argument("--users-per-call", type=int, default=8, help="Bir LLM çağrısına paketlenen kullanıcı sayısı")
+    parser.add_argument("--tokens-per-user", type=int, default=300, help="Kullanıcı başına ayrılan çıktı token'ı")
+    parser.add_argument("--max-output-tokens", type=int, default=4096, help="Modelin tek cevapta üretebileceği en fazla token")
+    parser.add_argument("--rpm", type=int, default=GROQ_RPM, help="Dakikalık istek limiti")
+    parser.add_argument("--tpm", type=int, default=GROQ_TPM, help="Dakikalık token limiti")
+    parser.add_argument("--share", type=float, default=BATCH_GROQ_SHARE,
+                        help="Dakikalık limitlerin bu işe ayrılan payı (0-1], kalanı canlı servise kalır")
+    parser.add_argument("--daily-requests", type=int, default=1000, help="Günlük istek limiti (bu çalıştırma için)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Aynı anda açık Groq çağrısı")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Çağrı başına zaman aşımı (sn)")
+    parser.add_argument("--retries", type=int, default=2, help="429/5xx/bağlantı hatasında tekrar sayısı")
+    parser.add_argument("--retry-fallbacks", action="store_true", help="Yedek anlatı almış satırları yeniden dene")
+    parser.add_argument("--progress-every", type=int, default=10, help="Kaç pakette bir ilerleme yazılsın")
+    args = parser.parse_args()
+    if not 0 < args.share <= 1:
+        raise SystemExit("❌ --share 0 ile 1 arasında olmalı")
+
+    if not GROQ_API_KEY:
+        raise SystemExit("❌ GROQ_API_KEY tanımlı değil")
+
+    rows, invalid = read_requests(args.input)
+    done = read_checkpoint(args.out)
+    pending = [(line_no, request) for line_no, request in rows
+               if line_no not in done or (args.retry_fallbacks and done[line_no] == "fallback")]
+    # Çıktı token limiti paket boyutunu sınırlar; token bütçesi de tek çağrıyı kaldırabilmeli
+    users_per_call = max(1, min(args.users_per_call, args.max_output_tokens // args.tokens_per_user,
+                                int(args.tpm * args.share) // (args.tokens_per_user * 2)))
+    chunks = [pending[i:i + users_per_call] for i in range(0, len(pending), users_per_call)]
+    print(f"📦 {len(rows)} kullanıcı, {len(rows) - len(pending)} tamamlanmış, {len(pending)} işlenecek "
+          f"({len(chunks)} çağrı, çağrı başına {users_per_call} kullanıcı), {invalid} geçersiz satır")
+
+    with open(args.out, "a", encoding="utf-8") as out_file:
+        job = BatchJob(args, out_file)
+        asyncio.run(job.run(chunks))
+
+    print(f"✅ LLM: {job.stats['llm']}, yedek anlatı: {job.stats['fallback']}, "
+          f"çağrı: {job.stats['calls']} ({job.stats['failed_calls']} başarısız)")
+    if job.daily_cap_hit:
+        print("⏸️ Günlük istek limiti doldu; kalan satırlar için aynı komutu sonra tekrar çalıştırın")
+
+
+if __name__ == "__main__":
+    main()